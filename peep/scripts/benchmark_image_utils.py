@@ -0,0 +1,409 @@
+"""
+Benchmark the vectorized image conversion functions in peep.src.image_utils
+against the original pixel-by-pixel (or matplotlib-based) implementations,
+and check that they give identical output.
+
+Usage
+=====
+
+python -m peep.scripts.benchmark_image_utils --npix 1024
+
+The functions that read tif files are benchmarked on randomly generated
+images of size npix x npix, while the binary-image functions are benchmarked
+on the .png files in peep/testdata.
+Note that the pixel-by-pixel implementations are slow - with the default
+image size of 512x512 they take a few tens of seconds.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+from PIL import Image
+
+from peep.src.image_utils import (
+    combine_tif,
+    compare_binary_images,
+    convert_to_bw,
+    create_count_heatmap,
+    image_all_same_colour,
+    image_from_array,
+    invert_binary_image,
+    scale_tif,
+)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), "..", "testdata")
+
+#######################################################################
+# Reference (pixel-by-pixel) implementations, as they were before
+# being vectorized.
+#######################################################################
+
+
+def combine_tif_loop(band_dict):
+    for v in band_dict.values():
+        v["min_val"] = sys.maxsize
+        v["max_val"] = -1 * sys.maxsize
+        v["pix_vals"] = []
+
+    for col in band_dict.keys():
+        pix = cv.imread(band_dict[col]["filename"], cv.IMREAD_ANYDEPTH).transpose()
+        # use python ints, to get the same arithmetic as the scalar operations
+        # on older versions of numpy.
+        pix = pix.astype(np.int64)
+        for ix in range(pix.shape[0]):
+            for iy in range(pix.shape[1]):
+                if pix[ix, iy] > band_dict[col]["max_val"]:
+                    band_dict[col]["max_val"] = pix[ix, iy]
+                elif pix[ix, iy] < band_dict[col]["min_val"]:
+                    band_dict[col]["min_val"] = pix[ix, iy]
+        band_dict[col]["pix_vals"] = pix
+    overall_max = max((band_dict[col]["max_val"] for col in ["r", "g", "b"]))
+
+    def get_pix_val(ix, iy, col):
+        return max(
+            0,
+            int(int(band_dict[col]["pix_vals"][ix, iy]) * 255 / (int(overall_max) + 1)),
+        )
+
+    new_img = Image.new("RGB", pix.shape)
+    for ix in range(new_img.size[0]):
+        for iy in range(new_img.size[1]):
+            new_img.putpixel(
+                (ix, iy), tuple(get_pix_val(ix, iy, col) for col in ["r", "g", "b"])
+            )
+    return new_img
+
+
+def scale_tif_loop(input_filename):
+    max_val = -1 * sys.maxsize
+    min_val = sys.maxsize
+    pix = cv.imread(input_filename, cv.IMREAD_ANYDEPTH).transpose()
+    pix = pix.astype(np.float64)
+    for ix in range(pix.shape[0]):
+        for iy in range(pix.shape[1]):
+            if pix[ix, iy] > max_val:
+                max_val = pix[ix, iy]
+            elif pix[ix, iy] < min_val:
+                min_val = pix[ix, iy]
+
+    def get_pix_val(ix, iy):
+        return int((pix[ix, iy] + 1) / 2 * 255)
+
+    new_img = Image.new("RGB", pix.shape)
+    for iy in range(new_img.size[1]):
+        for ix in range(new_img.size[0]):
+            new_img.putpixel(
+                (ix, iy), tuple(get_pix_val(ix, iy) for col in ["r", "g", "b"])
+            )
+    return new_img
+
+
+def create_count_heatmap_matplotlib(input_filename):
+    import matplotlib
+
+    matplotlib.use("PS")
+    import matplotlib.pyplot as plt
+
+    pix = cv.imread(input_filename, cv.IMREAD_ANYDEPTH)
+
+    image_plt = plt.matshow(pix)
+    scaled_img = (image_plt.get_array() - image_plt.get_clim()[0]) / (
+        image_plt.get_clim()[1] - image_plt.get_clim()[0]
+    )
+    new_image = Image.fromarray(np.uint8(image_plt.get_cmap()(scaled_img) * 255))
+    # close the figure here (the original didn't), so as not to penalize the
+    # remaining repetitions with an ever-growing number of open figures.
+    plt.close("all")
+    return new_image
+
+
+def image_from_array_loop(input_array, output_size=None, sel_val=200):
+    size_x, size_y = input_array.shape
+    new_img = Image.new("RGB", (size_x, size_y))
+    for ix in range(size_x):
+        for iy in range(size_y):
+            val = int(input_array[ix, iy])
+
+            if val == sel_val:
+                new_img.putpixel((ix, iy), (0, val, val))
+            else:
+                new_img.putpixel((ix, iy), (val, val, val))
+    if output_size:
+        new_img = new_img.resize((output_size, output_size), Image.LANCZOS)
+    return new_img
+
+
+def invert_binary_image_loop(image):
+    new_img = Image.new("RGB", image.size)
+    pix = image.load()
+    for ix in range(image.size[0]):
+        for iy in range(image.size[1]):
+            if sum(pix[ix, iy]) == 0:
+                new_img.putpixel((ix, iy), (255, 255, 255))
+            else:
+                new_img.putpixel((ix, iy), (0, 0, 0))
+    return new_img
+
+
+def convert_to_bw_loop(input_image, threshold, invert=False):
+    pix = input_image.load()
+    new_img = Image.new("RGB", input_image.size)
+    for ix in range(input_image.size[0]):
+        for iy in range(input_image.size[1]):
+            p = pix[ix, iy]
+            try:
+                total = 0
+                for col in p:
+                    total += col
+            except:
+                total = p
+            if (invert and (total > threshold)) or (
+                (not invert) and (total < threshold)
+            ):
+                new_img.putpixel((ix, iy), (255, 255, 255))
+            else:
+                new_img.putpixel((ix, iy), (0, 0, 0))
+    return new_img
+
+
+def image_all_same_colour_loop(image, colour=(255, 255, 255), threshold=0.99):
+    num_total = image.size[0] * image.size[1]
+    num_different = 0
+    pix = image.load()
+    for ix in range(image.size[0]):
+        for iy in range(image.size[1]):
+            if pix[ix, iy] != colour:
+                num_different += 1
+                if 1.0 - float(num_different / num_total) < threshold:
+                    return False
+    return True
+
+
+def compare_binary_images_loop(image1, image2):
+    if not image1.size == image2.size:
+        return 0.0
+    pix1 = image1.load()
+    pix2 = image2.load()
+    num_same = 0
+    num_total = image1.size[0] * image1.size[1]
+    for ix in range(image1.size[0]):
+        for iy in range(image1.size[1]):
+            if pix1[ix, iy] == pix2[ix, iy]:
+                num_same += 1
+    return float(num_same / num_total)
+
+
+#######################################################################
+
+
+def write_test_bands(output_dir, npix, seed=0):
+    """
+    Write three random 16-bit single-band tif files, similar to the
+    Sentinel-2 bands downloaded from GEE.
+    """
+    rng = np.random.default_rng(seed)
+    band_dict = {}
+    for col, band in zip("rgb", ["B4", "B3", "B2"]):
+        filename = os.path.join(output_dir, "download.{}.tif".format(band))
+        pix = rng.integers(0, 4000, size=(npix, npix)).astype(np.uint16)
+        cv.imwrite(filename, pix)
+        band_dict[col] = {"band": band, "filename": filename}
+    return band_dict
+
+
+def write_test_ndvi(output_dir, npix, seed=0):
+    """
+    Write a random floating-point NDVI tif file, with values in [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    filename = os.path.join(output_dir, "download.NDVI.tif")
+    pix = rng.uniform(-1, 1, size=(npix, npix)).astype(np.float32)
+    cv.imwrite(filename, pix)
+    return filename
+
+
+def write_test_count(output_dir, npix, seed=0):
+    """
+    Write a random integer COUNT tif file.
+    """
+    rng = np.random.default_rng(seed)
+    filename = os.path.join(output_dir, "download.COUNT.tif")
+    pix = rng.integers(0, 30, size=(npix, npix)).astype(np.uint16)
+    cv.imwrite(filename, pix)
+    return filename
+
+
+def time_function(func, *args, n_repeats=1):
+    """
+    Return the result of the function call, and the fastest time
+    over n_repeats calls.
+    """
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def benchmark_combine_tif(npix, n_repeats):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        band_dict = write_test_bands(tmpdir, npix)
+        new_img, t_new = time_function(combine_tif, band_dict, n_repeats=n_repeats)
+        old_img, t_old = time_function(combine_tif_loop, band_dict)
+    identical = np.array_equal(np.array(new_img), np.array(old_img))
+    return t_old, t_new, identical
+
+
+def benchmark_scale_tif(npix, n_repeats):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ndvi_filename = write_test_ndvi(tmpdir, npix)
+        new_img, t_new = time_function(scale_tif, ndvi_filename, n_repeats=n_repeats)
+        old_img, t_old = time_function(scale_tif_loop, ndvi_filename)
+    identical = np.array_equal(np.array(new_img), np.array(old_img))
+    return t_old, t_new, identical
+
+
+def benchmark_create_count_heatmap(npix, n_repeats):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        count_filename = write_test_count(tmpdir, npix)
+        new_img, t_new = time_function(
+            create_count_heatmap, count_filename, n_repeats=n_repeats
+        )
+        old_img, t_old = time_function(
+            create_count_heatmap_matplotlib, count_filename, n_repeats=n_repeats
+        )
+    identical = np.array_equal(np.array(new_img), np.array(old_img))
+    return t_old, t_new, identical
+
+
+def find_testdata_pngs():
+    """
+    Return a list of the .png files in the testdata directory (and subdirectories).
+    """
+    png_files = []
+    for root, dirs, files in os.walk(TESTDATA_DIR):
+        png_files += [os.path.join(root, f) for f in files if f.endswith(".png")]
+    return sorted(png_files)
+
+
+def results_identical(old_results, new_results):
+    for old_result, new_result in zip(old_results, new_results):
+        if isinstance(old_result, Image.Image):
+            if not np.array_equal(np.array(old_result), np.array(new_result)):
+                return False
+        elif old_result != new_result:
+            return False
+    return True
+
+
+def benchmark_testdata_pngs(n_repeats):
+    """
+    Run the binary-image functions over all the .png files in the testdata
+    directory, with both the pixel-loop and vectorized implementations.
+
+    Returns
+    =======
+    results: list of tuples (function_name, t_old, t_new, identical)
+    """
+    images = [Image.open(f) for f in find_testdata_pngs()]
+    for image in images:
+        image.load()
+    rgb_images = [image for image in images if image.mode == "RGB"]
+    arrays = [np.array(image.convert("L")) for image in images]
+    image_pairs = list(zip(images[:-1], images[1:]))
+
+    benchmarks = [
+        (
+            "convert_to_bw",
+            lambda: [convert_to_bw_loop(im, 470) for im in images],
+            lambda: [convert_to_bw(im, 470) for im in images],
+        ),
+        (
+            "invert_binary_image",
+            lambda: [invert_binary_image_loop(im) for im in rgb_images],
+            lambda: [invert_binary_image(im) for im in rgb_images],
+        ),
+        (
+            "image_from_array",
+            lambda: [image_from_array_loop(a) for a in arrays],
+            lambda: [image_from_array(a) for a in arrays],
+        ),
+        (
+            "image_all_same_colour",
+            lambda: [image_all_same_colour_loop(im, (0, 0, 0)) for im in images],
+            lambda: [image_all_same_colour(im, (0, 0, 0)) for im in images],
+        ),
+        (
+            "compare_binary_images",
+            lambda: [compare_binary_images_loop(*pair) for pair in image_pairs],
+            lambda: [compare_binary_images(*pair) for pair in image_pairs],
+        ),
+    ]
+    results = []
+    for name, old_func, new_func in benchmarks:
+        old_results, t_old = time_function(old_func, n_repeats=n_repeats)
+        new_results, t_new = time_function(new_func, n_repeats=n_repeats)
+        results.append(
+            (name, t_old, t_new, results_identical(old_results, new_results))
+        )
+    return results
+
+
+def print_result(name, t_old, t_new, identical):
+    print(
+        "{:<25} loop: {:8.3f}s   vectorized: {:8.4f}s   speedup: {:8.1f}x   identical: {}".format(
+            name, t_old, t_new, t_old / t_new, identical
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark vectorized image_utils functions against pixel loops"
+    )
+    parser.add_argument(
+        "--npix", help="size of (square) test images", type=int, default=512
+    )
+    parser.add_argument(
+        "--n_repeats",
+        help="number of times to run the vectorized functions",
+        type=int,
+        default=5,
+    )
+    args = parser.parse_args()
+
+    all_identical = True
+    t_old, t_new, identical = benchmark_combine_tif(args.npix, args.n_repeats)
+    print_result("combine_tif", t_old, t_new, identical)
+    all_identical &= identical
+
+    t_old, t_new, identical = benchmark_scale_tif(args.npix, args.n_repeats)
+    print_result("scale_tif", t_old, t_new, identical)
+    all_identical &= identical
+
+    t_old, t_new, identical = benchmark_create_count_heatmap(args.npix, args.n_repeats)
+    print_result("create_count_heatmap", t_old, t_new, identical)
+    all_identical &= identical
+
+    print(
+        "\nBinary-image functions, over all {} .png files in {}".format(
+            len(find_testdata_pngs()), os.path.normpath(TESTDATA_DIR)
+        )
+    )
+    for name, t_old, t_new, identical in benchmark_testdata_pngs(args.n_repeats):
+        print_result(name, t_old, t_new, identical)
+        all_identical &= identical
+
+    if not all_identical:
+        print("WARNING: vectorized output differs from the pixel loop output")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+"""
+Rebuild the run manifest (see peep/src/run_manifest.py) from an existing
+output tree, so that a pipeline with manifest_file set knows which dates
+are already done.
+
+Usage
+=====
+
+peep_rebuild_manifest --manifest_file <path> --output_location <output dir>
+"""
+
+import argparse
+
+from peep.src.run_manifest import get_run_manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild a run manifest from an existing output tree"
+    )
+    parser.add_argument("--manifest_file", help="Path to the manifest", required=True)
+    parser.add_argument(
+        "--output_location", help="Top-level output location", required=True
+    )
+    parser.add_argument(
+        "--output_location_type",
+        help="Where the output is stored",
+        choices=["local", "azure"],
+        default="local",
+    )
+    args = parser.parse_args()
+    n_artifacts = get_run_manifest(args.manifest_file).rebuild(
+        args.output_location, args.output_location_type
+    )
+    print("Recorded {} artifacts in {}".format(n_artifacts, args.manifest_file))
+
+
+if __name__ == "__main__":
+    main()
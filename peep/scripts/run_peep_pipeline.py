@@ -13,16 +13,9 @@ import sys
 import time
 from shutil import copyfile
 
-import ee
-
 from peep.src.date_utils import get_date_range_for_collection
+from peep.src.download_modules import ImageDownloader, WeatherDownloader
 from peep.src.peep_pipeline import Pipeline, Sequence
-
-try:
-    from peep.src.download_modules import ImageDownloader, WeatherDownloader
-except (ee.ee_exception.EEException):
-    print("Earth Engine not initialized - will not be able to download from GEE")
-    pass
 from peep.src.processor_modules import ImageProcessor, WeatherImageToJSON
 
 
@@ -64,6 +57,9 @@ def build_pipeline(config_file, from_cache=False):
     # if an id of a row in coordinates.py has been specified, add it here
     if "bounds_id" in vars(config):
         p.bounds_id = config.bounds_id
+    # if a run manifest has been specified, all the modules will use it
+    if "manifest_file" in vars(config):
+        p.manifest_file = config.manifest_file
     # if we have a pattern_type description, add it to the pipeline
     if "pattern_type" in vars(config):
         p.pattern_type = config.pattern_type
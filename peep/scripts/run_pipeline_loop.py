@@ -1,59 +1,157 @@
+"""
+Run the peep pipelines for all the config files in a directory.
+
+The pipelines are run in this process, on a pool of n_workers threads, so
+the packages are only imported once, and the pipelines share one Earth
+Engine initialization, HTTP session and blob storage client.  The outcome
+of each one - its exit status, how long it took, and how many module jobs
+succeeded or failed - is written to a summary table.
+
+When several pipelines are run at once, they share the batch pool, so it
+is only deleted once they have all finished.
+"""
+
 import argparse
+import functools
 import logging
-import shlex
-import subprocess
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
-from os import listdir
-from os.path import isfile, join
+
+import pandas as pd
+
+from peep.scripts.run_peep_pipeline import build_pipeline, configure_and_run_pipeline
+from peep.src.file_utils import save_table
 
 logger = logging.getLogger("peep_bulk_donwload_job")
 formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
 logger.setLevel(logging.INFO)
 
-c_handler = logging.StreamHandler()
-c_handler.setFormatter(formatter)
-f_handler = RotatingFileHandler(
-    "peep_bulk_download_job_{}.log".format(time.strftime("%Y-%m-%d_%H-%M-%S")),
-    maxBytes=5 * 1024 * 1024,
-    backupCount=10,
-)
-f_handler.setFormatter(formatter)
-
-logger.addHandler(f_handler)
-logger.addHandler(c_handler)
 
+def get_config_files(config_directory):
+    """
+    Full paths of the config (.py) files in a directory, in name order.
+    """
+    return sorted(
+        os.path.join(config_directory, filename)
+        for filename in os.listdir(config_directory)
+        if filename.endswith(".py")
+        and os.path.isfile(os.path.join(config_directory, filename))
+    )
 
-def run_pipeline(config_directory):
-    # Directory containing input files
-
-    # Get the full paths to the files in the input dir
-    full_paths = [
-        join(config_directory, f)
-        for f in listdir(config_directory)
-        if isfile(join(config_directory, f))
-    ]
-
-    # Build a list of commands to reproject each file individually
-    cmds = []
-    for input_fpath in full_paths:
-        safe_input = shlex.quote(str(input_fpath))
-
-        cmds.append(f"peep_run_pipeline --config_file {safe_input}")
 
-    # Now run those commands (This might be expensive)
+def get_run_counts(pipeline):
+    """
+    Total numbers of succeeded, failed and incomplete jobs over all the
+    modules in a pipeline.
+    """
+    counts = {"succeeded": 0, "failed": 0, "incomplete": 0}
+    if pipeline is None:
+        return counts
+    for sequence in pipeline.sequences:
+        for module in sequence.modules:
+            for key in counts:
+                counts[key] += module.run_status.get(key, 0)
+    return counts
+
+
+def run_one_pipeline(config_file, from_cache=False, delete_batch_pool=True):
+    """
+    Build and run the pipeline for one config file, catching any exception.
+    If delete_batch_pool is False, the batch pool is left for the caller
+    to delete.
+
+    Returns
+    =======
+    dict with the config_file, exit_status (0 if it ran, 1 if it raised an
+    exception), duration in seconds, job counts from get_run_counts, whether
+    it used batch, and the error message if there was one.
+    """
+    logger.info("Running pipeline for {}".format(config_file))
+    start_time = time.time()
+    pipeline = None
+    error = ""
+    try:
+        pipeline = build_pipeline(config_file, from_cache)
+        pipeline.delete_batch_pool = delete_batch_pool
+        configure_and_run_pipeline(pipeline)
+    except Exception as e:
+        logger.exception("Pipeline for {} failed".format(config_file))
+        error = "{}: {}".format(type(e).__name__, e)
+    summary = {
+        "config_file": config_file,
+        "exit_status": 1 if error else 0,
+        "duration": round(time.time() - start_time, 1),
+    }
+    summary.update(get_run_counts(pipeline))
+    summary["batch"] = pipeline is not None and pipeline.has_batch_job()
+    summary["error"] = error
+    return summary
+
+
+def run_pipelines(config_files, n_workers=1, from_cache=False):
+    """
+    Run the pipelines for a list of config files, up to n_workers at once.
+    If more than one at once, the batch pool they share is deleted after
+    they have all finished, rather than by each pipeline.
+
+    Returns
+    =======
+    pandas DataFrame with one row per config file, as given by run_one_pipeline.
+    """
+    with ThreadPoolExecutor(
+        max_workers=n_workers, thread_name_prefix="pipeline"
+    ) as executor:
+        summaries = list(
+            executor.map(
+                functools.partial(
+                    run_one_pipeline,
+                    from_cache=from_cache,
+                    delete_batch_pool=n_workers == 1,
+                ),
+                config_files,
+            )
+        )
+    if n_workers > 1 and any(summary["batch"] for summary in summaries):
+        from peep.src import batch_utils
+
+        logger.info("Deleting the batch pool")
+        batch_utils.delete_pool()
+    return pd.DataFrame(
+        summaries,
+        columns=[
+            "config_file",
+            "exit_status",
+            "duration",
+            "succeeded",
+            "failed",
+            "incomplete",
+            "batch",
+            "error",
+        ],
+    )
 
-    failed = 0
-    for cmd in cmds:
-        logger.info(f"Running gee download using the command: {cmd}")
-        try:
-            subprocess.run(cmd, shell=True)
 
-        except subprocess.SubprocessError as e:
-            failed += 1
-            logger.error(f"Download using the command: {cmd} failed")
+def run_pipeline(config_directory, n_workers=1, summary_file=None, from_cache=False):
+    """
+    Run the pipelines for all the config files in config_directory, and
+    write the summary table to summary_file (.csv or .parquet) if given.
 
-    return failed
+    Returns
+    =======
+    int, the number of pipelines that failed.
+    """
+    summary = run_pipelines(get_config_files(config_directory), n_workers, from_cache)
+    if summary_file:
+        save_table(
+            summary,
+            os.path.dirname(summary_file) or ".",
+            os.path.basename(summary_file),
+        )
+        logger.info("Wrote summary of {} runs to {}".format(len(summary), summary_file))
+    return int((summary["exit_status"] != 0).sum())
 
 
 def main():
@@ -63,10 +161,43 @@ def main():
     parser.add_argument(
         "--config_dir", help="Path to directory with config files", required=True
     )
-
+    parser.add_argument(
+        "--n_workers",
+        help="Number of pipelines to run at once",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--summary_file",
+        help="Where to write the table of results (.csv or .parquet)",
+        default="peep_bulk_download_job_{}.csv".format(
+            time.strftime("%Y-%m-%d_%H-%M-%S")
+        ),
+    )
+    parser.add_argument(
+        "--from_cache",
+        help="Are we using cached config files to resume unfinished jobs?",
+        action="store_true",
+    )
     args = parser.parse_args()
-    n = run_pipeline(args.config_dir)
+
+    c_handler = logging.StreamHandler()
+    c_handler.setFormatter(formatter)
+    f_handler = RotatingFileHandler(
+        "peep_bulk_download_job_{}.log".format(time.strftime("%Y-%m-%d_%H-%M-%S")),
+        maxBytes=5 * 1024 * 1024,
+        backupCount=10,
+    )
+    f_handler.setFormatter(formatter)
+    logger.addHandler(f_handler)
+    logger.addHandler(c_handler)
+
+    n = run_pipeline(
+        args.config_dir, args.n_workers, args.summary_file, args.from_cache
+    )
     logger.info(f"Bulk download finished. Number of failed dowloads {n}")
+    if n > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""
+An asyncio-based engine for downloading and unpacking the zipfiles from GEE.
+
+The engine runs an event loop in a background thread, shared by everything
+in the process, so downloads started from any thread (e.g. by several time
+slices, or several Sequences, at once) are all in flight together, with one
+limit on how many are downloading at any time.  Callers can also share a
+smaller limit of their own between their downloads, e.g. one per downloader
+Module, obtained with get_limit().  The HTTP requests themselves use the
+pooled session from file_utils, and both they and the writes to disk run in
+thread pools, leaving the event loop free to schedule the rest.  Waits
+between retries don't count towards the limits.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from .file_utils import (
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_POOL_SIZE,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    get_retry_wait,
+    try_download_to_buffer,
+    unzip_buffer,
+)
+
+logger = logging.getLogger("peep_logger")
+
+_async_download_engine = None
+_async_download_engine_lock = threading.Lock()
+
+
+class AsyncDownloadEngine:
+    """
+    Download and unzip files on an event loop running in a background thread.
+    Coroutines can be awaited on the engine's own loop, or run from any
+    other thread with run().
+    """
+
+    def __init__(self, max_concurrent=DOWNLOAD_POOL_SIZE):
+        self.max_concurrent = max_concurrent
+        self.loop = asyncio.new_event_loop()
+        # owner: (max_concurrent, semaphore) for the limits from get_limit
+        self.limits = weakref.WeakKeyDictionary()
+        self.limits_lock = threading.Lock()
+        # blocking HTTP requests, at most max_concurrent at once
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="download"
+        )
+        # unzipping to disk
+        self.write_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="unzip"
+        )
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.semaphore = self.run(self.make_semaphore(max_concurrent))
+
+    async def make_semaphore(self, value):
+        """
+        Make an asyncio.Semaphore on the engine's loop - before Python 3.10,
+        a semaphore belongs to the loop of the thread it was made in, so one
+        made in the caller's thread can't be used here.
+        """
+        return asyncio.Semaphore(value)
+
+    def get_limit(self, owner, max_concurrent):
+        """
+        Return a limit of max_concurrent downloads at once, to pass to
+        download_and_unzip_all - the same one for the same owner, so that it
+        is shared by e.g. all the time slices of one downloader, but not
+        with other downloaders, even of the same name in another pipeline.
+        It applies on top of the engine's own limit, so values above that
+        have no further effect.  Must not be called from the event loop itself.
+
+        Parameters
+        ==========
+        owner: object the limit belongs to, e.g. a downloader Module.  The
+               limit is forgotten once the owner is.
+        max_concurrent: int
+        """
+        if max_concurrent > self.max_concurrent:
+            logger.warning(
+                "{}: at most {} downloads at once are possible, not {}".format(
+                    getattr(owner, "name", owner), self.max_concurrent, max_concurrent
+                )
+            )
+        with self.limits_lock:
+            if self.limits.get(owner, (None, None))[0] != max_concurrent:
+                self.limits[owner] = (
+                    max_concurrent,
+                    self.run(self.make_semaphore(max_concurrent)),
+                )
+            return self.limits[owner][1]
+
+    def run(self, coro):
+        """
+        Run a coroutine on the engine's event loop, and wait for the result.
+        Must not be called from the event loop itself.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        """
+        Stop the event loop and thread pools.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.download_executor.shutdown()
+        self.write_executor.shutdown()
+
+    async def download_to_buffer(
+        self,
+        url,
+        retries=DOWNLOAD_RETRIES,
+        backoff=DOWNLOAD_BACKOFF,
+        timeout=DOWNLOAD_TIMEOUT,
+        download_stats=None,
+        limit=None,
+    ):
+        """
+        Coroutine version of file_utils.download_to_buffer, retrying in the
+        same way.  Only the attempts themselves hold the semaphore, and the
+        limit from get_limit, if given.
+
+        Returns
+        =======
+        tempfile.TemporaryFile, positioned at the start.
+        """
+        if download_stats is not None:
+            download_stats.setdefault("retries", 0)
+            download_stats.setdefault("bytes", 0)
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                if download_stats is not None:
+                    download_stats["retries"] += 1
+                await asyncio.sleep(get_retry_wait(backoff, attempt))
+            if limit is not None:
+                await limit.acquire()
+            try:
+                async with self.semaphore:
+                    buffer, error, retryable = await self.loop.run_in_executor(
+                        self.download_executor,
+                        try_download_to_buffer,
+                        url,
+                        timeout,
+                        download_stats,
+                    )
+            finally:
+                if limit is not None:
+                    limit.release()
+            if buffer:
+                return buffer
+            if not retryable:
+                break
+        raise error
+
+    async def download_and_unzip(self, url, output_dir, file_endings=None, **kwargs):
+        """
+        Coroutine version of file_utils.download_and_unzip.
+        kwargs (retries, backoff, timeout, download_stats, limit) are passed
+        to download_to_buffer.
+
+        Returns
+        =======
+        tif_filenames: list of strings, the full paths to unpacked tif files.
+        """
+        zip_buffer = await self.download_to_buffer(url, **kwargs)
+        return await self.loop.run_in_executor(
+            self.write_executor,
+            functools.partial(unzip_buffer, zip_buffer, url, output_dir, file_endings),
+        )
+
+    async def download_and_unzip_all(
+        self, urls, output_dir, file_endings=None, download_stats=None, **kwargs
+    ):
+        """
+        Download and unzip all the urls into output_dir concurrently.
+
+        Parameters
+        ==========
+        urls: list of str
+        output_dir: str, directory to extract the files into.
+        file_endings: list of str, optional, see file_utils.download_and_unzip.
+        download_stats: dict, optional.  If given, the "retries" and "bytes"
+                        entries are increased by the totals for all the urls.
+        kwargs (retries, backoff, timeout, limit) are passed to download_to_buffer.
+
+        Returns
+        =======
+        list with the list of tif filenames for each url, or the exception
+        raised while downloading it.
+        """
+        stats = [{} for _ in urls]
+        results = await asyncio.gather(
+            *[
+                self.download_and_unzip(
+                    url, output_dir, file_endings, download_stats=url_stats, **kwargs
+                )
+                for url, url_stats in zip(urls, stats)
+            ],
+            return_exceptions=True,
+        )
+        if download_stats is not None:
+            for key in ["retries", "bytes"]:
+                download_stats[key] = download_stats.get(key, 0) + sum(
+                    url_stats.get(key, 0) for url_stats in stats
+                )
+        return results
+
+
+def get_async_download_engine(max_concurrent=DOWNLOAD_POOL_SIZE):
+    """
+    Return the AsyncDownloadEngine shared by all downloads in this process,
+    starting it on first use.  max_concurrent only has an effect the first
+    time this is called - use get_limit on the engine for a limit that can
+    differ between callers.
+    """
+    global _async_download_engine
+    with _async_download_engine_lock:
+        if _async_download_engine is None:
+            _async_download_engine = AsyncDownloadEngine(max_concurrent)
+        elif _async_download_engine.max_concurrent != max_concurrent:
+            logger.warning(
+                "The download engine already allows {} downloads at once, "
+                "not changing it to {}".format(
+                    _async_download_engine.max_concurrent, max_concurrent
+                )
+            )
+    return _async_download_engine
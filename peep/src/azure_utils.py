@@ -3,6 +3,7 @@ import json
 import os
 import re
 import tempfile
+import threading
 
 import arrow
 from azure.common import AzureMissingResourceHttpError
@@ -21,6 +22,24 @@ try:
 except:
     pass
 
+_blob_service = None
+_blob_service_lock = threading.Lock()
+
+
+def get_blob_service():
+    """
+    Return the BlockBlobService shared by everything in this process,
+    creating it on first use.
+    """
+    global _blob_service
+    with _blob_service_lock:
+        if _blob_service is None:
+            _blob_service = BlockBlobService(
+                account_name=config["storage_account_name"],
+                account_key=config["storage_account_key"],
+            )
+    return _blob_service
+
 
 def sanitize_container_name(orig_name):
     """
@@ -59,19 +78,13 @@ def check_container_exists(container_name, bbs=None):
             """
         )
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     return bbs.exists(container_name)
 
 
 def create_container(container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     exists = check_container_exists(container_name, bbs)
     if not exists:
         bbs.create_container(container_name)
@@ -82,20 +95,14 @@ def check_blob_exists(blob_name, container_name, bbs=None):
     See if a blob already exists for this account name.
     """
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_names = bbs.list_blob_names(container_name)
     return blob_name in blob_names
 
 
 def get_sas_token(container_name, token_duration=1, permissions="READ", bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     token_permission = (
         ContainerPermissions.WRITE
         if permissions == "WRITE"
@@ -117,10 +124,7 @@ def retrieve_blob(blob_name, container_name, destination="/tmp/", bbs=None):
     use the BlockBlobService to retrieve file from Azure, and place in destination folder.
     """
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     local_filename = blob_name.split("/")[-1]
     try:
         bbs.get_blob_to_path(
@@ -134,11 +138,7 @@ def retrieve_blob(blob_name, container_name, destination="/tmp/", bbs=None):
 
 def list_directory(path, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
-        pass
+        bbs = get_blob_service()
     output_names = []
     prefix = remove_container_name_from_blob_path(path, container_name)
     if prefix and not prefix.endswith("/"):
@@ -149,6 +149,18 @@ def list_directory(path, container_name, bbs=None):
     return [os.path.basename(bn) for bn in blob_names]
 
 
+def list_blob_names_recursive(path, container_name, bbs=None):
+    """
+    List the names of all the blobs under path, at any depth.
+    """
+    if not bbs:
+        bbs = get_blob_service()
+    prefix = remove_container_name_from_blob_path(path, container_name)
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return list(bbs.list_blob_names(container_name, prefix=prefix))
+
+
 def remove_container_name_from_blob_path(blob_path, container_name):
     """
     Get the bit of the filepath after the container name.
@@ -172,10 +184,7 @@ def remove_container_name_from_blob_path(blob_path, container_name):
 
 def delete_blob(blob_name, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_exists = check_blob_exists(blob_name, container_name, bbs)
     if not blob_exists:
         return
@@ -184,10 +193,7 @@ def delete_blob(blob_name, container_name, bbs=None):
 
 def write_file_to_blob(file_path, blob_name, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     bbs.create_blob_from_path(container_name, blob_name, file_path)
 
 
@@ -201,10 +207,7 @@ def write_files_to_blob(
     """
 
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     filepaths_to_upload = []
     for root, dirs, files in os.walk(path):
         for filename in files:
@@ -235,10 +238,7 @@ def save_image(
     probably others...
     """
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     output_path = os.path.join(output_location, output_filename)
     blob_name = remove_container_name_from_blob_path(output_path, container_name)
     im_bytes = io.BytesIO()
@@ -248,10 +248,7 @@ def save_image(
 
 def read_image(blob_name, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_name = remove_container_name_from_blob_path(blob_name, container_name)
     img_bytes = bbs.get_blob_to_bytes(container_name, blob_name)
     image = Image.open(io.BytesIO(img_bytes.content))
@@ -260,10 +257,7 @@ def read_image(blob_name, container_name, bbs=None):
 
 def save_json(data, blob_path, filename, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_name = os.path.join(blob_path, filename)
     blob_name = remove_container_name_from_blob_path(blob_name, container_name)
     bbs.create_blob_from_text(container_name, blob_name, json.dumps(data))
@@ -271,10 +265,7 @@ def save_json(data, blob_path, filename, container_name, bbs=None):
 
 def read_json(blob_name, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_name = remove_container_name_from_blob_path(blob_name, container_name)
     data_blob = bbs.get_blob_to_text(container_name, blob_name)
     data = json.loads(data_blob.content)
@@ -283,10 +274,7 @@ def read_json(blob_name, container_name, bbs=None):
 
 def get_blob_to_tempfile(filename, container_name, bbs=None):
     if not bbs:
-        bbs = BlockBlobService(
-            account_name=config["storage_account_name"],
-            account_key=config["storage_account_key"],
-        )
+        bbs = get_blob_service()
     blob_name = remove_container_name_from_blob_path(filename, container_name)
     td = tempfile.mkdtemp()
     output_name = os.path.join(td, os.path.basename(filename))
@@ -322,10 +310,7 @@ def download_rgb(container, rgb_dir):
     rgb_dir: str, directory into which to put image files.
     """
     print("Getting RGB images to {}".format(rgb_dir))
-    bbs = BlockBlobService(
-        account_name=config["storage_account_name"],
-        account_key=config["storage_account_key"],
-    )
+    bbs = get_blob_service()
     blob_names = bbs.list_blob_names(container)
     rgb_names = [b for b in blob_names if "PROCESSED" in b and b.endswith("RGB.png")]
     print("Found {} images".format(len(rgb_names)))
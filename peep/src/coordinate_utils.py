@@ -5,6 +5,7 @@ and their string representations.,
 
 import re
 
+import numpy as np
 import requests
 
 
@@ -94,6 +95,114 @@ def find_coords_string(file_path):
     return coords_string
 
 
+def split_bounds(bounds, max_size):
+    """
+    Divide a rectangle into a grid of sub-rectangles that are no larger than
+    max_size along either side.  The grid starts from the bottom left corner,
+    so the sub-rectangles in the last column and row may be smaller.
+
+    Parameters
+    ==========
+    bounds: list with coordinates, e.g.  [left, bottom, right, top]
+    max_size: float, maximum width and height of each sub-rectangle, in
+              the same units as bounds.
+
+    Returns
+    =======
+    list of [left, bottom, right, top] for each sub-rectangle, going
+    along the bottom row first.
+    """
+    edges = []
+    for low, high in [(bounds[0], bounds[2]), (bounds[1], bounds[3])]:
+        n_parts = max(1, int(np.ceil((high - low) / max_size)))
+        edges.append([low + i * max_size for i in range(n_parts)] + [high])
+    x_edges, y_edges = edges
+    return [
+        [x_edges[ix], y_edges[iy], x_edges[ix + 1], y_edges[iy + 1]]
+        for iy in range(len(y_edges) - 1)
+        for ix in range(len(x_edges) - 1)
+    ]
+
+
+def get_enclosing_bounds(bounds_list):
+    """
+    Find the smallest rectangle containing all of a list of rectangles.
+
+    Parameters
+    ==========
+    bounds_list: list of [left, bottom, right, top]
+
+    Returns
+    =======
+    list, [left, bottom, right, top]
+    """
+    return [
+        min(bounds[0] for bounds in bounds_list),
+        min(bounds[1] for bounds in bounds_list),
+        max(bounds[2] for bounds in bounds_list),
+        max(bounds[3] for bounds in bounds_list),
+    ]
+
+
+def read_bounds_file(bounds_file, projection=None, land_only=True):
+    """
+    Read the bounds of many regions from a geoparquet file with a
+    'geometry' column, e.g. testdata/images_1024.parquet.
+
+    Parameters
+    ==========
+    bounds_file: str, path to the geoparquet file
+    projection: str, optional, e.g. "EPSG:27700".  If given, convert the
+                geometries to this coordinate system first.
+    land_only: bool, if True and the file has an 'on_land' column,
+               only keep the rows where it is True.
+
+    Returns
+    =======
+    list of [left, bottom, right, top] for each region, as integers.
+    """
+    # geopandas is slow to import, and only needed here
+    import geopandas
+
+    bounds_gdf = geopandas.read_parquet(bounds_file)
+    if projection and bounds_gdf.crs is not None:
+        bounds_gdf = bounds_gdf.to_crs(projection)
+    if land_only and "on_land" in bounds_gdf:
+        bounds_gdf = bounds_gdf[bounds_gdf["on_land"] == True]
+    return [[int(b) for b in geometry.bounds] for geometry in bounds_gdf["geometry"]]
+
+
+def get_sub_image_coords_grid(bounds, x_parts, y_parts):
+    """
+    If an image is divided into sub_images, return an array of coordinates
+    for all the sub-images, laid out in the same way as the sub-images
+    themselves, i.e. with rows (from the top of the image) first.
+    Coordinates will be defined as the bottom left corner of each image.
+
+    Parameters
+    ==========
+    bounds: list with coordinates, e.g.  [left, bottom, right, top]
+    x_parts: int, number of sub-images in x-direction
+    y_parts: int, number of sub-images in y-direction
+
+    Returns
+    =======
+    sub_image_coords: numpy array of floats, shape (y_parts, x_parts, 2), where
+                      sub_image_coords[iy, ix] is [long, lat] of the sub-image
+                      in row iy and column ix.
+    """
+    sub_image_size_x = (bounds[2] - bounds[0]) / x_parts
+    sub_image_size_y = (bounds[3] - bounds[1]) / y_parts
+    ix = np.arange(x_parts)
+    iy = np.arange(y_parts)
+    sub_image_coords = np.empty((y_parts, x_parts, 2), dtype=np.float64)
+    sub_image_coords[:, :, 0] = bounds[0] + ix * sub_image_size_x
+    sub_image_coords[:, :, 1] = (
+        bounds[3] - sub_image_size_y - (iy * sub_image_size_y)
+    )[:, np.newaxis]
+    return sub_image_coords
+
+
 def get_sub_image_coords(bounds, x_parts, y_parts):
     """
     If an image is divided into sub_images, return a list of coordinates
@@ -107,23 +216,15 @@ def get_sub_image_coords(bounds, x_parts, y_parts):
 
     Returns
     =======
-    sub_image_coords: list, of lists of floats [[long,lat],...]
-    """
-    sub_image_coords = []
-    if bounds:
-        left_start = bounds[0]
-        top_start = bounds[3]
-        sub_image_size_x = (bounds[2] - bounds[0]) / x_parts
-        sub_image_size_y = (bounds[3] - bounds[1]) / y_parts
-        for ix in range(x_parts):
-            for iy in range(y_parts):
-                sub_image_coords.append(
-                    (
-                        left_start + (ix * sub_image_size_x),
-                        top_start - sub_image_size_y - (iy * sub_image_size_y),
-                    )
-                )
-    return sub_image_coords
+    sub_image_coords: list, of tuples of floats [(long,lat),...], ordered
+                      by column (ix) then row (iy), i.e. index ix * y_parts + iy.
+    """
+    if not bounds:
+        return []
+    coords_grid = get_sub_image_coords_grid(bounds, x_parts, y_parts)
+    return [
+        tuple(coords) for coords in coords_grid.swapaxes(0, 1).reshape(-1, 2).tolist()
+    ]
 
 
 def lookup_country(latitude, longitude):
@@ -0,0 +1,193 @@
+"""
+A local cache of files downloaded from GEE, shared between pipeline runs.
+
+Each entry is a directory named by a hash of the parameters of the download
+request (collection, bounds, date range, bands, ...), holding the downloaded
+.tif files and a copy of the request parameters.  The total size of the cache
+is bounded - when it grows too large, the least recently used entries
+are removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+
+def get_cache_key(request_params):
+    """
+    Hash the parameters of a download request into a key for the cache.
+
+    Parameters
+    ==========
+    request_params: dict, with json-serializable values.
+
+    Returns
+    =======
+    str, hex digest of the request parameters.
+    """
+    request_string = json.dumps(request_params, sort_keys=True)
+    return hashlib.sha256(request_string.encode("utf-8")).hexdigest()
+
+
+def copy_file(src, dst):
+    """
+    Copy src to dst.  The cache and the output never share files (e.g. by
+    hard links), so rewriting an output file can't change the cache.
+    """
+    if os.path.exists(dst):
+        # don't write through an existing hard link to a cache entry
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+
+
+def get_cached_files(cache_dir, cache_key, file_endings=[".tif"]):
+    """
+    Look for an entry in the cache, and mark it as recently used.
+
+    Parameters
+    ==========
+    cache_dir: str, base directory of the cache
+    cache_key: str, from get_cache_key
+    file_endings: list of str, only return files with these endings.
+
+    Returns
+    =======
+    list of str, full paths of the cached files, or None if there is no entry.
+    """
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if not os.path.isdir(entry_dir):
+        return None
+    # the modification time of the entry directory records when it was last used
+    os.utime(entry_dir)
+    return sorted(
+        os.path.join(entry_dir, filename)
+        for filename in os.listdir(entry_dir)
+        if any(filename.endswith(ending) for ending in file_endings)
+    )
+
+
+def copy_from_cache(cache_dir, cache_key, output_dir, file_endings=[".tif"]):
+    """
+    Copy the files of a cache entry into output_dir.
+
+    Returns
+    =======
+    bool, True if the entry was in the cache and all its files were copied.
+    """
+    cached_files = get_cached_files(cache_dir, cache_key, file_endings)
+    if not cached_files:
+        return False
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        for cached_file in cached_files:
+            copy_file(
+                cached_file, os.path.join(output_dir, os.path.basename(cached_file))
+            )
+    except OSError:
+        # entry was removed while we were reading it
+        return False
+    return True
+
+
+def add_to_cache(
+    cache_dir,
+    cache_key,
+    input_dir,
+    request_params=None,
+    max_size_bytes=None,
+    file_endings=[".tif"],
+):
+    """
+    Add the files in input_dir to the cache, then remove the least recently
+    used entries if the cache is larger than max_size_bytes.
+    The new entry only appears once it is complete, so it is safe for other
+    threads or processes to read the cache at the same time.
+
+    Parameters
+    ==========
+    cache_dir: str, base directory of the cache
+    cache_key: str, from get_cache_key
+    input_dir: str, directory containing the downloaded files
+    request_params: dict, optional, saved in the entry for reference
+    max_size_bytes: int, optional, maximum total size of the cache
+    file_endings: list of str, only add files with these endings.
+    """
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if os.path.isdir(entry_dir):
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=cache_dir)
+    try:
+        for filename in os.listdir(input_dir):
+            if any(filename.endswith(ending) for ending in file_endings):
+                copy_file(
+                    os.path.join(input_dir, filename), os.path.join(tmp_dir, filename)
+                )
+        if request_params:
+            with open(os.path.join(tmp_dir, "request.json"), "w") as request_file:
+                json.dump(request_params, request_file, indent=2, sort_keys=True)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # e.g. another process added the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if max_size_bytes is not None:
+        evict_from_cache(cache_dir, max_size_bytes, keep=[cache_key])
+
+
+def get_cache_entries(cache_dir):
+    """
+    List the complete entries in the cache.
+
+    Returns
+    =======
+    list of tuples (cache_key, last_used_time, size_in_bytes),
+    least recently used first.
+    """
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for cache_key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, cache_key)
+        if cache_key.startswith(".") or not os.path.isdir(entry_dir):
+            continue
+        try:
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, filename))
+                for filename in os.listdir(entry_dir)
+            )
+            entries.append((cache_key, os.path.getmtime(entry_dir), size))
+        except OSError:
+            # entry was removed while we were looking at it
+            continue
+    return sorted(entries, key=lambda entry: entry[1])
+
+
+def evict_from_cache(cache_dir, max_size_bytes, keep=[]):
+    """
+    Remove least recently used entries until the total size of the cache
+    is at most max_size_bytes.
+
+    Parameters
+    ==========
+    cache_dir: str, base directory of the cache
+    max_size_bytes: int, maximum total size of the cache
+    keep: list of str, cache keys that should not be removed.
+
+    Returns
+    =======
+    list of str, the keys of the removed entries.
+    """
+    entries = get_cache_entries(cache_dir)
+    total_size = sum(size for _, _, size in entries)
+    removed = []
+    for cache_key, _, size in entries:
+        if total_size <= max_size_bytes:
+            break
+        if cache_key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, cache_key), ignore_errors=True)
+        total_size -= size
+        removed.append(cache_key)
+    return removed
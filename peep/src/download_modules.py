@@ -3,20 +3,33 @@ Classes for modules that download from GEE
 """
 
 import logging
+import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import ee
-
+from peep.src.async_download import get_async_download_engine
+from peep.src.coordinate_utils import (
+    get_enclosing_bounds,
+    read_bounds_file,
+    split_bounds,
+)
 from peep.src.date_utils import slice_time_period
-from peep.src.file_utils import download_and_unzip
-from peep.src.gee_interface import add_NDVI, apply_mask_cloud
+from peep.src.download_cache import add_to_cache, copy_from_cache, get_cache_key
+from peep.src.ee_backend import ee
+from peep.src.file_utils import (
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_POOL_SIZE,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    download_and_unzip,
+)
+from peep.src.gee_interface import add_NDVI, apply_mask_cloud, get_collection_info
+from peep.src.image_utils import mosaic_tifs
 from peep.src.peep_pipeline import BaseModule, logger
 
 # from datetime import datetime, timedelta
 
 
-ee.Initialize()
-
 # silence google API WARNING
 
 
@@ -44,6 +57,24 @@ class DownloaderModule(BaseModule):
             ("count", [bool]),
             ("bounds", [list]),
             ("projection", [str]),
+            ("n_download_threads", [int]),  # number of time slices to do at once
+            ("download_retries", [int]),
+            ("download_backoff", [float, int]),  # seconds
+            ("download_timeout", [int, float, list, tuple]),  # seconds
+            ("download_cache_dir", [str]),  # "" means no cache
+            ("download_cache_max_gb", [int, float]),
+            # larger areas are downloaded in pieces of at most this many pixels
+            # along each side, then combined
+            ("max_download_npix", [int]),
+            ("n_tile_threads", [int]),  # number of pieces to download at once
+            # geoparquet file with many regions to download, instead of bounds
+            ("bounds_file", [str]),
+            # download all the bands of a time slice into one tif file
+            ("multiband_tif", [bool]),
+            ("download_engine", [str]),  # "requests" or "asyncio"
+            # with the asyncio engine, the maximum number of downloads in
+            # flight at once for this downloader, over all its time slices
+            ("max_concurrent_downloads", [int]),
         ]
         return
 
@@ -70,6 +101,30 @@ class DownloaderModule(BaseModule):
             self.bounds = []
         if not "projection" in vars(self):
             self.projection = "EPSG:27700"
+        if not "n_download_threads" in vars(self):
+            self.n_download_threads = 1
+        if not "download_retries" in vars(self):
+            self.download_retries = DOWNLOAD_RETRIES
+        if not "download_backoff" in vars(self):
+            self.download_backoff = DOWNLOAD_BACKOFF
+        if not "download_timeout" in vars(self):
+            self.download_timeout = DOWNLOAD_TIMEOUT
+        if not "download_cache_dir" in vars(self):
+            self.download_cache_dir = ""
+        if not "download_cache_max_gb" in vars(self):
+            self.download_cache_max_gb = 20
+        if not "max_download_npix" in vars(self):
+            self.max_download_npix = 1024
+        if not "n_tile_threads" in vars(self):
+            self.n_tile_threads = 4
+        if not "bounds_file" in vars(self):
+            self.bounds_file = ""
+        if not "multiband_tif" in vars(self):
+            self.multiband_tif = False
+        if not "download_engine" in vars(self):
+            self.download_engine = "requests"
+        if not "max_concurrent_downloads" in vars(self):
+            self.max_concurrent_downloads = DOWNLOAD_POOL_SIZE
 
         return
 
@@ -88,16 +143,7 @@ class DownloaderModule(BaseModule):
 
         elif ("bounds" in vars(self)) and ("collection_name" in vars(self)):
 
-            self.output_location = (
-                "gee_{:0>6}_{:0>7}_{:0>6}_{:0>7}".format(
-                    round(self.bounds[0]),
-                    round(self.bounds[1]),
-                    round(self.bounds[2]),
-                    round(self.bounds[3]),
-                )
-                + "_"
-                + self.collection_name.replace("/", "-")
-            )
+            self.output_location = self.get_region_dirname(self.bounds)
 
         else:
             raise RuntimeError(
@@ -108,7 +154,39 @@ class DownloaderModule(BaseModule):
                 )
             )
 
-    def prep_data(self, date_range):
+    def get_region_dirname(self, bounds):
+        """
+        Name of the directory for the outputs for a region,
+        from its bounds and the collection name.
+        """
+        return (
+            "gee_{:0>6}_{:0>7}_{:0>6}_{:0>7}".format(
+                round(bounds[0]),
+                round(bounds[1]),
+                round(bounds[2]),
+                round(bounds[3]),
+            )
+            + "_"
+            + self.collection_name.replace("/", "-")
+        )
+
+    def get_region_geometry(self, bounds):
+        """
+        Parameters
+        ----------
+        bounds: list of [left, bottom, right, top], in self.projection
+
+        Returns
+        -------
+        ee.Geometry.Rectangle
+        """
+        ll_point = ee.Geometry.Point((bounds[0], bounds[1]), proj=self.projection)
+        tr_point = ee.Geometry.Point((bounds[2], bounds[3]), proj=self.projection)
+        return ee.Geometry.Rectangle(
+            coords=(ll_point, tr_point), proj=self.projection, evenOdd=False
+        )
+
+    def prep_data(self, date_range, bounds=None):
         """
         Interact with the Google Earth Engine API to get in ImageCollection,
         filter it, and convert (e.g. via median or sum) into a list of Images,
@@ -119,50 +197,109 @@ class DownloaderModule(BaseModule):
         date_range: list of strings 'YYYY-MM-DD'.  Note that this will generally
                     be a sub-range of the overall date-range, as this function
                     is called in the loop over time slices.
+        bounds: list of [left, bottom, right, top], optional.  The area to
+                download, if not the whole of self.bounds.
 
         Returns
         -------
         url_list:  a list of URLs from which zipfiles can be downloaded from GEE.
         """
-        start_date, end_date = date_range
+        if bounds is None:
+            bounds = self.bounds
+        geom = self.get_region_geometry(bounds)
+        image_list = self.prep_image_list(date_range, geom)
+        return self.get_download_urls(image_list, geom)
 
-        image_coll = ee.ImageCollection(self.collection_name)
-        ll_point = ee.Geometry.Point(
-            (self.bounds[0], self.bounds[1]), proj=self.projection
-        )
-        tr_point = ee.Geometry.Point(
-            (self.bounds[2], self.bounds[3]), proj=self.projection
-        )
-        geom = ee.Geometry.Rectangle(
-            coords=(ll_point, tr_point), proj=self.projection, evenOdd=False
-        )
+    def prep_image_list(self, date_range, geom):
+        """
+        Get the ImageCollection for a date range and area, filter it, and
+        convert it into a list of Images, which can then be downloaded for
+        that area or any part of it.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD'
+        geom: ee.Geometry, the area to look for images in.
 
+        Returns
+        -------
+        image_list: list of ee.Image, empty if no valid images were found.
+        """
+        start_date, end_date = date_range
+        image_coll = ee.ImageCollection(self.collection_name)
         dataset = image_coll.filterBounds(geom).filterDate(start_date, end_date)
-        dataset_size = dataset.size().getInfo()
+        # concrete class may do more filtering (e.g. removing cloudy images)
+        filtered_dataset = self.filter_dataset(dataset)
+        # get all the metadata we need in one round trip to the server
+        collection_info = get_collection_info(dataset, filtered_dataset)
+        dataset_size = collection_info["size"]
+        valid_size = collection_info["filtered_size"]
+        logger.debug(
+            "{}: bands {} for date range {}".format(
+                self.name, collection_info["band_names"], date_range
+            )
+        )
 
         if dataset_size == 0:
             logger.info("No images found in this date rage, skipping.")
             log_msg = "WARN >>> No data found."
             return []
-        # concrete class will do more filtering, and prepare Images for download
-        image_list = self.prep_images(dataset)
+        if valid_size == 0:
+            logger.info(
+                f"WARN >>> Found 0/{dataset_size} valid images after cloud filtering, skipping."
+            )
+            return []
+        logger.info(
+            f"OK   >>> Found {valid_size}/{dataset_size} valid images after cloud filtering."
+        )
+        # concrete class will prepare Images for download
+        return self.prep_images(filtered_dataset)
+
+    def get_download_urls(self, image_list, geom):
+        """
+        Get the URLs from which the Images can be downloaded, for one area.
+
+        Parameters
+        ----------
+        image_list: list of ee.Image, from prep_image_list
+        geom: ee.Geometry, the area to download.
+
+        Returns
+        -------
+        url_list:  a list of URLs from which zipfiles can be downloaded from GEE.
+        """
+        download_params = {"region": geom, "scale": self.scale, "crs": self.projection}
+        if self.multiband_tif and len(image_list) > 0:
+            # all the bands go into one file, download.tif
+            image_list = [ee.Image.cat(image_list)]
+            download_params["filePerBand"] = False
         url_list = []
         for image in image_list:
             # get a URL from which we can download the resulting data
             try:
-                url = image.getDownloadURL(
-                    {"region": geom, "scale": self.scale, "crs": self.projection}
-                )
+                url = image.getDownloadURL(download_params)
                 url_list.append(url)
             except Exception as e:
                 logger.info("Unable to get URL: {}".format(e))
-
-            logging.info(
-                f"OK   >>> Found {dataset.size().getInfo()}/{dataset_size} valid images after cloud filtering."
-            )
         return url_list
 
-    def download_data(self, download_urls, download_location):
+    def filter_dataset(self, dataset):
+        """
+        Apply any filtering needed before the images in a dataset are combined.
+        By default, do nothing - subclasses can override this.
+
+        Parameters
+        ----------
+        dataset : ee.ImageCollection
+            The ImageCollection of images filtered by location and date.
+
+        Returns
+        ----------
+        ee.ImageCollection
+        """
+        return dataset
+
+    def download_data(self, download_urls, download_location, cache_params=None):
         """
         Download zip file(s) from GEE to configured output location.
 
@@ -170,6 +307,9 @@ class DownloaderModule(BaseModule):
         ---------
         download_urls: list of strings (URLs) from gee_prep_data
         download_location: str, this will generally be <base_dir>/<date>/RAW
+        cache_params: dict, optional.  If given (and download_cache_dir is set)
+                      the downloaded files are added to the download cache
+                      with these request parameters.
 
         Returns:
         --------
@@ -179,41 +319,537 @@ class DownloaderModule(BaseModule):
             logger.info("{}: No URLs found for {}".format(self.name, self.bounds))
             return False
 
-        # download files and unzip to temporary directory
-        tempdir = tempfile.TemporaryDirectory()
-        for download_url in download_urls:
-            try:
-                download_and_unzip(download_url, tempdir.name)
-            except RuntimeError as e:
-                return False
-        logger.debug("{}: Wrote zipfiles to {}".format(self.name, tempdir.name))
         logger.info("{}: Will download to {}".format(self.name, download_location))
-        self.copy_to_output_location(tempdir.name, download_location, [".tif"])
+        if self.output_location_type == "local":
+            # unzip the tif files straight into the output location
+            downloaded_ok = self.download_and_unzip_all(
+                download_urls, download_location
+            )
+            self.invalidate_listing(download_location, self.output_location_type)
+            if not downloaded_ok:
+                return False
+            self.add_to_download_cache(download_location, cache_params)
+            return True
+
+        # download files and unzip to temporary directory, then upload
+        with tempfile.TemporaryDirectory() as tempdir:
+            if not self.download_and_unzip_all(download_urls, tempdir):
+                return False
+            logger.debug("{}: Wrote zipfiles to {}".format(self.name, tempdir))
+            self.add_to_download_cache(tempdir, cache_params)
+            self.copy_to_output_location(tempdir, download_location, [".tif"])
         return True
 
+    def download_tiled_data(
+        self,
+        date_range,
+        tile_bounds,
+        download_location,
+        cache_params=None,
+        image_list=None,
+    ):
+        """
+        Download the data for one time slice in several pieces, one for each
+        of tile_bounds, using n_tile_threads threads, then combine the pieces
+        into one .tif file per band in the download location.  The Images are
+        prepared once, for the area enclosing all the pieces, and then a
+        download URL is requested for each piece.
+
+        Parameters
+        ---------
+        date_range: list of strings 'YYYY-MM-DD'
+        tile_bounds: list of [left, bottom, right, top] for each piece
+        download_location: str, this will generally be <base_dir>/<date>/RAW
+        cache_params: dict, optional, see download_data
+        image_list: list of ee.Image, optional, from prep_image_list, if
+                    already prepared for an area including all the pieces.
+
+        Returns:
+        --------
+        bool, True if all the pieces were downloaded and combined, False otherwise
+        """
+        logger.info(
+            "{}: downloading date range {} in {} pieces".format(
+                self.name, date_range, len(tile_bounds)
+            )
+        )
+        if image_list is None:
+            image_list = self.prep_image_list(
+                date_range, self.get_region_geometry(get_enclosing_bounds(tile_bounds))
+            )
+        if len(image_list) == 0:
+            return False
+        with tempfile.TemporaryDirectory() as tempdir:
+            tile_dirs = [
+                os.path.join(tempdir, "tile_{}".format(i))
+                for i in range(len(tile_bounds))
+            ]
+
+            def download_tile(bounds, tile_dir):
+                urls = self.get_download_urls(
+                    image_list, self.get_region_geometry(bounds)
+                )
+                if len(urls) == 0:
+                    logger.info("{}: No URLs found for {}".format(self.name, bounds))
+                    return False
+                return self.download_and_unzip_all(urls, tile_dir)
+
+            with ThreadPoolExecutor(
+                max_workers=min(self.n_tile_threads, len(tile_bounds))
+            ) as executor:
+                results = list(executor.map(download_tile, tile_bounds, tile_dirs))
+            if not all(results):
+                return False
+
+            tif_filenames = sorted(
+                filename
+                for filename in os.listdir(tile_dirs[0])
+                if filename.endswith(".tif")
+            )
+            if self.output_location_type == "local":
+                mosaic_dir = download_location
+            else:
+                mosaic_dir = os.path.join(tempdir, "mosaic")
+            # check all the pieces are there before writing anything
+            for filename in tif_filenames:
+                if not all(
+                    os.path.exists(os.path.join(tile_dir, filename))
+                    for tile_dir in tile_dirs
+                ):
+                    logger.info(
+                        "{}: {} is missing for some pieces of {}".format(
+                            self.name, filename, date_range
+                        )
+                    )
+                    return False
+            os.makedirs(mosaic_dir, exist_ok=True)
+            for filename in tif_filenames:
+                mosaic_tifs(
+                    [os.path.join(tile_dir, filename) for tile_dir in tile_dirs],
+                    os.path.join(mosaic_dir, filename),
+                )
+            if self.output_location_type == "local":
+                # written without going through the Module
+                self.invalidate_listing(download_location, self.output_location_type)
+            self.add_to_download_cache(mosaic_dir, cache_params)
+            if self.output_location_type != "local":
+                self.copy_to_output_location(mosaic_dir, download_location, [".tif"])
+        return True
+
+    def get_cache_params(self, date_range, bounds=None):
+        """
+        The parameters that determine what is downloaded for a time slice,
+        used to look up the download cache.  Subclasses should add any
+        parameters of their own (e.g. bands) that change the download.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD'
+        bounds: list of [left, bottom, right, top], optional, if not self.bounds
+
+        Returns
+        -------
+        dict
+        """
+        if bounds is None:
+            bounds = self.bounds
+        return {
+            "collection_name": self.collection_name,
+            "bounds": list(bounds),
+            "date_range": list(date_range),
+            "scale": self.scale,
+            "projection": self.projection,
+            "ndvi": self.ndvi,
+            "count": self.count,
+            "multiband_tif": self.multiband_tif,
+        }
+
+    def add_to_download_cache(self, input_dir, cache_params):
+        """
+        If the download cache is enabled, add the .tif files in input_dir to it.
+        """
+        if not (self.download_cache_dir and cache_params):
+            return
+        add_to_cache(
+            self.download_cache_dir,
+            get_cache_key(cache_params),
+            input_dir,
+            cache_params,
+            max_size_bytes=int(self.download_cache_max_gb * 1024**3),
+        )
+
+    def copy_from_download_cache(self, cache_params, download_location):
+        """
+        If the download cache is enabled and has the files for these request
+        parameters, put them in download_location.
+
+        Returns
+        -------
+        bool, True if the files were found in the cache.
+        """
+        if not self.download_cache_dir:
+            return False
+        cache_key = get_cache_key(cache_params)
+        if self.output_location_type == "local":
+            found = copy_from_cache(
+                self.download_cache_dir, cache_key, download_location
+            )
+            if found:
+                self.invalidate_listing(download_location, self.output_location_type)
+            return found
+        with tempfile.TemporaryDirectory() as tempdir:
+            if not copy_from_cache(self.download_cache_dir, cache_key, tempdir):
+                return False
+            self.copy_to_output_location(tempdir, download_location, [".tif"])
+        return True
+
+    def download_and_unzip_all(self, download_urls, output_dir):
+        """
+        Download zip file(s) from GEE, and extract the .tif files
+        from them into output_dir.  With the "asyncio" download_engine,
+        all the files are downloaded at once, by the engine shared with the
+        other downloads in this process.
+
+        Returns:
+        --------
+        bool, True if all the downloads succeeded, False otherwise
+        """
+        download_stats = {"retries": 0, "bytes": 0}
+        downloaded_ok = True
+        if self.download_engine == "asyncio":
+            engine = get_async_download_engine()
+            results = engine.run(
+                engine.download_and_unzip_all(
+                    download_urls,
+                    output_dir,
+                    [".tif"],
+                    retries=self.download_retries,
+                    backoff=self.download_backoff,
+                    timeout=self.download_timeout,
+                    download_stats=download_stats,
+                    limit=engine.get_limit(self, self.max_concurrent_downloads),
+                )
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.info("{}: {}".format(self.name, result))
+                    downloaded_ok = False
+        elif self.download_engine == "requests":
+            for download_url in download_urls:
+                try:
+                    download_and_unzip(
+                        download_url,
+                        output_dir,
+                        [".tif"],
+                        retries=self.download_retries,
+                        backoff=self.download_backoff,
+                        timeout=self.download_timeout,
+                        download_stats=download_stats,
+                    )
+                except RuntimeError as e:
+                    logger.info("{}: {}".format(self.name, e))
+                    downloaded_ok = False
+                    break
+        else:
+            raise RuntimeError(
+                "{}: Unknown download_engine {} - must be 'requests' or 'asyncio'".format(
+                    self.name, self.download_engine
+                )
+            )
+        logger.info(
+            "{}: downloaded {} bytes with {} retries for {}".format(
+                self.name,
+                download_stats["bytes"],
+                download_stats["retries"],
+                output_dir,
+            )
+        )
+        return downloaded_ok
+
+    def download_time_slice(self, date_range):
+        """
+        Prepare and download the data for one time slice, unless it is
+        already in the output location.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD', one of the sub-ranges
+                    from slice_time_period.
+
+        Returns
+        -------
+        tuple (downloaded_ok, location), where downloaded_ok is None if
+        the files already existed, and True/False otherwise.
+        """
+        mid_date = "{}_{}".format(
+            date_range[0], date_range[1]
+        )  # find_mid_period(date_range[0], date_range[1])
+        location = self.join_path(self.output_location, mid_date, "RAW")
+        logger.debug(
+            "{} Will check for existing files in {}".format(self.name, location)
+        )
+        if not self.replace_existing_files and self.check_for_existing_files(
+            location, self.get_num_files_per_point()
+        ):
+            return None, location
+        cache_params = self.get_cache_params(date_range)
+        # large areas need to be downloaded in pieces
+        tile_bounds = split_bounds(self.bounds, self.max_download_npix * self.scale)
+        if self.copy_from_download_cache(cache_params, location):
+            logger.info(
+                "{}: found date range {} in download cache".format(
+                    self.name, date_range
+                )
+            )
+            downloaded_ok = True
+        elif len(tile_bounds) > 1:
+            downloaded_ok = self.download_tiled_data(
+                date_range, tile_bounds, location, cache_params
+            )
+        else:
+            urls = self.prep_data(date_range)
+            logger.debug(
+                "{}: got URL {} for date range {}".format(self.name, urls, date_range)
+            )
+            downloaded_ok = self.download_data(urls, location, cache_params)
+        if downloaded_ok:
+            self.record_output(location, mid_date)
+        return downloaded_ok, location
+
+    def download_time_slice_or_fail(self, date_range):
+        """
+        Call download_time_slice, logging any exception and treating it as
+        a failed download, so that the other time slices can carry on.
+        """
+        try:
+            return self.download_time_slice(date_range)
+        except Exception:
+            logger.exception(
+                "{}: error downloading date range {}".format(self.name, date_range)
+            )
+            return False, None
+
+    def get_num_files_per_point(self):
+        """
+        Number of files we expect to download for each time slice.
+        """
+        return 1 if self.multiband_tif else self.num_files_per_point
+
+    def can_publish_dates(self):
+        """
+        Time slices can be handed on as they are downloaded, except in
+        multi-region mode, where each region has its own directories.
+        """
+        return not self.bounds_file
+
+    def publish_time_slice(self, date_range, result):
+        """
+        If the next Module is taking dates from our output_stream, give it
+        this time slice, unless the download failed.  This waits while the
+        stream is full, so downloading can't get far ahead of processing.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD'
+        result: tuple (downloaded_ok, location) from download_time_slice
+
+        Returns
+        -------
+        result, unchanged
+        """
+        downloaded_ok, _ = result
+        if self.output_stream is not None and downloaded_ok is not False:
+            self.output_stream.put("{}_{}".format(date_range[0], date_range[1]))
+        return result
+
+    def download_and_publish_time_slice(self, date_range):
+        """
+        Call download_time_slice_or_fail, then publish_time_slice.
+        """
+        return self.publish_time_slice(
+            date_range, self.download_time_slice_or_fail(date_range)
+        )
+
+    def download_region(self, date_range, bounds, image_list, location):
+        """
+        Download the data for one region of a multi-region run, for one
+        time slice, using Images prepared for all the regions at once.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD'
+        bounds: list of [left, bottom, right, top] for this region
+        image_list: list of ee.Image, from prep_image_list
+        location: str, this will generally be <base_dir>/<region>/<date>/RAW
+
+        Returns
+        -------
+        bool, True if downloaded something, False otherwise
+        """
+        try:
+            cache_params = self.get_cache_params(date_range, bounds)
+            # large regions still need to be downloaded in pieces
+            tile_bounds = split_bounds(bounds, self.max_download_npix * self.scale)
+            if len(tile_bounds) > 1:
+                downloaded_ok = self.download_tiled_data(
+                    date_range, tile_bounds, location, cache_params, image_list
+                )
+            else:
+                urls = self.get_download_urls(
+                    image_list, self.get_region_geometry(bounds)
+                )
+                downloaded_ok = self.download_data(urls, location, cache_params)
+            if downloaded_ok:
+                self.record_output(location, "{}_{}".format(*date_range), bounds)
+            return downloaded_ok
+        except Exception:
+            logger.exception(
+                "{}: error downloading date range {} for {}".format(
+                    self.name, date_range, bounds
+                )
+            )
+            return False
+
+    def download_time_slice_multi_region(self, date_range, region_bounds):
+        """
+        Download the data for one time slice for many regions.  The Images
+        are prepared once, for the area enclosing all the regions that still
+        need downloading, and then a download URL is requested for each
+        region, with up to n_download_threads regions downloading at once.
+
+        Parameters
+        ----------
+        date_range: list of strings 'YYYY-MM-DD'
+        region_bounds: list of [left, bottom, right, top] for each region
+
+        Returns
+        -------
+        list of (downloaded_ok, location) for each region, where downloaded_ok
+        is None if the files already existed, and True/False otherwise.
+        """
+        mid_date = "{}_{}".format(date_range[0], date_range[1])
+        results = []
+        to_download = []
+        for i, bounds in enumerate(region_bounds):
+            location = self.join_path(
+                self.output_location, self.get_region_dirname(bounds), mid_date, "RAW"
+            )
+            if not self.replace_existing_files and self.check_for_existing_files(
+                location, self.get_num_files_per_point()
+            ):
+                results.append((None, location))
+            elif self.copy_from_download_cache(
+                self.get_cache_params(date_range, bounds), location
+            ):
+                self.record_output(location, mid_date, bounds)
+                results.append((True, location))
+            else:
+                results.append((False, location))
+                to_download.append(i)
+        if len(to_download) == 0:
+            return results
+
+        logger.info(
+            "{}: downloading date range {} for {}/{} regions".format(
+                self.name, date_range, len(to_download), len(region_bounds)
+            )
+        )
+        # one server-side graph for all the regions
+        geom = self.get_region_geometry(
+            get_enclosing_bounds([region_bounds[i] for i in to_download])
+        )
+        image_list = self.prep_image_list(date_range, geom)
+        if len(image_list) == 0:
+            return results
+
+        def download_one(i):
+            return self.download_region(
+                date_range, region_bounds[i], image_list, results[i][1]
+            )
+
+        with ThreadPoolExecutor(max_workers=self.n_download_threads) as executor:
+            for i, downloaded_ok in zip(
+                to_download, executor.map(download_one, to_download)
+            ):
+                results[i] = (downloaded_ok, results[i][1])
+        return results
+
+    def run_multi_region(self):
+        """
+        Download every time slice for all the regions in bounds_file.
+        The output for each region goes in its own directory in
+        output_location, named as if it had been downloaded on its own.
+        """
+        region_bounds = read_bounds_file(self.bounds_file, self.projection)
+        logger.info(
+            "{}: read {} regions from {}".format(
+                self.name, len(region_bounds), self.bounds_file
+            )
+        )
+        start_date, end_date = self.date_range
+        date_ranges = slice_time_period(start_date, end_date, self.time_per_point)
+        for date_range in date_ranges:
+            try:
+                results = self.download_time_slice_multi_region(
+                    date_range, region_bounds
+                )
+            except Exception:
+                logger.exception(
+                    "{}: error downloading date range {}".format(self.name, date_range)
+                )
+                results = [(False, None)] * len(region_bounds)
+            n_succeeded = sum(1 for ok, _ in results if ok)
+            n_failed = sum(1 for ok, _ in results if ok is False)
+            self.run_status["succeeded"] += n_succeeded
+            self.run_status["failed"] += n_failed
+            log = logger.error if n_failed else logger.info
+            log(
+                "{}: date range {}: {} regions downloaded, {} failed, {} already present".format(
+                    self.name,
+                    date_range,
+                    n_succeeded,
+                    n_failed,
+                    len(results) - n_succeeded - n_failed,
+                )
+            )
+        self.is_finished = True
+        return self.run_status
+
     def run(self):
+        try:
+            return self.run_time_slices()
+        finally:
+            # let the next Module know there are no more dates coming
+            if self.output_stream is not None:
+                self.output_stream.close()
+
+    def run_time_slices(self):
+        """
+        Download every time slice in date_range.
+        """
         self.prepare_for_run()
+        if self.bounds_file:
+            return self.run_multi_region()
 
         start_date, end_date = self.date_range
         date_ranges = slice_time_period(start_date, end_date, self.time_per_point)
-        download_locations = []
-        for date_range in date_ranges:
-            mid_date = "{}_{}".format(
-                date_range[0], date_range[1]
-            )  # find_mid_period(date_range[0], date_range[1])
-            location = self.join_path(self.output_location, mid_date, "RAW")
-            logger.debug(
-                "{} Will check for existing files in {}".format(self.name, location)
+        if self.n_download_threads > 1:
+            logger.info(
+                "{}: downloading {} time slices with {} threads".format(
+                    self.name, len(date_ranges), self.n_download_threads
+                )
             )
-            if not self.replace_existing_files and self.check_for_existing_files(
-                location, self.num_files_per_point
-            ):
+            with ThreadPoolExecutor(max_workers=self.n_download_threads) as executor:
+                # map returns the results in the order of date_ranges
+                results = list(
+                    executor.map(self.download_and_publish_time_slice, date_ranges)
+                )
+        else:
+            results = (self.download_and_publish_time_slice(d) for d in date_ranges)
+        download_locations = []
+        for date_range, (downloaded_ok, location) in zip(date_ranges, results):
+            if downloaded_ok is None:
                 continue
-            urls = self.prep_data(date_range)
-            logger.debug(
-                "{}: got URL {} for date range {}".format(self.name, urls, date_range)
-            )
-            downloaded_ok = self.download_data(urls, location)
             if downloaded_ok:
                 self.run_status["succeeded"] += 1
                 logger.info(
@@ -269,24 +905,49 @@ class ImageDownloader(DownloaderModule):
         self.cloudy_pix_frac = 50
         self.num_files_per_point = 4
 
-    def prep_images(self, dataset):
+    def filter_dataset(self, dataset):
         """
-        Take a dataset that has already been filtered by date and location.
-        Then apply specific filters, take the median, and calculate NDVI and create
-        the COUNT band.
+        Remove very cloudy images, and mask cloudy pixels in the rest.
 
         Parameters
         ----------
         dataset : ee.ImageCollection
             The ImageCollection of images filtered by location and date.
 
+        Returns
+        ----------
+        ee.ImageCollection
+        """
+        return apply_mask_cloud(dataset, self.collection_name, self.cloudy_pix_flag)
+
+    def get_cache_params(self, date_range, bounds=None):
+        cache_params = super().get_cache_params(date_range, bounds)
+        cache_params.update(
+            {
+                "RGB_bands": list(self.RGB_bands),
+                "NIR_band": self.NIR_band if self.ndvi else None,
+                "mask_cloud": self.mask_cloud,
+                "cloudy_pix_flag": self.cloudy_pix_flag,
+            }
+        )
+        return cache_params
+
+    def prep_images(self, dataset):
+        """
+        Take a dataset that has already been filtered by date and location,
+        and by filter_dataset.
+        Then take the median, and calculate NDVI and create the COUNT band.
+
+        Parameters
+        ----------
+        dataset : ee.ImageCollection
+            The ImageCollection of filtered images.
+
         Returns
         ----------
         image_list : list(ee.Image)
             List of Images to be downloaded
         """
-        # Apply cloud mask
-        dataset = apply_mask_cloud(dataset, self.collection_name, self.cloudy_pix_flag)
         # Take median
         image = dataset.median()
         bands_to_select = self.RGB_bands
@@ -334,6 +995,16 @@ class WeatherDownloader(DownloaderModule):
         super().set_default_parameters()
         self.num_files_per_point = 2
 
+    def get_cache_params(self, date_range, bounds=None):
+        cache_params = super().get_cache_params(date_range, bounds)
+        cache_params.update(
+            {
+                "temperature_band": list(self.temperature_band),
+                "precipitation_band": list(self.precipitation_band),
+            }
+        )
+        return cache_params
+
     def prep_images(self, dataset):
         """
         Take a dataset that has already been filtered by date and location,
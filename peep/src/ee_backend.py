@@ -0,0 +1,88 @@
+"""
+Lazy access to the Google Earth Engine API.
+
+Modules that talk to GEE use the `ee` and `cloud_mask` objects from here in
+place of the `ee` module and `geetools.cloud_mask`.  The backend providing
+them is only initialized the first time one of their attributes is used, so
+importing the downloaders doesn't need network access or credentials.
+
+The backend can be swapped, e.g. for the FakeEEBackend in fake_ee.py,
+either by calling set_ee_backend() or by setting the environment variable
+PEEP_EE_BACKEND to "fake" before the first use.
+"""
+
+import os
+import threading
+
+_ee_backend = None
+_ee_backend_lock = threading.Lock()
+
+
+class EarthEngineBackend:
+    """
+    The real Earth Engine API.  A backend needs an initialize() method,
+    after which its `ee` and `cloud_mask` attributes can be used.
+    """
+
+    def __init__(self):
+        self.ee = None
+        self.cloud_mask = None
+
+    def initialize(self):
+        import ee
+
+        ee.Initialize()
+        # geetools needs Earth Engine to be initialized first
+        from geetools import cloud_mask
+
+        self.ee = ee
+        self.cloud_mask = cloud_mask
+
+
+def set_ee_backend(backend):
+    """
+    Use the given backend (e.g. EarthEngineBackend or FakeEEBackend) for all
+    later calls to the Earth Engine API.  It is initialized here.
+    """
+    global _ee_backend
+    with _ee_backend_lock:
+        backend.initialize()
+        _ee_backend = backend
+
+
+def get_ee_backend():
+    """
+    Return the backend in use, choosing and initializing it on first use.
+    """
+    global _ee_backend
+    with _ee_backend_lock:
+        if _ee_backend is None:
+            if os.environ.get("PEEP_EE_BACKEND") == "fake":
+                from .fake_ee import FakeEEBackend
+
+                backend = FakeEEBackend()
+            else:
+                backend = EarthEngineBackend()
+            backend.initialize()
+            _ee_backend = backend
+    return _ee_backend
+
+
+class _LazyBackendAttribute:
+    """
+    Stands in for a module provided by the backend, e.g. `ee`, and forwards
+    attribute lookups to it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(getattr(get_ee_backend(), self._name), attribute)
+
+    def __repr__(self):
+        return "<lazy {} from the Earth Engine backend>".format(self._name)
+
+
+ee = _LazyBackendAttribute("ee")
+cloud_mask = _LazyBackendAttribute("cloud_mask")
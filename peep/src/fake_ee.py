@@ -0,0 +1,374 @@
+"""
+A fake Earth Engine backend, which can stand in for GEE (see ee_backend.py)
+to run the downloaders offline, e.g. in tests and benchmarks.
+
+It implements the small part of the Earth Engine API that the downloaders
+use.  Every collection has one image every `revisit_days` days, covering
+everywhere, and each band of an image has a constant value.  Asking for a
+download URL writes a zipfile of georeferenced tif files for the requested
+region and scale, as GEE would, and serves it from a local HTTP server.
+"""
+
+import collections
+import datetime
+import functools
+import http.server
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import uuid
+import zipfile
+import zlib
+
+import numpy as np
+import rasterio
+import rasterio.transform
+
+
+def fake_band_value(band, image_number):
+    """
+    The pixel value of a band in the image_number-th image of a collection.
+    """
+    return float(zlib.crc32(band.encode("utf-8")) % 1000 + image_number)
+
+
+def get_info(value):
+    """
+    Evaluate a (possibly nested) fake computed value, as getInfo() would.
+    """
+    if isinstance(value, (FakeComputedObject, FakeList)):
+        return value.getInfo()
+    if isinstance(value, dict):
+        return {k: get_info(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [get_info(v) for v in value]
+    return value
+
+
+class FakeComputedObject:
+    """
+    A value that, in GEE, would be computed on the server.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def getInfo(self):
+        return get_info(self.value)
+
+
+class FakeList:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def map(self, func):
+        return FakeList(func(item) for item in self.items)
+
+    def getInfo(self):
+        return [get_info(item) for item in self.items]
+
+
+class FakeGeometry:
+    """
+    A rectangle (or point), as [left, bottom, right, top] in projection proj.
+    """
+
+    def __init__(self, bounds, proj=None):
+        self.bounds = list(bounds)
+        self.proj = proj
+
+    @staticmethod
+    def Point(coords, proj=None):
+        return FakeGeometry([coords[0], coords[1], coords[0], coords[1]], proj)
+
+    @staticmethod
+    def Rectangle(coords, proj=None, evenOdd=True):
+        lower_left, top_right = coords
+        return FakeGeometry(
+            [
+                lower_left.bounds[0],
+                lower_left.bounds[1],
+                top_right.bounds[0],
+                top_right.bounds[1],
+            ],
+            proj,
+        )
+
+
+class FakeFilter:
+    @staticmethod
+    def lt(name, value):
+        return ("lt", name, value)
+
+
+class FakeImage:
+    """
+    An image with constant-valued bands.  get_value(band) gives the value
+    of a band - any band name can be selected.
+    """
+
+    def __init__(self, image=None, band_names=None, get_value=None, backend=None):
+        if isinstance(image, FakeImage):
+            band_names, get_value, backend = (
+                image.band_names,
+                image.get_value,
+                image.backend,
+            )
+        self.band_names = list(band_names or [])
+        self.get_value = get_value or (lambda band: 0.0)
+        self.backend = backend
+
+    def derived(self, band_names, get_value):
+        return FakeImage(
+            band_names=band_names, get_value=get_value, backend=self.backend
+        )
+
+    def bandNames(self):
+        return FakeComputedObject(list(self.band_names))
+
+    def select(self, bands):
+        if isinstance(bands, str):
+            bands = [bands]
+        return self.derived(bands, self.get_value)
+
+    def rename(self, names):
+        if isinstance(names, str):
+            names = [names]
+        old_names = dict(zip(names, self.band_names))
+        return self.derived(names, lambda band: self.get_value(old_names[band]))
+
+    def addBands(self, image):
+        new_bands = [band for band in image.band_names if band not in self.band_names]
+
+        def get_value(band):
+            if band in image.band_names:
+                return image.get_value(band)
+            return self.get_value(band)
+
+        return self.derived(self.band_names + new_bands, get_value)
+
+    def normalizedDifference(self, bands):
+        first, second = [self.get_value(band) for band in bands]
+        value = (first - second) / (first + second) if first + second else 0.0
+        return self.derived(["nd"], lambda band: value)
+
+    @staticmethod
+    def cat(images):
+        image = images[0]
+        for other in images[1:]:
+            image = image.addBands(other)
+        return image
+
+    def getDownloadURL(self, params):
+        return self.backend.serve_image(self, params)
+
+
+class FakeImageCollection:
+    """
+    A collection with one image every backend.revisit_days days within
+    the date range given by filterDate.
+    """
+
+    def __init__(self, name, backend=None, images=None):
+        self.name = name
+        self.backend = backend
+        self.images = images or []
+        if backend and images is None:
+            backend.calls["ImageCollection"] += 1
+
+    def with_images(self, images):
+        return FakeImageCollection(self.name, self.backend, list(images))
+
+    def filterBounds(self, geom):
+        # images cover everywhere
+        return self
+
+    def filterDate(self, start_date, end_date):
+        start = datetime.date.fromisoformat(start_date)
+        end = datetime.date.fromisoformat(end_date)
+        n_images = max(0, (end - start).days + self.backend.revisit_days - 1)
+        n_images = n_images // self.backend.revisit_days
+        return self.with_images(
+            FakeImage(
+                band_names=self.backend.band_names,
+                get_value=functools.partial(fake_band_value, image_number=i),
+                backend=self.backend,
+            )
+            for i in range(n_images)
+        )
+
+    def filter(self, ee_filter):
+        # no images are too cloudy
+        return self
+
+    def map(self, func):
+        return self.with_images(func(image) for image in self.images)
+
+    def select(self, bands):
+        return self.map(lambda image: image.select(bands))
+
+    def size(self):
+        return FakeComputedObject(len(self.images))
+
+    def toList(self, count):
+        return FakeList(self.images[:count])
+
+    def first(self):
+        return self.images[0]
+
+    def reduce(self, reducer):
+        band_names = self.images[0].band_names if self.images else []
+        images = list(self.images)
+        return FakeImage(
+            band_names=band_names,
+            get_value=lambda band: reducer([image.get_value(band) for image in images]),
+            backend=self.backend,
+        )
+
+    def median(self):
+        return self.reduce(statistics.median)
+
+    def mean(self):
+        return self.reduce(statistics.mean)
+
+    def sum(self):
+        return self.reduce(sum)
+
+    def count(self):
+        return self.reduce(len)
+
+
+class FakeEE:
+    """
+    Stands in for the `ee` module.
+    """
+
+    Geometry = FakeGeometry
+    Filter = FakeFilter
+    Image = FakeImage
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def ImageCollection(self, name):
+        return FakeImageCollection(name, self.backend, None)
+
+    def Dictionary(self, values):
+        return FakeComputedObject(values)
+
+    def Initialize(self):
+        pass
+
+
+class FakeCloudMask:
+    """
+    Stands in for geetools.cloud_mask - the masks do nothing.
+    """
+
+    def sentinel2(self):
+        return lambda image: image
+
+    def landsat8SRPixelQA(self):
+        return lambda image: image
+
+    def landsat457SRPixelQA(self):
+        return lambda image: image
+
+
+class _QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeEEBackend:
+    """
+    Earth Engine backend whose downloads are served from a local HTTP server.
+    calls counts the collections built and download URLs requested.
+
+    Parameters
+    ==========
+    band_names: list of str, the bands of the images in every collection.
+    revisit_days: int, days between images in a collection.
+    """
+
+    DEFAULT_BAND_NAMES = [
+        "B2",
+        "B3",
+        "B4",
+        "B8",
+        "SR_B2",
+        "SR_B3",
+        "SR_B4",
+        "SR_B5",
+        "total_precipitation",
+        "mean_2m_air_temperature",
+    ]
+
+    def __init__(self, band_names=None, revisit_days=5):
+        self.band_names = band_names or self.DEFAULT_BAND_NAMES
+        self.revisit_days = revisit_days
+        self.calls = collections.Counter()
+        self.ee = FakeEE(self)
+        self.cloud_mask = FakeCloudMask()
+        self.serve_dir = None
+        self.server = None
+
+    def initialize(self):
+        if self.server:
+            return
+        self.serve_dir = tempfile.mkdtemp(prefix="fake_ee_")
+        handler = functools.partial(_QuietRequestHandler, directory=self.serve_dir)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        shutil.rmtree(self.serve_dir, ignore_errors=True)
+
+    def serve_image(self, image, params):
+        """
+        Write the zipfile GEE would give for getDownloadURL(params),
+        and return the URL it is served from.
+        """
+        self.calls["getDownloadURL"] += 1
+        left, bottom, right, top = params["region"].bounds
+        scale = params.get("scale", 10)
+        crs = params.get("crs") or params["region"].proj or "EPSG:4326"
+        width = max(1, int(round((right - left) / scale)))
+        height = max(1, int(round((top - bottom) / scale)))
+        profile = {
+            "driver": "GTiff",
+            "height": height,
+            "width": width,
+            "dtype": "float32",
+            "crs": crs,
+            "transform": rasterio.transform.from_origin(left, top, scale, scale),
+        }
+        if params.get("filePerBand", True):
+            tif_bands = {
+                "download.{}.tif".format(band): [band] for band in image.band_names
+            }
+        else:
+            tif_bands = {"download.tif": image.band_names}
+        zip_filename = "{}.zip".format(uuid.uuid4().hex)
+        with tempfile.TemporaryDirectory() as tempdir, zipfile.ZipFile(
+            os.path.join(self.serve_dir, zip_filename), "w"
+        ) as zip_obj:
+            for tif_filename, bands in tif_bands.items():
+                tif_path = os.path.join(tempdir, tif_filename)
+                with rasterio.open(tif_path, "w", count=len(bands), **profile) as tif:
+                    for i, band in enumerate(bands):
+                        tif.write(
+                            np.full((height, width), image.get_value(band), "float32"),
+                            i + 1,
+                        )
+                    tif.descriptions = tuple(bands)
+                zip_obj.write(tif_path, tif_filename)
+        return "http://127.0.0.1:{}/{}".format(
+            self.server.server_address[1], zip_filename
+        )
@@ -1,7 +1,12 @@
 import datetime
 import json
 import os
+import random
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
 from zipfile import BadZipFile, ZipFile
 
 import numpy as np
@@ -16,6 +21,21 @@ else:
 
 LOGFILE = os.path.join(TMPDIR, "failed_downloads.log")
 
+# size of the chunks in which downloads are read and written
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# number of connections kept open to each host by the shared download session
+DOWNLOAD_POOL_SIZE = 16
+# how many times to retry a download after a dropped connection, timeout
+# or one of RETRY_STATUS_CODES, and the base of the exponential backoff (seconds)
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 2.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# (connect, read) timeouts in seconds
+DOWNLOAD_TIMEOUT = (30, 300)
+
+_download_session = None
+_download_session_lock = threading.Lock()
+
 
 def split_filepath(path):
     allparts = []
@@ -62,10 +82,142 @@ def get_filepath_after_directory(path, dirname, include_dirname=False):
     return os.path.join(*output_parts)
 
 
-def download_and_unzip(url, output_tmpdir):
+def get_download_session():
+    """
+    Return the requests.Session shared by all downloads in this process,
+    so that connections to the GEE servers are pooled and reused.
+    """
+    global _download_session
+    with _download_session_lock:
+        if _download_session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _download_session = session
+    return _download_session
+
+
+def download_to_buffer(
+    url,
+    retries=DOWNLOAD_RETRIES,
+    backoff=DOWNLOAD_BACKOFF,
+    timeout=DOWNLOAD_TIMEOUT,
+    download_stats=None,
+):
+    """
+    Stream the contents of a URL, in chunks, into a temporary file.
+    Dropped connections, timeouts, and HTTP errors in RETRY_STATUS_CODES
+    are retried, waiting backoff * 2^n seconds (with random jitter)
+    before the n-th retry.
+
+    Parameters
+    ==========
+    url: str, URL to download.
+    retries: int, maximum number of times to retry.
+    backoff: float, base of the wait between retries, in seconds.
+    timeout: float, or (connect, read) tuple/list of timeouts in seconds.
+    download_stats: dict, optional.  If given, the "retries" and "bytes"
+                    entries are increased by the number of retries and
+                    bytes downloaded.
+
+    Returns
+    =======
+    tempfile.TemporaryFile, positioned at the start.
+    """
+    if download_stats is not None:
+        download_stats.setdefault("retries", 0)
+        download_stats.setdefault("bytes", 0)
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            if download_stats is not None:
+                download_stats["retries"] += 1
+            time.sleep(get_retry_wait(backoff, attempt))
+        buffer, error, retryable = try_download_to_buffer(url, timeout, download_stats)
+        if buffer:
+            return buffer
+        if not retryable:
+            break
+    raise error
+
+
+def get_retry_wait(backoff, attempt):
+    """
+    Time to wait before the given retry (counting from 1), in seconds:
+    backoff * 2^(attempt-1), with random jitter.
+    """
+    return backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+def try_download_to_buffer(url, timeout=DOWNLOAD_TIMEOUT, download_stats=None):
+    """
+    Make a single attempt at streaming the contents of a URL into a buffer,
+    as used by download_to_buffer.
+
+    Parameters
+    ==========
+    url: str, URL to download.
+    timeout: float, or (connect, read) tuple/list of timeouts in seconds.
+    download_stats: dict, optional.  If given, the "bytes" entry is
+                    increased by the number of bytes downloaded.
+
+    Returns
+    =======
+    tuple (buffer, error, retryable): buffer is a
+    tempfile.TemporaryFile positioned at the start, or None if the
+    download failed, in which case error is a RuntimeError saying why, and
+    retryable is True if it is worth trying again.
     """
-    Given a URL from GEE, download it (will be a zipfile) to
-    a temporary directory, then extract archive to that same dir.
+    if isinstance(timeout, list):
+        # e.g. from a json config - requests needs a tuple
+        timeout = tuple(timeout)
+    session = get_download_session()
+    # not a SpooledTemporaryFile, which ZipFile can't read before Python 3.11
+    buffer = tempfile.TemporaryFile()
+    try:
+        with session.get(url, stream=True, timeout=timeout) as r:
+            if r.status_code == 200:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+                    if download_stats is not None:
+                        download_stats["bytes"] = download_stats.get("bytes", 0) + len(
+                            chunk
+                        )
+                buffer.seek(0)
+                return buffer, None, False
+            error = RuntimeError(
+                " HTTP Error {} getting download link {}".format(r.status_code, url)
+            )
+            retryable = r.status_code in RETRY_STATUS_CODES
+    except (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    ) as e:
+        error = RuntimeError("Error getting download link {}: {}".format(url, e))
+        retryable = True
+    buffer.close()
+    return None, error, retryable
+
+
+def download_and_unzip(
+    url,
+    output_tmpdir,
+    file_endings=None,
+    retries=DOWNLOAD_RETRIES,
+    backoff=DOWNLOAD_BACKOFF,
+    timeout=DOWNLOAD_TIMEOUT,
+    download_stats=None,
+):
+    """
+    Given a URL from GEE, download it (will be a zipfile),
+    then extract the archive to the given directory.
+    The download is streamed in chunks by download_to_buffer (retrying on
+    transient errors), and the wanted members of the archive are written
+    straight to the output directory, so memory use does not depend on the
+    size of the download.
     Then find the base filename of the resulting .tif files (there
     should be one-file-per-band) and return that.
 
@@ -73,6 +225,9 @@ def download_and_unzip(url, output_tmpdir):
     ==========
     url: str, URL of zipfile on GEE server.
     output_tmpdir: str, full path of directory into which to unpack zipfile.
+    file_endings: list of str, optional.  If given, only members of the
+                  archive with those endings will be extracted.
+    retries, backoff, timeout, download_stats: passed to download_to_buffer.
 
     Returns
     =======
@@ -80,29 +235,39 @@ def download_and_unzip(url, output_tmpdir):
     """
 
     # GET the URL
-    r = requests.get(url)
-    if not r.status_code == 200:
-        raise RuntimeError(
-            " HTTP Error {} getting download link {}".format(r.status_code, url)
-        )
+    zip_buffer = download_to_buffer(url, retries, backoff, timeout, download_stats)
+    return unzip_buffer(zip_buffer, url, output_tmpdir, file_endings)
+
+
+def unzip_buffer(zip_buffer, url, output_tmpdir, file_endings=None):
+    """
+    Extract a downloaded zipfile to the given directory, then close it,
+    as for download_and_unzip.
+
+    Parameters
+    ==========
+    zip_buffer: file-like object, from download_to_buffer.
+    url: str, the URL it was downloaded from, logged if it isn't a zipfile.
+    output_tmpdir: str, full path of directory into which to unpack zipfile.
+    file_endings: list of str, optional, see download_and_unzip.
+
+    Returns
+    =======
+    tif_filenames: list of strings, the full paths to unpacked tif files.
+    """
     os.makedirs(output_tmpdir, exist_ok=True)
-    output_zipfile = os.path.join(output_tmpdir, "gee.zip")
-    with open(output_zipfile, "wb") as outfile:
-        outfile.write(r.content)
     # catch zipfile-related exceptions here, and if they arise,
-    # write the name of the zipfile and the url to a logfile
+    # write the output directory and the url to a logfile
     try:
-        with ZipFile(output_zipfile, "r") as zip_obj:
-            zip_obj.extractall(path=output_tmpdir)
+        with zip_buffer, ZipFile(zip_buffer, "r") as zip_obj:
+            extracted_files = extract_zip_members(zip_obj, output_tmpdir, file_endings)
     except (BadZipFile):
         with open(LOGFILE, "a") as logfile:
             logfile.write(
-                "{}: {} {}\n".format(str(datetime.now()), output_zipfile, url)
+                "{}: {} {}\n".format(str(datetime.datetime.now()), output_tmpdir, url)
             )
         return None
-    tif_files = [
-        filename for filename in os.listdir(output_tmpdir) if filename.endswith(".tif")
-    ]
+    tif_files = [filename for filename in extracted_files if filename.endswith(".tif")]
     if len(tif_files) == 0:
         raise RuntimeError("No files extracted")
 
@@ -119,6 +284,37 @@ def download_and_unzip(url, output_tmpdir):
     return tif_filenames
 
 
+def extract_zip_members(zip_obj, output_dir, file_endings=None):
+    """
+    Copy files from an open zipfile into a directory, one chunk at a time.
+    Any directory structure inside the archive is ignored.
+
+    Parameters
+    ==========
+    zip_obj: zipfile.ZipFile, open for reading.
+    output_dir: str, directory to write the files to.
+    file_endings: list of str, optional.  If given, only files with those
+                  endings will be extracted.
+
+    Returns
+    =======
+    list of str, the names of the extracted files.
+    """
+    extracted_files = []
+    for member in zip_obj.infolist():
+        filename = os.path.basename(member.filename)
+        if member.is_dir() or not filename:
+            continue
+        if file_endings and not any(filename.endswith(e) for e in file_endings):
+            continue
+        with zip_obj.open(member) as infile, open(
+            os.path.join(output_dir, filename), "wb"
+        ) as outfile:
+            shutil.copyfileobj(infile, outfile, DOWNLOAD_CHUNK_SIZE)
+        extracted_files.append(filename)
+    return extracted_files
+
+
 def save_json(out_dict, output_dir, output_filename, verbose=False):
     """
     Given a dictionary, save
@@ -169,6 +365,152 @@ def save_array(image, output_dir, output_filename, file_extension, verbose=False
         print("Saved image '{}'".format(output_path))
 
 
+def save_tile_store(tiles, tile_keys, output_dir, output_filebase, verbose=False):
+    """
+    Save many equally-sized sub-images into one chunked, memory-mappable
+    .npy file (one chunk per sub-image), along with a json index that maps
+    each sub-image's key (e.g. number and coordinates) to the byte offset
+    of its chunk in the .npy file.
+
+    Parameters
+    ==========
+    tiles: sequence of numpy arrays, all with the same shape and dtype,
+           or one numpy array with shape (n_tiles, ...).  If there are
+           none, an empty store is written.
+    tile_keys: list of dicts, one per tile, e.g. {"sub": 0, "x": 532480, "y": 184000}
+    output_dir: str, directory in which to write the files
+    output_filebase: str, the files will be <output_filebase>.npy and
+                     <output_filebase>_index.json
+
+    Returns
+    =======
+    index_path: str, full path to the index json file
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    if len(tiles) != len(tile_keys):
+        raise RuntimeError(
+            "Got {} tiles but {} tile keys".format(len(tiles), len(tile_keys))
+        )
+    store_filename = output_filebase + ".npy"
+    if len(tiles) == 0:
+        # e.g. an image smaller than one sub-image - write an empty store,
+        # with the tile shape if we can tell what it would have been
+        empty = np.asarray(tiles)
+        tile_shape = tuple(empty.shape[1:])
+        dtype = empty.dtype
+        np.save(os.path.join(output_dir, store_filename), empty)
+        store_offset = 0
+        tile_nbytes = 0
+    else:
+        tile_shape = tuple(tiles[0].shape)
+        dtype = np.asarray(tiles[0]).dtype
+        store = np.lib.format.open_memmap(
+            os.path.join(output_dir, store_filename),
+            mode="w+",
+            dtype=dtype,
+            shape=(len(tiles),) + tile_shape,
+        )
+        for i, tile in enumerate(tiles):
+            store[i] = tile
+        store.flush()
+        store_offset = store.offset
+        tile_nbytes = store[0].nbytes
+        del store
+    index = {
+        "store_filename": store_filename,
+        "dtype": dtype.str,
+        "tile_shape": list(tile_shape),
+        "n_tiles": len(tiles),
+        "tile_nbytes": tile_nbytes,
+        "tiles": [
+            dict(key, position=i, offset=store_offset + i * tile_nbytes)
+            for i, key in enumerate(tile_keys)
+        ],
+    }
+    save_json(index, output_dir, output_filebase + "_index.json")
+    if verbose:
+        print(
+            "Saved {} sub-images to '{}'".format(
+                len(tiles), os.path.join(output_dir, store_filename)
+            )
+        )
+    return os.path.join(output_dir, output_filebase + "_index.json")
+
+
+def read_tile_store(index_path):
+    """
+    Open a tile store written by save_tile_store, without reading the
+    sub-images into memory.
+
+    Parameters
+    ==========
+    index_path: str, full path to the <output_filebase>_index.json file
+
+    Returns
+    =======
+    store: read-only numpy memmap, shape (n_tiles, ...)
+    index: dict, the contents of the index json file
+    """
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    store = np.load(
+        os.path.join(os.path.dirname(index_path), index["store_filename"]),
+        mmap_mode="r",
+    )
+    return store, index
+
+
+def read_tile(index_path, **key):
+    """
+    Read a single sub-image from a tile store written by save_tile_store,
+    by memory-mapping only that sub-image's chunk of the file.
+
+    Parameters
+    ==========
+    index_path: str, full path to the <output_filebase>_index.json file
+    key: the values identifying the sub-image, e.g. sub=3, or x=532480, y=184000
+
+    Returns
+    =======
+    tile: read-only numpy memmap with the sub-image
+    """
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    for tile_info in index["tiles"]:
+        if all(tile_info.get(k) == v for k, v in key.items()):
+            return np.memmap(
+                os.path.join(os.path.dirname(index_path), index["store_filename"]),
+                dtype=np.dtype(index["dtype"]),
+                mode="r",
+                offset=tile_info["offset"],
+                shape=tuple(index["tile_shape"]),
+            )
+    raise KeyError("No sub-image matching {} in {}".format(key, index_path))
+
+
+def save_table(table, output_dir, output_filename, verbose=False):
+    """
+    Given a pandas DataFrame, save it to requested filename - the file
+    extension determines the output format, either .parquet or .csv.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, output_filename)
+    if output_filename.endswith(".parquet"):
+        table.to_parquet(output_path, index=False)
+    elif output_filename.endswith(".csv"):
+        table.to_csv(output_path, index=False)
+    else:
+        raise RuntimeError(
+            "Unknown table format for {} - must be .parquet or .csv".format(
+                output_filename
+            )
+        )
+    if verbose:
+        print("Saved table '{}'".format(output_path))
+
+
 def construct_image_savepath(
     output_dir, collection_name, coords, date_range, image_type
 ):
@@ -4,14 +4,9 @@ Functions to help interface with GEE, in particular to download images.
 
 import os
 
-import ee
-from geetools import cloud_mask
-
+from .ee_backend import cloud_mask, ee
 from .file_utils import download_and_unzip
 
-ee.Initialize()
-
-
 if os.name == "posix":
     TMPDIR = "/tmp/"
 else:
@@ -78,6 +73,43 @@ def apply_mask_cloud(image_coll, collection_name, cloudy_pix_flag):
     return image_coll
 
 
+def get_collection_info(dataset, filtered_dataset=None):
+    """
+    Get the metadata we need before downloading - the number of images in
+    a collection before and after any (e.g. cloud) filtering, and the band
+    names of its first image - in a single request to the server.
+
+    Parameters
+    ----------
+    dataset : ee.ImageCollection
+        The ImageCollection filtered by location and date.
+    filtered_dataset : ee.ImageCollection, optional
+        The same collection after further filtering.  If not given,
+        filtered_size will be the same as size.
+
+    Returns
+    ----------
+    dict
+        {"size": int, "filtered_size": int, "band_names": list of str},
+        band_names is empty if there are no images.
+    """
+    if filtered_dataset is None:
+        filtered_dataset = dataset
+    info = ee.Dictionary(
+        {
+            "size": dataset.size(),
+            "filtered_size": filtered_dataset.size(),
+            # a list of (at most one) list of band names, so that this is
+            # still valid for an empty collection
+            "band_names": dataset.toList(1).map(
+                lambda image: ee.Image(image).bandNames()
+            ),
+        }
+    ).getInfo()
+    info["band_names"] = info["band_names"][0] if info["band_names"] else []
+    return info
+
+
 def add_NDVI(image, red_band, near_infrared_band):
     try:
         image_ndvi = image.normalizedDifference([near_infrared_band, red_band]).rename(
@@ -137,31 +169,37 @@ def ee_prep_data(
 
     #  gather relevant images
     dataset = image_coll.filterBounds(geom).filterDate(start_date, end_date)
-    dataset_size = dataset.size().getInfo()
-
-    # check we have enough images to work with
-    if dataset.size().getInfo() == 0:
-        print("No images found in this date rage, skipping.")
-        log_msg = "WARN >>> No data found."
-        return [], log_msg
 
     # store the type of data we are working with
     data_type = collection_dict["type"]
 
     # mask clouds in images
+    masked_dataset = dataset
     if mask_cloud and data_type == "vegetation":
-        dataset = apply_mask_cloud(
+        masked_dataset = apply_mask_cloud(
             dataset, collection_name, collection_dict["cloudy_pix_flag"]
         )
 
+    # get the numbers of images before and after cloud masking in one go
+    collection_info = get_collection_info(dataset, masked_dataset)
+    dataset_size = collection_info["size"]
+    valid_size = collection_info["filtered_size"]
+    dataset = masked_dataset
+
+    # check we have enough images to work with
+    if dataset_size == 0:
+        print("No images found in this date rage, skipping.")
+        log_msg = "WARN >>> No data found."
+        return [], log_msg
+
     # check we have enough images to work with after cloud masking
-    if dataset.size().getInfo() == 0:
+    if valid_size == 0:
         print("No valid images found in this date rage, skipping.")
         log_msg = f"WARN >>> Found 0/{dataset_size} valid images after cloud filtering."
         return [], log_msg
     else:
         print(
-            f"Found {dataset.size().getInfo()} valid images of {dataset_size} total images in this date range."
+            f"Found {valid_size} valid images of {dataset_size} total images in this date range."
         )
 
     image_list = []
@@ -208,7 +246,7 @@ def ee_prep_data(
         url = image.getDownloadURL({"region": region, "scale": scale})
         url_list.append(url)
 
-    log_msg = f"OK   >>> Found {dataset.size().getInfo()}/{dataset_size} valid images after cloud filtering."
+    log_msg = f"OK   >>> Found {valid_size}/{dataset_size} valid images after cloud filtering."
     return url_list, log_msg
 
 
@@ -7,21 +7,19 @@ pip install --upgrade pillow
 """
 
 import os
-import sys
 
 import cv2 as cv
-import imageio
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import rasterio
+import rasterio.merge
 from PIL import Image
 
-from .coordinate_utils import get_sub_image_coords
+from .colour_maps import VIRIDIS_LUT
+from .coordinate_utils import get_sub_image_coords, get_sub_image_coords_grid
 from .file_utils import save_image
 
-matplotlib.use("PS")
+# name of the file GEE puts all the bands in, if asked for a single file
+MULTIBAND_TIF_FILENAME = "download.tif"
 
 
 def image_from_array(input_array, output_size=None, sel_val=200):
@@ -31,19 +29,15 @@ def image_from_array(input_array, output_size=None, sel_val=200):
     the corresponding value in the array.
     If an output size is specified, rescale to this size.
     """
-    size_x, size_y = input_array.shape
-    new_img = Image.new("RGB", (size_x, size_y))
-    # count the number of distinct values in the array
-    for ix in range(size_x):
-        for iy in range(size_y):
-            val = int(input_array[ix, iy])
-
-            if val == sel_val:
-                new_img.putpixel((ix, iy), (0, val, val))
-            else:
-                new_img.putpixel((ix, iy), (val, val, val))
+    # note that the first index of the array is used as the x (column)
+    # coordinate of the image.
+    vals = np.asarray(input_array).astype(np.int64).transpose()
+    rgb = np.stack([vals, vals, vals], axis=-1)
+    # highlight pixels with the selected value
+    rgb[vals == sel_val, 0] = 0
+    new_img = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
     if output_size:
-        new_img = new_img.resize((output_size, output_size), Image.ANTIALIAS)
+        new_img = new_img.resize((output_size, output_size), Image.LANCZOS)
     return new_img
 
 
@@ -62,18 +56,120 @@ def invert_binary_image(image):
     """
     Swap (255,255,255) with (0,0,0) for all pixels
     """
-    new_img = Image.new("RGB", image.size)
-    pix = image.load()
-    for ix in range(image.size[0]):
-        for iy in range(image.size[1]):
-            if sum(pix[ix, iy]) == 0:
-                new_img.putpixel((ix, iy), (255, 255, 255))
-            else:
-                new_img.putpixel((ix, iy), (0, 0, 0))
-    return new_img
+    return binary_image_from_mask(sum_pixel_values(image) == 0)
+
+
+def image_to_array(image):
+    """
+    Convert a PIL Image to a numpy array of pixel values, with the same
+    values as the Image's pixel access object would give, i.e. 0 or 255 for
+    1-bit images.
+
+    Parameters
+    ==========
+    image: PIL Image
+
+    Returns
+    =======
+    pix: numpy array, shape (rows, columns) or (rows, columns, bands)
+    """
+    if image.mode == "1":
+        image = image.convert("L")
+    return np.asarray(image)
+
+
+def sum_pixel_values(image):
+    """
+    Sum the values of all bands (e.g. r+g+b) for every pixel of an image.
+
+    Parameters
+    ==========
+    image: PIL Image
+
+    Returns
+    =======
+    totals: 2D numpy array, shape (rows, columns)
+    """
+    pix = image_to_array(image)
+    if pix.ndim == 3:
+        return pix.sum(axis=2, dtype=np.int64)
+    return pix
+
+
+def binary_image_from_mask(mask):
+    """
+    Create a black and white RGB image, with pixels set to (255,255,255)
+    where mask is True, and (0,0,0) where it is False.
+
+    Parameters
+    ==========
+    mask: 2D numpy array of bool, shape (rows, columns)
+
+    Returns
+    =======
+    new_img: PIL Image
+    """
+    rgb = np.zeros(mask.shape + (3,), dtype=np.uint8)
+    rgb[mask] = 255
+    return Image.fromarray(rgb)
+
+
+def read_tif_band(input_filename):
+    """
+    Read a single-band tif file into a 2D numpy array, keeping the
+    original bit depth of the pixel values.
+
+    Parameters
+    ==========
+    input_filename: str, location of input tif file
+
+    Returns
+    =======
+    pix: 2D numpy array, indexed as [row, column]
+    """
+    pix = cv.imread(input_filename, cv.IMREAD_ANYDEPTH)
+    if pix is None:
+        raise RuntimeError("Unable to read tif file {}".format(input_filename))
+    return pix
+
+
+def get_band_array(band_info):
+    """
+    Return the pixel values for one entry of a band_dict, using the
+    already-loaded array if there is one, or reading the tif file otherwise.
+
+    Parameters
+    ==========
+    band_info: dict, format {'band': <band_name>, 'filename': <filename>,
+                             'array': <2D numpy array, optional>}
+    """
+    if band_info.get("array") is not None:
+        return band_info["array"]
+    return read_tif_band(band_info["filename"])
+
+
+def scale_bands_to_rgb(bands):
+    """
+    Rescale a list of 2D arrays (one per r,g,b band) to 8-bit values, using
+    the overall maximum over all bands, so that the relative intensities of
+    the bands are preserved.  Values are truncated towards zero, negative
+    (and NaN) values are set to 0.
+
+    Parameters
+    ==========
+    bands: list of 2D numpy arrays, all with the same shape.
+
+    Returns
+    =======
+    rgb_array: 3D numpy array of uint8, shape (rows, columns, n_bands)
+    """
+    # Take the overall max of the bands to be the value to scale down with.
+    overall_max = float(max(np.nanmax(band) for band in bands))
+    scaled = np.stack(bands, axis=-1).astype(np.float64) * 255 / (overall_max + 1)
+    scaled = np.nan_to_num(np.trunc(scaled), nan=0.0)
+    return np.clip(scaled, 0, 255).astype(np.uint8)
 
 
-# def combine_tif(input_files, bands=["B4", "B3", "B2"]):
 def combine_tif(band_dict):
     """
     Read tif files - one per specified band, and rescale and combine
@@ -82,114 +178,104 @@ def combine_tif(band_dict):
     Parameters
     ==========
     band_dict: dict, format {'<r|g|b>': {'band': <band_name>, 'filename': <filename>}}
+               if an 'array' is also given for a band, it is used instead of
+               reading the file.
 
     Returns
     =======
     new_img: PIL Image, 8-bit rgb image.
     """
-    for v in band_dict.values():
-        v["min_val"] = sys.maxsize
-        v["max_val"] = -1 * sys.maxsize
-        v["pix_vals"] = []
-
-    for col in band_dict.keys():
-        pix = cv.imread(band_dict[col]["filename"], cv.IMREAD_ANYDEPTH).transpose()
-        # find the minimum and maximum pixel values in the original scale
-        for ix in range(pix.shape[0]):
-            for iy in range(pix.shape[1]):
-                if pix[ix, iy] > band_dict[col]["max_val"]:
-                    band_dict[col]["max_val"] = pix[ix, iy]
-                elif pix[ix, iy] < band_dict[col]["min_val"]:
-                    band_dict[col]["min_val"] = pix[ix, iy]
-        band_dict[col]["pix_vals"] = pix
-    # Take the overall max of the three bands to be the value to scale down with.
-    overall_max = max((band_dict[col]["max_val"] for col in ["r", "g", "b"]))
-
-    # create a new image where we will fill RGB pixel values from 0 to 255
-    def get_pix_val(ix, iy, col):
-        return max(
-            0,
-            int(
-                band_dict[col]["pix_vals"][ix, iy]
-                * 255
-                / (overall_max + 1)  # band_dict[col]["max_val"]
-            ),
-        )
+    bands = [get_band_array(band_dict[col]) for col in ["r", "g", "b"]]
+    return Image.fromarray(scale_bands_to_rgb(bands))
 
-    new_img = Image.new("RGB", pix.shape)
-    for ix in range(new_img.size[0]):
-        for iy in range(new_img.size[1]):
-            new_img.putpixel(
-                (ix, iy), tuple(get_pix_val(ix, iy, col) for col in ["r", "g", "b"])
-            )
-    return new_img
+
+def ndvi_to_greyscale(ndvi):
+    """
+    Apply the global linear transform [-1, 1] -> [0, 255] to an NDVI band
+    (tested in issue #224).  Values are truncated towards zero, and
+    anything outside the range (or NaN) is clipped to 0 or 255.
+
+    Parameters
+    ==========
+    ndvi: str or 2D numpy array, either the location of the NDVI tif file,
+          or the already-loaded band.
+
+    Returns
+    =======
+    grey: 2D numpy array of uint8, same shape as the input band.
+    """
+    if isinstance(ndvi, str):
+        ndvi = read_tif_band(ndvi)
+    grey = np.trunc((ndvi.astype(np.float64) + 1) / 2 * 255)
+    grey = np.nan_to_num(grey, nan=0.0)
+    return np.clip(grey, 0, 255).astype(np.uint8)
 
 
-def scale_tif(input_filename):
+def scale_tif(input_tif):
     """
     Given only a single band, scale to range 0,255 and apply this
     value to all of r,g,b
 
     Parameters
     ==========
-    input_filename: str, location of input image
+    input_tif: str or 2D numpy array, location of input image,
+               or the already-loaded band.
 
     Returns
     =======
     new_img: pillow Image.
     """
-    max_val = -1 * sys.maxsize
-    min_val = sys.maxsize
-    # load the single band file and extract pixel data
-
-    pix = cv.imread(input_filename, cv.IMREAD_ANYDEPTH).transpose()
-    # find the minimum and maximum pixel values in the original scale
-    # print("Found image of size {}".format(im.size))
-    for ix in range(pix.shape[0]):
-        for iy in range(pix.shape[1]):
-            if pix[ix, iy] > max_val:
-                max_val = pix[ix, iy]
-            elif pix[ix, iy] < min_val:
-                min_val = pix[ix, iy]
-
-    # create a new image where we will fill RGB pixel values from 0 to 255
-
-    # global linear transform from [-1, 1] -> [0, 255]
-    # tested in issue #224
-    def get_pix_val(ix, iy):
-        return int((pix[ix, iy] + 1) / 2 * 255)
-
-    new_img = Image.new("RGB", pix.shape)
-    for iy in range(new_img.size[1]):
-        for ix in range(new_img.size[0]):
-            new_img.putpixel(
-                (ix, iy), tuple(get_pix_val(ix, iy) for col in ["r", "g", "b"])
-            )
-    return new_img
+    return Image.fromarray(ndvi_to_greyscale(input_tif)).convert("RGB")
+
 
+def apply_colour_lut(values, lut=VIRIDIS_LUT):
+    """
+    Scale an array of values linearly between its minimum and maximum,
+    and map the result onto a colour lookup table, in the same way as
+    a matplotlib colormap would.  NaN values are set to transparent black.
 
-def create_count_heatmap(input_filename):
+    Parameters
+    ==========
+    values: 2D numpy array
+    lut: numpy array of uint8, shape (N, 4), RGBA lookup table.
+
+    Returns
+    =======
+    rgba: 3D numpy array of uint8, shape (rows, columns, 4)
+    """
+    values = values.astype(np.float64)
+    is_bad = np.isnan(values)
+    if is_bad.all():
+        return np.zeros(values.shape + (4,), dtype=np.uint8)
+    vmin, vmax = np.nanmin(values), np.nanmax(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scaled = (values - vmin) / (vmax - vmin)
+    # if all values are the same, scaled will be NaN everywhere
+    is_bad |= np.isnan(scaled)
+    n_colours = lut.shape[0]
+    index = np.clip(np.nan_to_num(scaled, nan=0.0) * n_colours, 0, n_colours - 1)
+    rgba = lut[index.astype(int)]
+    rgba[is_bad] = 0
+    return rgba
+
+
+def create_count_heatmap(input_tif):
     """
     Given only a single band, get a heatmap based on the raw values
 
     Parameters
     ==========
-    input_filename: str, location of input image
+    input_tif: str or 2D numpy array, location of input image,
+               or the already-loaded band.
 
     Returns
     =======
     new_img: pillow Image.
 
     """
-
-    pix = cv.imread(input_filename, cv.IMREAD_ANYDEPTH)
-
-    image_plt = plt.matshow(pix)
-    scaled_img = (image_plt.get_array() - image_plt.get_clim()[0]) / (
-        image_plt.get_clim()[1] - image_plt.get_clim()[0]
-    )
-    new_image = Image.fromarray(np.uint8(image_plt.get_cmap()(scaled_img) * 255))
-    return new_image
+    if isinstance(input_tif, str):
+        input_tif = read_tif_band(input_tif)
+    return Image.fromarray(apply_colour_lut(input_tif))
 
 
 def convert_to_rgb(band_dict):
@@ -203,11 +289,12 @@ def convert_to_rgb(band_dict):
     Parameters
     ==========
     band_dict: dict, format {'<r|g|b|rgb>': {'band': <band_name>, 'filename': <filename>}}
+               (optionally with an 'array' of already-loaded values for each band)
     """
     if len(band_dict.keys()) >= 3:
         new_img = combine_tif(band_dict)
     elif len(band_dict.keys()) == 1:
-        new_img = scale_tif(band_dict.values[0]["filename"])
+        new_img = scale_tif(get_band_array(list(band_dict.values())[0]))
     else:
         raise RuntimeError(
             "Can't convert to RGB with {} bands".format(band_dict.keys())
@@ -219,14 +306,16 @@ def plot_band_values(input_filebase, bands=["B4", "B3", "B2"]):
     """
     Plot histograms of the values in the chosen bands of the input image
     """
+    # only import matplotlib here, so it isn't needed for image processing.
+    import matplotlib
+
+    matplotlib.use("PS")
+    import matplotlib.pyplot as plt
+
     num_subplots = len(bands)
     for i, band in enumerate(bands):
         im = Image.open(input_filebase + "." + band + ".tif")
-        pix = im.load()
-        vals = []
-        for ix in range(im.size[0]):
-            for iy in range(im.size[1]):
-                vals.append(pix[ix, iy])
+        vals = image_to_array(im).ravel()
         plt.subplot(1, num_subplots, i + 1)
         plt.hist(vals)
     plt.show()
@@ -258,13 +347,103 @@ def crop_image_npix(input_image, n_pix_x, n_pix_y=None, bounds=None):
             # depending on whether we have been given coordinates,
             # return a list of images, or a list of (image,coords) tuples.
             if sub_image_coords:
-                sub_images.append((region, sub_image_coords[ix * x_parts + iy]))
+                sub_images.append((region, sub_image_coords[ix * y_parts + iy]))
             else:
                 sub_images.append(region)
 
     return sub_images
 
 
+def tile_array(input_array, n_pix_x, n_pix_y=None):
+    """
+    Divide an array (e.g. an image) into sub-arrays with fixed pixel size,
+    without copying any data.  Any pixels left over at the right or bottom
+    edge that don't fill a whole tile are dropped.
+
+    Parameters
+    ==========
+    input_array: numpy array, shape (rows, columns) or (rows, columns, channels)
+    n_pix_x: int, number of pixels in the x-direction (columns) of each tile
+    n_pix_y: int, number of pixels in the y-direction (rows) of each tile.
+             If not given, assume n_pix_y = n_pix_x.
+
+    Returns
+    =======
+    tiles: read-only numpy array view, shape (ny, nx, n_pix_y, n_pix_x[, channels]),
+           where tiles[iy, ix] is the tile in row iy and column ix.
+    """
+    if not n_pix_y:
+        n_pix_y = n_pix_x
+    input_array = np.asarray(input_array)
+    y_parts = input_array.shape[0] // n_pix_y
+    x_parts = input_array.shape[1] // n_pix_x
+    shape = (y_parts, x_parts, n_pix_y, n_pix_x) + input_array.shape[2:]
+    strides = (
+        input_array.strides[0] * n_pix_y,
+        input_array.strides[1] * n_pix_x,
+    ) + input_array.strides
+    return np.lib.stride_tricks.as_strided(
+        input_array, shape=shape, strides=strides, writeable=False
+    )
+
+
+def crop_array_npix(input_array, n_pix_x, n_pix_y=None, bounds=None):
+    """
+    Array equivalent of crop_image_npix - divide an array into tiles with
+    fixed pixel size (as a view, see tile_array), and if bounds are given,
+    also calculate the coordinates of the bottom left corner of each tile.
+
+    Parameters
+    ==========
+    input_array: numpy array (or PIL Image), shape (rows, columns[, channels])
+    n_pix_x: int, number of pixels in x-direction of each tile
+    n_pix_y: int, number of pixels in y-direction of each tile (default n_pix_x)
+    bounds: list with coordinates, e.g.  [left, bottom, right, top]
+
+    Returns
+    =======
+    tiles: read-only numpy array view, shape (ny, nx, n_pix_y, n_pix_x[, channels])
+    tile_coords: numpy array of shape (ny, nx, 2), or None if no bounds given.
+                 tile_coords[iy, ix] are the coordinates of tiles[iy, ix].
+    """
+    tiles = tile_array(input_array, n_pix_x, n_pix_y)
+    tile_coords = None
+    if bounds:
+        y_parts, x_parts = tiles.shape[:2]
+        tile_coords = get_sub_image_coords_grid(bounds, x_parts, y_parts)
+    return tiles, tile_coords
+
+
+def tile_summary_stats(tiles):
+    """
+    Calculate summary statistics of the pixel values in every tile at once,
+    using reductions over the pixel axes of the tiled array.
+
+    Parameters
+    ==========
+    tiles: numpy array, shape (ny, nx, n_pix_y, n_pix_x[, channels]),
+           e.g. as returned by tile_array.
+
+    Returns
+    =======
+    stats: dict, keyed by "mean", "stdev", "median", "min", "max", "25pc", "75pc",
+           with values numpy arrays of float64 with shape (ny, nx).
+    """
+    y_parts, x_parts = tiles.shape[:2]
+    # flatten all the pixels of each tile (this makes one copy of the data)
+    pix_vals = tiles.reshape(y_parts, x_parts, -1).astype(np.float64)
+    pc25, pc75 = np.percentile(pix_vals, [25, 75], axis=-1)
+    return {
+        "mean": pix_vals.mean(axis=-1),
+        "stdev": pix_vals.std(axis=-1),
+        "median": np.median(pix_vals, axis=-1),
+        "min": pix_vals.min(axis=-1),
+        "max": pix_vals.max(axis=-1),
+        "25pc": pc25,
+        "75pc": pc75,
+    }
+
+
 def crop_image_nparts(input_image, n_parts_x, n_parts_y=None):
     """
     Divide an image into n_parts_x*n_parts_y equal smaller sub-images.
@@ -292,24 +471,10 @@ def convert_to_bw(input_image, threshold, invert=False):
     Given an RGB input, apply a threshold to each pixel.
     If pix(r,g,b)>threshold, set to 255,255,255, if <threshold, set to 0,0,0
     """
-    pix = input_image.load()
-    new_img = Image.new("RGB", input_image.size)
-    for ix in range(input_image.size[0]):
-        for iy in range(input_image.size[1]):
-            p = pix[ix, iy]
-            try:
-                total = 0
-                for col in p:
-                    total += col
-            except:
-                total = p
-            if (invert and (total > threshold)) or (
-                (not invert) and (total < threshold)
-            ):
-                new_img.putpixel((ix, iy), (255, 255, 255))
-            else:
-                new_img.putpixel((ix, iy), (0, 0, 0))
-    return new_img
+    total = sum_pixel_values(input_image)
+    if invert:
+        return binary_image_from_mask(total > threshold)
+    return binary_image_from_mask(total < threshold)
 
 
 def crop_and_convert_to_bw(
@@ -333,58 +498,76 @@ def crop_and_convert_to_bw(
         save_image(sub_image, output_dir, new_filename)
 
 
-def create_gif_from_images(directory_path, output_name, string_in_filename=""):
+def create_gif_from_images(
+    directory_path,
+    output_name,
+    string_in_filename="",
+    downscale_factor=1,
+    frame_stride=1,
+):
     """
-        Loop through a directory and convert all images in it into a gif chronologically
+        Loop through a directory and convert all images in it into a gif chronologically.
+        The filenames are sorted by date first, and the images are then read
+        one at a time, as the gif is written.
 
     :param directory_path:  directory where all the files are.
     :param output_name: name to be given to the output gif
     :param string_in_filename: select only files that containsa particular string,
                   default is "" which implies all in directory files are selected
+    :param downscale_factor: int, divide the width and height of each frame by this.
+    :param frame_stride: int, only use every n-th image (in date order).
 
-    :return:
+    :return: path to the output gif
     """
+    if downscale_factor < 1 or frame_stride < 1:
+        raise ValueError("downscale_factor and frame_stride must be at least 1")
 
+    # only use images with certain name (optional)
     file_names = [
         f
         for f in os.listdir(directory_path)
-        if (os.path.isfile(os.path.join(directory_path, f)) and f.endswith(".png"))
+        if (
+            os.path.isfile(os.path.join(directory_path, f))
+            and f.endswith(".png")
+            and string_in_filename in f
+        )
     ]
-
-    images = []
-    date = []
-
-    for filename in file_names:
-
-        # only use images with certain name (optional)
-        if string_in_filename in filename:
-            images.append(imageio.imread(os.path.join(directory_path, filename)))
-
-            # the name of each file should end with the date of the image
-            # (this is true in the gee images)
-            date.append(filename[-14:-4])
-
-    if len(images) == 0:
+    if len(file_names) == 0:
         raise RuntimeError("No images found")
-    else:
-        image_dates_df = pd.DataFrame()
-        image_dates_df["date"] = date
-        image_dates_df["images"] = images
-
-        image_dates_df.sort_values(by=["date"], inplace=True, ascending=True)
-        imageio.mimsave(
-            os.path.join(directory_path, output_name + ".gif"),
-            image_dates_df["images"],
-            duration=0.5,
-        )
+
+    # the name of each file should end with the date of the image
+    # (this is true in the gee images)
+    file_names = sorted(file_names, key=lambda f: (f[-14:-4], f))[::frame_stride]
+
+    output_path = os.path.join(directory_path, output_name + ".gif")
+
+    def read_frames():
+        for filename in file_names:
+            frame = Image.open(os.path.join(directory_path, filename)).convert("RGB")
+            if downscale_factor > 1:
+                new_size = (
+                    max(1, frame.size[0] // downscale_factor),
+                    max(1, frame.size[1] // downscale_factor),
+                )
+                frame = frame.resize(new_size, Image.LANCZOS)
+            yield frame
+
+    frames = read_frames()
+    next(frames).save(
+        output_path,
+        save_all=True,
+        append_images=frames,
+        loop=0,
+        duration=500,
+    )
 
     print(
         "Saved gif file containing '{}' images in directory '{}'".format(
-            image_dates_df.shape[0], directory_path
+            len(file_names), directory_path
         )
     )
 
-    return os.path.join(directory_path, output_name + ".gif")
+    return output_path
 
 
 def crop_and_convert_all(input_dir, output_dir, threshold=470, num_x=50, num_y=50):
@@ -415,14 +598,19 @@ def image_all_same_colour(image, colour=(255, 255, 255), threshold=0.99):
     Return true if all (or nearly all) pixels are same colour
     """
     num_total = image.size[0] * image.size[1]
-    num_different = 0
-    pix = image.load()
-    for ix in range(image.size[0]):
-        for iy in range(image.size[1]):
-            if pix[ix, iy] != colour:
-                num_different += 1
-                if 1.0 - float(num_different / num_total) < threshold:
-                    return False
+    pix = image_to_array(image)
+    colour = np.atleast_1d(colour)
+    n_bands = pix.shape[2] if pix.ndim == 3 else 1
+    if n_bands != len(colour):
+        # e.g. an (r,g,b) colour can never match a greyscale or rgba pixel
+        return False
+    if pix.ndim == 3:
+        num_same = np.count_nonzero(np.all(pix == colour, axis=2))
+    else:
+        num_same = np.count_nonzero(pix == colour[0])
+    num_different = num_total - num_same
+    if num_different > 0 and 1.0 - float(num_different / num_total) < threshold:
+        return False
     return True
 
 
@@ -444,14 +632,16 @@ def compare_binary_images(image1, image2):
     """
     if not image1.size == image2.size:
         return 0.0
-    pix1 = image1.load()
-    pix2 = image2.load()
-    num_same = 0
+    pix1 = image_to_array(image1)
+    pix2 = image_to_array(image2)
     num_total = image1.size[0] * image1.size[1]
-    for ix in range(image1.size[0]):
-        for iy in range(image1.size[1]):
-            if pix1[ix, iy] == pix2[ix, iy]:
-                num_same += 1
+    if pix1.shape != pix2.shape:
+        # pixels with different numbers of bands are never the same
+        return 0.0
+    same = pix1 == pix2
+    if same.ndim == 3:
+        same = np.all(same, axis=2)
+    num_same = np.count_nonzero(same)
     return float(num_same / num_total)
 
 
@@ -569,14 +759,14 @@ def adaptive_threshold(img):
 def process_and_threshold(img, r=3):
     """
     Perform histogram equalisation, adaptive thresholding, and median
-    filtering on an input PIL Image. Return the result converted
-    back to a PIL Image.
+    filtering on an input PIL Image or greyscale numpy array.
+    Return the result converted back to a PIL Image.
 
-    @param img input PIL Image object
+    @param img input PIL Image object, or 2D numpy array
     @return processed PIL Image
     """
-
-    img = pillow_to_numpy(img)
+    if not isinstance(img, np.ndarray):
+        img = pillow_to_numpy(img)
     img = hist_eq(img)
     img = adaptive_threshold(img)
     img = median_filter(img, r)
@@ -624,12 +814,97 @@ def check_image_ok(rgb_image, black_pix_threshold=0.05):
 
 
 def get_bounds(tiff_file):
-    rio_file = rasterio.open(tiff_file)
-    bounds = [
-        rio_file.bounds.left,
-        rio_file.bounds.bottom,
-        rio_file.bounds.right,
-        rio_file.bounds.top,
-    ]
+    with rasterio.open(tiff_file) as rio_file:
+        bounds = [
+            rio_file.bounds.left,
+            rio_file.bounds.bottom,
+            rio_file.bounds.right,
+            rio_file.bounds.top,
+        ]
+
+        return bounds, [rio_file.width, rio_file.height]
+
 
-    return bounds, [rio_file.width, rio_file.height]
+def mosaic_tifs(input_filenames, output_filename):
+    """
+    Combine tif files covering neighbouring areas (e.g. downloaded separately)
+    into one tif file covering the whole area, with the georeferencing
+    (coordinate system and transform) of the combined area.
+
+    Parameters
+    ==========
+    input_filenames: list of str, locations of the input tif files.  These
+                     should all have the same bands, data type and resolution.
+    output_filename: str, location of the output tif file.
+    """
+    sources = [rasterio.open(filename) for filename in input_filenames]
+    try:
+        mosaic, transform = rasterio.merge.merge(sources)
+        profile = sources[0].profile.copy()
+        # keep the band names of multi-band files
+        descriptions = sources[0].descriptions
+    finally:
+        for source in sources:
+            source.close()
+    profile.update(height=mosaic.shape[1], width=mosaic.shape[2], transform=transform)
+    with rasterio.open(output_filename, "w", **profile) as output_file:
+        output_file.write(mosaic)
+        output_file.descriptions = descriptions
+
+
+def read_tif(tiff_file):
+    """
+    Open a single-band tif file once, and read both its pixel values
+    and the information that get_bounds would give.
+
+    Parameters
+    ==========
+    tiff_file: str, location of the input tif file
+
+    Returns
+    =======
+    dict, format {'array': <2D numpy array>,
+                  'bounds': [left, bottom, right, top],
+                  'npix': [width, height]}
+    """
+    with rasterio.open(tiff_file) as rio_file:
+        return {
+            "array": rio_file.read(1),
+            "bounds": [
+                rio_file.bounds.left,
+                rio_file.bounds.bottom,
+                rio_file.bounds.right,
+                rio_file.bounds.top,
+            ],
+            "npix": [rio_file.width, rio_file.height],
+        }
+
+
+def read_tif_bands(tiff_file):
+    """
+    Open a multi-band tif file once, and read all its bands, keyed by the
+    band names that GEE stores as the band descriptions.
+
+    Parameters
+    ==========
+    tiff_file: str, location of the input tif file
+
+    Returns
+    =======
+    dict, format {'bands': {<band_name>: <2D numpy array>},
+                  'bounds': [left, bottom, right, top],
+                  'npix': [width, height]}
+    """
+    with rasterio.open(tiff_file) as rio_file:
+        if None in rio_file.descriptions:
+            raise RuntimeError("Bands in {} are not named".format(tiff_file))
+        return {
+            "bands": dict(zip(rio_file.descriptions, rio_file.read())),
+            "bounds": [
+                rio_file.bounds.left,
+                rio_file.bounds.bottom,
+                rio_file.bounds.right,
+                rio_file.bounds.top,
+            ],
+            "npix": [rio_file.width, rio_file.height],
+        }
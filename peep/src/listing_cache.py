@@ -0,0 +1,116 @@
+"""
+A cache of directory listings, shared by the Modules of a Pipeline for one
+run, so that checking what input and output already exists doesn't list the
+same directories again and again - for Azure, each listing is a request
+over the network.
+
+A listing is kept until something writes to that directory (or one
+inside it, or one containing it), at which point the Module doing the
+writing invalidates it.  The numbers of hits and misses are counted, to
+show how many listings were saved.
+"""
+
+import os
+import threading
+
+
+class DirectoryListingCache:
+    """
+    Listings of local or Azure directories, keyed by path and location type.
+    Can be used from several threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listings = {}
+        # incremented by every invalidation, so that a listing made while
+        # something was being written isn't kept
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __getstate__(self):
+        # a copy in another process (e.g. a worker process pickled along
+        # with a Module) starts empty, as the listings may be out of date
+        # by the time it is used, and locks can't be pickled
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @staticmethod
+    def get_key(directory_path, location_type):
+        if location_type == "local":
+            return location_type, os.path.abspath(directory_path)
+        return location_type, directory_path.strip("/")
+
+    def list_directory(self, directory_path, location_type, list_func):
+        """
+        Return the cached listing of a directory, or call
+        list_func(directory_path, location_type) and cache the result.
+
+        Returns
+        =======
+        list of str, the names of the directory contents.
+        """
+        key = self.get_key(directory_path, location_type)
+        with self.lock:
+            if key in self.listings:
+                self.hits += 1
+                return list(self.listings[key])
+            self.misses += 1
+            generation = self.generation
+        listing = list_func(directory_path, location_type)
+        with self.lock:
+            if self.generation == generation:
+                self.listings[key] = list(listing)
+        return listing
+
+    def invalidate(self, path, location_type):
+        """
+        Forget the listings of path, of directories inside it, and of
+        the directories containing it, which are all changed by writing there.
+        """
+        location_type, path = self.get_key(path, location_type)
+        separator = os.sep if location_type == "local" else "/"
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for key in list(self.listings):
+                key_type, key_path = key
+                if key_type != location_type:
+                    continue
+                if (
+                    key_path == path
+                    or key_path.startswith(path.rstrip(separator) + separator)
+                    or path.startswith(key_path.rstrip(separator) + separator)
+                ):
+                    del self.listings[key]
+
+    def clear(self):
+        """
+        Forget everything, and reset the counters.
+        """
+        with self.lock:
+            self.listings = {}
+            self.generation += 1
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def get_stats(self):
+        """
+        Returns
+        =======
+        dict with the numbers of hits, misses and invalidations.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+    def __repr__(self):
+        return "DirectoryListingCache({})".format(self.get_stats())
@@ -17,11 +17,22 @@ import json
 import logging
 import os
 import subprocess
+import threading
 import time
+import uuid
 from logging.handlers import RotatingFileHandler
 from shutil import copyfile
 
 from peep.src.file_utils import save_json
+from peep.src.listing_cache import DirectoryListingCache
+from peep.src.run_manifest import (
+    get_artifact_key,
+    get_bounds_string,
+    get_directory_checksum,
+    get_run_manifest,
+)
+from peep.src.scheduler import FINISHED, SUBMITTED, DAGScheduler
+from peep.src.streaming import DateStream
 
 logger = logging.getLogger("peep_logger")
 formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
@@ -45,6 +56,9 @@ try:
 except:
     print("Azure utils could not be imported - is Azure SDK installed?")
 
+# how often to check on Modules running in batch mode, in seconds
+BATCH_POLL_INTERVAL = 10
+
 
 class Pipeline(object):
     """
@@ -60,6 +74,13 @@ class Pipeline(object):
         self.date_range = None
         self.output_location = None
         self.output_location_type = None
+        # maximum number of Modules to run at once - by default, no limit
+        self.max_parallel_modules = None
+        # directory listings shared by all the Modules
+        self.listing_cache = DirectoryListingCache()
+        # delete the batch pool in cleanup() - turned off when other
+        # pipelines running at the same time are using it too
+        self.delete_batch_pool = True
         self.is_configured = False
 
     def __iadd__(self, sequence):
@@ -115,6 +136,9 @@ class Pipeline(object):
         for sequence in self.sequences:
             if not "bounds" in vars(sequence):
                 sequence.bounds = self.bounds
+            if "manifest_file" in vars(self) and not "manifest_file" in vars(sequence):
+                sequence.manifest_file = self.manifest_file
+            sequence.listing_cache = self.listing_cache
             if not "date_range" in vars(sequence):
                 sequence.date_range = self.date_range
             sequence.configure()
@@ -123,23 +147,84 @@ class Pipeline(object):
 
     def run(self):
         """
-        run all the sequences in this pipeline
+        Run all the sequences in this pipeline.  Modules are run concurrently,
+        each one starting as soon as the Modules and Sequences it depends on
+        are done, so independent Sequences (e.g. for vegetation and weather
+        data) run at the same time.  In streaming Sequences, a processor runs
+        alongside the downloader before it, taking each date as it arrives.
         """
-        for sequence in self.sequences:
-            sequence.run()
+        self.listing_cache.clear()
+        _, errors, skipped = self.build_scheduler().run()
         self.print_run_status()
         self.cleanup()
+        if errors:
+            raise RuntimeError(
+                "{}: {} failed, so {} did not run".format(
+                    self.name, sorted(errors), skipped
+                )
+            )
+
+    def build_scheduler(self):
+        """
+        Make a DAGScheduler with a task for each Module in the pipeline.
+        Each Module depends on the Modules in its depends_on list, and on all
+        the Modules of the Sequences its own Sequence depends on.  A Module
+        only needs the previous one in its Sequence to have been SUBMITTED,
+        as in batch mode the batch tasks wait for each other, and a Module
+        taking dates from a stream doesn't wait for the previous one at all.
+
+        Returns
+        =======
+        DAGScheduler
+        """
+        max_workers = self.max_parallel_modules
+        n_streams = sum(
+            1
+            for sequence in self.sequences
+            for module in sequence.modules
+            if module.input_stream is not None
+        )
+        if max_workers and n_streams:
+            # a Module handing dates on to the next can't finish until the
+            # next one is running, so leave room for both
+            max_workers += n_streams
+        scheduler = DAGScheduler(max_workers)
+        for sequence in self.sequences:
+            sequence_dependencies = []
+            for seq_name in sequence.depends_on:
+                dependency = self.get(seq_name)
+                if dependency is None:
+                    raise ValueError(
+                        "{}: Sequence {} depends on unknown Sequence {}".format(
+                            self.name, sequence.name, seq_name
+                        )
+                    )
+                sequence_dependencies += [module.name for module in dependency.modules]
+            sequence.add_module_tasks(scheduler, sequence_dependencies)
+        return scheduler
 
     def print_run_status(self):
         for sequence in self.sequences:
             sequence.print_run_status()
+        stats = self.listing_cache.get_stats()
+        logger.info(
+            "{}: {} directory listings made, {} found in the cache".format(
+                self.name, stats["misses"], stats["hits"]
+            )
+        )
+
+    def has_batch_job(self):
+        """
+        Do any of our Sequences have Modules with run_mode == 'batch'?
+        """
+        return any(sequence.has_batch_job() for sequence in self.sequences)
 
     def cleanup(self):
         """
         Call cleanup() for all our sequences
         """
         for sequence in self.sequences:
-            sequence.cleanup()
+            sequence.cleanup(self.delete_batch_pool)
 
 
 class Sequence(object):
@@ -160,7 +245,16 @@ class Sequence(object):
         self.output_location_type = None
         self.is_configured = False
         self.is_finished = False
+        # set once all the modules have finished
+        self.finished_event = threading.Event()
         self.run_status = {}
+        # hand each date from the downloader to the processor as soon as it
+        # is downloaded, with at most stream_queue_size dates waiting
+        self.streaming = False
+        self.stream_queue_size = 2
+        # directory listings shared by the modules - replaced by the
+        # Pipeline's when configured as part of one
+        self.listing_cache = DirectoryListingCache()
 
     def __iadd__(self, module):
         """
@@ -243,6 +337,7 @@ class Sequence(object):
         for i, module in enumerate(self.modules):
             module.output_location = self.output_location
             module.output_location_type = self.output_location_type
+            module.listing_cache = self.listing_cache
             if i > 0:
                 module.input_location = self.modules[i - 1].output_location
                 module.input_location_type = self.modules[i - 1].output_location_type
@@ -251,39 +346,140 @@ class Sequence(object):
             module.bounds = self.bounds
             module.date_range = self.date_range
             module.configure()
+        self.link_streams()
         self.is_configured = True
 
+    def link_streams(self):
+        """
+        If streaming, connect each Module that can publish dates as it goes
+        to the next Module, if that one can take them, with a DateStream.
+        """
+        for module in self.modules:
+            module.input_stream = None
+            module.output_stream = None
+        if not self.streaming:
+            return
+        for producer, consumer in zip(self.modules[:-1], self.modules[1:]):
+            if producer.can_publish_dates() and consumer.can_consume_dates():
+                logger.info(
+                    "{}: {} will process dates as {} publishes them".format(
+                        self.name, consumer.name, producer.name
+                    )
+                )
+                stream = DateStream(self.stream_queue_size)
+                producer.output_stream = stream
+                consumer.input_stream = stream
+
     def run(self):
         """
         Before we run the Modules in this Sequence, check if there are any other Sequences
         on which we depend, and if so, wait for them to finish.
+        (Pipeline.run doesn't use this, but schedules the Modules itself).
+        Modules linked by a stream have to run at the same time, so if there
+        are any, the Modules are run with a DAGScheduler.
         """
         if len(self.depends_on) > 0:
             logger.info(
-                "{} Checking if all dependency Sequences have finished".format(
-                    self.name
-                )
+                "{} Waiting for all dependency Sequences to finish".format(self.name)
             )
-            dependencies_finished = False
-            while not dependencies_finished:
-                num_seq_finished = 0
-                for seq_name in self.depends_on:
-                    seq = self.parent.get(seq_name)
-                    logger.info("{}: checking status of {}".format(self.name, seq.name))
-                    if seq.check_if_finished():
-                        logger.info("     {}   ... finished".format(seq.name))
-                        num_seq_finished += 1
-                    dependencies_finished = num_seq_finished == len(self.depends_on)
-                    logger.info(
-                        "{}: {} / {} dependencies finished".format(
-                            self.name, num_seq_finished, len(self.depends_on)
-                        )
+            for seq_name in self.depends_on:
+                self.parent.get(seq_name).wait_until_finished()
+
+        if any(module.input_stream is not None for module in self.modules):
+            scheduler = DAGScheduler()
+            self.add_module_tasks(scheduler)
+            _, errors, skipped = scheduler.run()
+            if errors:
+                raise RuntimeError(
+                    "{}: {} failed, so {} did not run".format(
+                        self.name, sorted(errors), skipped
                     )
-                time.sleep(10)
+                )
+            return
 
         self.create_batch_job_if_needed()
         for module in self.modules:
             self.run_status[module.name] = module.run()
+        if not self.has_batch_job():
+            self.set_finished()
+
+    def add_module_tasks(self, scheduler, depends_on=[]):
+        """
+        Add a task to the scheduler for each of our Modules.
+
+        Parameters
+        ==========
+        scheduler: DAGScheduler
+        depends_on: list of task names that all our Modules depend on,
+                    e.g. the Modules of the Sequences we depend on.
+        """
+        for i, module in enumerate(self.modules):
+            task_dependencies = list(depends_on)
+            for mod_name in module.depends_on:
+                if i > 0 and mod_name == self.modules[i - 1].name:
+                    if module.input_stream is None:
+                        task_dependencies.append((mod_name, SUBMITTED))
+                else:
+                    task_dependencies.append((mod_name, FINISHED))
+            scheduler.add_task(
+                module.name,
+                run=self.get_module_runner(module),
+                depends_on=task_dependencies,
+                wait=self.get_module_waiter(module),
+                skip=module.release_streams,
+            )
+
+    def get_module_runner(self, module):
+        """
+        Return a function that runs one of our Modules, and records its run status,
+        creating the batch job first if this is the first Module.
+        """
+
+        def run_module():
+            try:
+                if module is self.modules[0]:
+                    self.create_batch_job_if_needed()
+                self.run_status[module.name] = module.run()
+            finally:
+                # however run() ended, don't leave the Modules either side
+                # of a stream waiting for this one
+                module.release_streams()
+            return self.run_status[module.name]
+
+        return run_module
+
+    def get_module_waiter(self, module):
+        """
+        Return a function that waits until one of our Modules has finished,
+        which is as soon as run() returns unless it is in batch mode,
+        and marks this Sequence as finished after the last Module.
+        """
+
+        def wait_for_module():
+            if "run_mode" in vars(module) and module.run_mode == "batch":
+                while not module.check_if_finished():
+                    time.sleep(BATCH_POLL_INTERVAL)
+            if module is self.modules[-1]:
+                self.set_finished()
+
+        return wait_for_module
+
+    def set_finished(self):
+        """
+        Mark this Sequence as finished, waking up anything waiting for it.
+        """
+        self.is_finished = True
+        self.finished_event.set()
+
+    def wait_until_finished(self):
+        """
+        Wait until this Sequence has finished - either it was marked as finished
+        when its last Module finished, or all its Modules report that they
+        are finished (e.g. in batch mode).
+        """
+        while not self.finished_event.wait(BATCH_POLL_INTERVAL):
+            if self.check_if_finished():
+                break
 
     def __repr__(self):
         if not self.is_configured:
@@ -344,7 +540,16 @@ class Sequence(object):
         """
 
         if self.has_batch_job():
-            self.batch_job_id = self.name + "_" + time.strftime("%Y-%m-%d_%H-%M-%S")
+            # other pipelines, often with the same name, may be creating jobs
+            # for the same collection in the same second, so end with a uuid
+            self.batch_job_id = "_".join(
+                ([self.parent.name] if self.parent else [])
+                + [
+                    self.name,
+                    time.strftime("%Y-%m-%d_%H-%M-%S"),
+                    uuid.uuid4().hex[:8],
+                ]
+            )
             batch_utils.create_job(self.batch_job_id)
             logger.info(
                 "Sequence {}: Creating batch job {}".format(
@@ -372,14 +577,17 @@ class Sequence(object):
         self.is_finished = num_modules_finished == len(self.modules)
         return self.is_finished
 
-    def cleanup(self):
+    def cleanup(self, delete_pool=True):
         """
-        If we have batch resources (job/pool), remove them to avoid charges
+        If we have batch resources (job/pool), remove them to avoid charges.
+        The pool is left if delete_pool is False, e.g. if other pipelines
+        are still using it.
         """
         if self.has_batch_job():
             if "batch_job_id" in vars(self):
                 batch_utils.delete_job(self.batch_job_id)
-            batch_utils.delete_pool()
+            if delete_pool:
+                batch_utils.delete_pool()
 
 
 class BaseModule(object):
@@ -397,12 +605,33 @@ class BaseModule(object):
             self.name = name
         else:
             self.name = self.__class__.__name__
-        self.params = []
+        self.params = [
+            # SQLite file recording the output written, "" means don't use one
+            ("manifest_file", [str]),
+        ]
         self.parent = None
         self.depends_on = []
         self.is_configured = False
         self.is_finished = False
         self.run_status = {"succeeded": 0, "failed": 0, "incomplete": 0}
+        # replaced by the Sequence's when configured as part of one
+        self.listing_cache = DirectoryListingCache()
+        # DateStreams connecting this Module to the previous or next one,
+        # set by the Sequence when streaming
+        self.input_stream = None
+        self.output_stream = None
+
+    def __getstate__(self):
+        """
+        When pickled, e.g. to run in worker processes, leave out the parent
+        Sequence and the DateStreams, which hold locks and only make sense
+        in this process.  The listing_cache is pickled as an empty one.
+        """
+        state = vars(self).copy()
+        state["parent"] = None
+        state["input_stream"] = None
+        state["output_stream"] = None
+        return state
 
     def set_parameters(self, config_dict):
         for k, v in config_dict.items():
@@ -455,7 +684,8 @@ class BaseModule(object):
         return True
 
     def set_default_parameters(self):
-        pass
+        if not "manifest_file" in vars(self):
+            self.manifest_file = ""
 
     def prepare_for_run(self):
         if not self.is_configured:
@@ -474,10 +704,35 @@ class BaseModule(object):
             self.output_location
         ):
             os.makedirs(self.output_location, exist_ok=True)
+            self.invalidate_listing(self.output_location, self.output_location_type)
 
     def check_if_finished(self):
         return self.is_finished
 
+    def release_streams(self):
+        """
+        Stop taking dates from our input_stream, and close our output_stream,
+        so that the Modules at the other ends don't wait for us - e.g. if we
+        failed, or were never run.  Does nothing to streams that were
+        already closed and consumed.
+        """
+        if self.input_stream is not None:
+            self.input_stream.stop()
+        if self.output_stream is not None:
+            self.output_stream.close()
+
+    def can_publish_dates(self):
+        """
+        Can this Module put each date in an output_stream as soon as it is done?
+        """
+        return False
+
+    def can_consume_dates(self):
+        """
+        Can this Module process dates as they arrive through an input_stream?
+        """
+        return False
+
     def __repr__(self):
         if not self.is_configured:
             return "\n        Module not configured"
@@ -550,11 +805,27 @@ class BaseModule(object):
             azure_utils.write_files_to_blob(
                 tmpdir, container_name, output_location, file_endings
             )
+        self.invalidate_listing(output_location, self.output_location_type)
 
     def list_directory(self, directory_path, location_type):
         """
         List contents of a directory, either on local file system
-        or Azure blob storage.
+        or Azure blob storage.  The listing is kept in our listing_cache
+        until something is written to the directory.
+        """
+        return self.listing_cache.list_directory(
+            directory_path, location_type, self.list_directory_uncached
+        )
+
+    def invalidate_listing(self, path, location_type):
+        """
+        Call whenever writing to path, so that it will be listed afresh.
+        """
+        self.listing_cache.invalidate(path, location_type)
+
+    def list_directory_uncached(self, directory_path, location_type):
+        """
+        List contents of a directory, without using the listing_cache.
         """
         if location_type == "local":
             if not os.path.isdir(directory_path):
@@ -579,6 +850,7 @@ class BaseModule(object):
             azure_utils.save_json(data, location, filename, container_name)
         else:
             raise RuntimeError("Unknown location_type - must be 'local' or 'azure'")
+        self.invalidate_listing(location, location_type)
 
     def get_json(self, filepath, location_type):
         """
@@ -611,20 +883,68 @@ class BaseModule(object):
         else:
             raise RuntimeError("Unknown location_type - must be 'local' or 'azure'")
 
+    def get_manifest(self):
+        """
+        The RunManifest recording the output of this Module, or None if we
+        aren't using one, or are running in batch mode, where the output
+        is written elsewhere.
+        """
+        if not ("manifest_file" in vars(self) and self.manifest_file):
+            return None
+        if "run_mode" in vars(self) and self.run_mode == "batch":
+            return None
+        return get_run_manifest(self.manifest_file)
+
+    def record_output(self, location, date_string, bounds=None):
+        """
+        Once all the output for a date has been written to location,
+        add it to the manifest, if we are using one.  bounds defaults to
+        the bounds of this Module.
+        """
+        manifest = self.get_manifest()
+        if manifest is None:
+            return
+        if bounds is None:
+            bounds = self.bounds if "bounds" in vars(self) else []
+        n_files = len(self.list_directory(location, self.output_location_type))
+        if self.output_location_type == "local":
+            checksum = get_directory_checksum(location)
+        else:
+            checksum = None
+        manifest.record(
+            get_artifact_key(location, self.output_location_type),
+            module=self.name,
+            bounds=get_bounds_string(bounds),
+            date=date_string,
+            n_files=n_files,
+            checksum=checksum,
+        )
+
     def check_for_existing_files(self, location, num_files_expected):
         """
         See if there are already num_files in the specified location.
-        If "replace_existing_files" is set to True, always return False
+        If "replace_existing_files" is set to True, always return False.
+        If we are using a manifest, it is looked up there, rather than
+        listing the location.
         """
-        if self.output_location_type == "local":
+        if self.output_location_type == "local" and not os.path.isdir(location):
             os.makedirs(location, exist_ok=True)
+            self.invalidate_listing(location, self.output_location_type)
         # if we haven't specified number of expected files per point it will be -1
         if num_files_expected < 0:
             return False
         if self.replace_existing_files:
             return False
-        existing_files = self.list_directory(location, self.output_location_type)
-        if len(existing_files) == num_files_expected:
+        manifest = self.get_manifest()
+        if manifest is not None:
+            found = manifest.is_complete(
+                get_artifact_key(location, self.output_location_type),
+                num_files_expected,
+            )
+        else:
+            existing_files = self.list_directory(location, self.output_location_type)
+            found = len(existing_files) == num_files_expected
+        if found:
             logger.info(
                 "{}: Already found {} files in {} - skipping".format(
                     self.name, num_files_expected, location
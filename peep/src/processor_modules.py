@@ -4,13 +4,18 @@ that can be chained together to build a sequence.
 """
 
 import datetime
+import logging
 import os
 import re
+import shutil
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from logging.handlers import BufferingHandler
 
 import cv2 as cv
 import numpy as np
+import pandas as pd
 
 # import rasterio
 from PIL import Image
@@ -18,18 +23,64 @@ from PIL import Image
 from peep.src import azure_utils, batch_utils
 from peep.src.coordinate_utils import find_coords_string
 from peep.src.date_utils import assign_dates_to_tasks
-from peep.src.file_utils import save_array, save_image
+from peep.src.file_utils import save_array, save_image, save_table, save_tile_store
 from peep.src.image_utils import (
+    MULTIBAND_TIF_FILENAME,
     check_image_ok,
     convert_to_rgb,
     create_count_heatmap,
-    crop_image_npix,
-    get_bounds,
+    crop_array_npix,
+    ndvi_to_greyscale,
     pillow_to_numpy,
     process_and_threshold,
-    scale_tif,
+    read_tif,
+    read_tif_bands,
+    tile_summary_stats,
 )
 from peep.src.peep_pipeline import BaseModule, logger
+from peep.src.run_manifest import get_artifact_key
+
+# state of each worker process used by ProcessorModule.run_local when
+# n_workers > 1 - set once per worker by _init_worker.
+_worker_module = None
+_worker_log_handler = None
+
+
+def _init_worker(module):
+    """
+    Keep the module to be run, and replace the peep_logger handlers in this
+    worker process with one that holds on to the log records, so that they
+    can be sent back to the parent process and logged there.
+    """
+    global _worker_module, _worker_log_handler
+    _worker_module = module
+    _worker_log_handler = BufferingHandler(capacity=sys.maxsize)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_worker_log_handler)
+
+
+def _process_date_in_worker(date_string):
+    """
+    Run process_single_date for one date in a worker process.
+
+    Returns
+    =======
+    tuple (succeeded, log_records), where log_records is the list of
+    (picklable) records logged while processing this date.
+    """
+    _worker_log_handler.buffer = []
+    succeeded = _worker_module.try_process_single_date(date_string)
+    log_records = _worker_log_handler.buffer
+    _worker_log_handler.buffer = []
+    for record in log_records:
+        # make the record picklable by formatting the message and traceback now
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+    return succeeded, log_records
 
 
 class ProcessorModule(BaseModule):
@@ -48,6 +99,7 @@ class ProcessorModule(BaseModule):
             ("run_mode", [str]),  # batch or local
             ("n_batch_tasks", [int]),
             ("timeout", [int]),  # timeout in mins for waiting for batch jobs
+            ("n_workers", [int]),  # number of processes to use when running local
         ]
 
     def set_default_parameters(self):
@@ -74,6 +126,8 @@ class ProcessorModule(BaseModule):
             self.batch_task_dict = {}
         if not "timeout" in vars(self):
             self.timeout = 30  # 1/2 hour, with nothing changing
+        if not "n_workers" in vars(self):
+            self.n_workers = 1
 
     def check_input_data_exists(self, date_string):
         """
@@ -89,6 +143,15 @@ class ProcessorModule(BaseModule):
         =======
         True if input directories exist and are not empty, False otherwise.
         """
+        manifest = self.get_manifest()
+        if manifest is not None:
+            # recorded by the previous Module once it wrote them
+            input_location = self.join_path(
+                self.input_location, date_string, *(self.input_location_subdirs)
+            )
+            return manifest.is_complete(
+                get_artifact_key(input_location, self.input_location_type)
+            )
         for i in range(len(self.input_location_subdirs)):
             if not self.input_location_subdirs[i] in self.list_directory(
                 self.join_path(
@@ -160,6 +223,7 @@ class ProcessorModule(BaseModule):
             raise RuntimeError(
                 "Unknown output location type {}".format(self.output_location_type)
             )
+        self.invalidate_listing(output_location, self.output_location_type)
 
     def run(self):
         self.prepare_for_run()
@@ -176,43 +240,176 @@ class ProcessorModule(BaseModule):
             )
         return job_status
 
+    def needs_processing(self, date_string):
+        """
+        Is date_string a date whose input is there, and output isn't yet?
+        """
+        date_regex = "[\d]{4}-[\d]{2}-[\d]{2}"
+        if not re.search(date_regex, date_string):
+            logger.info("{}: {} not a date string".format(self.name, date_string))
+            return False
+        input_exists = self.check_input_data_exists(date_string)
+        output_exists = input_exists and self.check_output_data_exists(date_string)
+        logger.debug(
+            "{}: date string {} input exists {} output exists {}".format(
+                self.name, date_string, input_exists, output_exists
+            )
+        )
+        return input_exists and not output_exists
+
+    def can_consume_dates(self):
+        """
+        Dates can be processed as they arrive when running locally.
+        """
+        return self.run_mode == "local"
+
     def run_local(self):
         """
         loop over dates and call process_single_date on all of them.
+        Any exception when processing a date is logged, and that date
+        counted as failed.  If n_workers > 1, the dates are shared out
+        between that many processes, and the log output from each date is
+        written once it has finished, in date order.
         """
         logger.info("{}: Running local".format(self.name))
-        if "dates_to_process" in vars(self) and len(self.dates_to_process) > 0:
-            date_strings = self.dates_to_process
+        if self.input_stream is not None:
+            date_results = self.run_local_streaming()
         else:
-            date_strings = sorted(
-                self.list_directory(self.input_location, self.input_location_type)
-            )
+            if "dates_to_process" in vars(self) and len(self.dates_to_process) > 0:
+                date_strings = self.dates_to_process
+            else:
+                date_strings = sorted(
+                    self.list_directory(self.input_location, self.input_location_type)
+                )
+            dates_to_run = [d for d in date_strings if self.needs_processing(d)]
 
-        for date_string in date_strings:
-            date_regex = "[\d]{4}-[\d]{2}-[\d]{2}"
-            if not re.search(date_regex, date_string):
-                logger.info("{}: {} not a date string".format(self.name, date_string))
-                continue
-            logger.debug(
-                "{}: date string {} input exists {} output exists {}".format(
-                    self.name,
+            if self.n_workers > 1 and len(dates_to_run) > 1:
+                results = self.run_local_parallel(dates_to_run)
+            else:
+                results = (self.try_process_single_date(d) for d in dates_to_run)
+            date_results = zip(dates_to_run, results)
+        for date_string, succeeded in date_results:
+            # output may have been written by worker processes, or
+            # without going through save_image/save_json
+            self.invalidate_listing(
+                self.join_path(self.output_location, date_string),
+                self.output_location_type,
+            )
+            if succeeded:
+                self.run_status["succeeded"] += 1
+                self.record_output(
+                    self.join_path(
+                        self.output_location,
+                        date_string,
+                        *(self.output_location_subdirs),
+                    ),
                     date_string,
-                    self.check_input_data_exists(date_string),
-                    self.check_output_data_exists(date_string),
                 )
-            )
-
-            if self.check_input_data_exists(
-                date_string
-            ) and not self.check_output_data_exists(date_string):
-                succeeded = self.process_single_date(date_string)
-                if succeeded:
-                    self.run_status["succeeded"] += 1
-                else:
-                    self.run_status["failed"] += 1
+            else:
+                self.run_status["failed"] += 1
         self.is_finished = True
         return self.run_status
 
+    def try_process_single_date(self, date_string):
+        """
+        Call process_single_date, logging any exception and counting that
+        date as failed, so that one bad date doesn't stop the others,
+        whether or not they are processed in worker processes.
+
+        Returns
+        =======
+        bool, whether processing succeeded
+        """
+        try:
+            return self.process_single_date(date_string)
+        except Exception:
+            logger.exception(
+                "{}: error processing date {}".format(self.name, date_string)
+            )
+            return False
+
+    def run_local_streaming(self):
+        """
+        Process dates as the previous Module publishes them to our
+        input_stream, until it is closed.  If n_workers > 1, up to that many
+        dates are processed at once, and no more are taken from the stream
+        until one of them has finished, so the previous Module is held back
+        rather than dates piling up.
+
+        Yields
+        ======
+        tuple (date_string, succeeded) for each date processed.
+        """
+        executor = None
+        if self.n_workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=self.n_workers, initializer=_init_worker, initargs=(self,)
+            )
+        in_flight = set()
+
+        def collect(futures):
+            # log the output from each finished date, in date order
+            for future in sorted(futures, key=lambda f: f.date_string):
+                succeeded, log_records = future.result()
+                for record in log_records:
+                    logger.handle(record)
+                yield future.date_string, succeeded
+
+        try:
+            for date_string in self.input_stream:
+                if self.dates_to_process and date_string not in self.dates_to_process:
+                    continue
+                if not self.needs_processing(date_string):
+                    continue
+                if executor is None:
+                    yield date_string, self.try_process_single_date(date_string)
+                    continue
+                if len(in_flight) >= self.n_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    yield from collect(done)
+                future = executor.submit(_process_date_in_worker, date_string)
+                future.date_string = date_string
+                in_flight.add(future)
+            yield from collect(in_flight)
+        finally:
+            # if we stop early, don't leave the previous Module waiting
+            self.input_stream.stop()
+            if executor is not None:
+                executor.shutdown()
+
+    def run_local_parallel(self, date_strings):
+        """
+        Call process_single_date for each date using a pool of n_workers
+        processes.  Any exception when processing a date is logged, and that
+        date counted as failed.
+
+        Parameters
+        ==========
+        date_strings: list of str, format YYYY-MM-DD
+
+        Returns
+        =======
+        list of bool, whether processing succeeded for each date
+        """
+        n_workers = min(self.n_workers, len(date_strings))
+        logger.info(
+            "{}: processing {} dates with {} workers".format(
+                self.name, len(date_strings), n_workers
+            )
+        )
+        results = []
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(self,)
+        ) as executor:
+            # map returns results in the order of date_strings
+            for succeeded, log_records in executor.map(
+                _process_date_in_worker, date_strings
+            ):
+                for record in log_records:
+                    logger.handle(record)
+                results.append(succeeded)
+        return results
+
     def get_dependent_batch_tasks(self):
         """
         When running in batch, we are likely to depend on tasks submitted by
@@ -271,6 +468,8 @@ class ProcessorModule(BaseModule):
         # reset run_mode so that the batch jobs won't try to generate more batch jobs!
         config["run_mode"] = "local"
         config["input_location_type"] = "azure"
+        # the manifest is only on this machine
+        config["manifest_file"] = ""
         task_dict = {"depends_on": dependencies, "task_id": task_id, "config": config}
         return task_dict
 
@@ -446,6 +645,10 @@ class ImageProcessor(ProcessorModule):
 
     def __init__(self, name=None):
         super().__init__(name)
+        # contents of the tif files for the date being processed
+        self.tif_cache = {}
+        # names of the tif files for the date being processed
+        self.tif_filenames = []
         self.params += [
             ("RGB_bands", [list]),
             ("split_RGB_images", [bool]),
@@ -457,6 +660,8 @@ class ImageProcessor(ProcessorModule):
                 [int],
             ),  # if true the image will be saved as png.
             ("bounds", [list]),
+            ("summary_stats_format", [str]),  # "parquet" or "csv"
+            ("split_array_format", [str]),  # "npy" or "tile_store"
         ]
 
     def set_default_parameters(self):
@@ -477,6 +682,11 @@ class ImageProcessor(ProcessorModule):
             self.sub_image_npix = 32  # 32 x 32 pixels
         if not "save_split_image" in vars(self):
             self.save_split_image = False  # not saving .png files
+        if not "summary_stats_format" in vars(self):
+            self.summary_stats_format = "parquet"
+        if not "split_array_format" in vars(self):
+            # one .npy file per sub-image
+            self.split_array_format = "npy"
 
         # in PROCESSED dir we expect RGB. NDVI, BWNDVI
         self.num_files_per_point = 3
@@ -551,7 +761,7 @@ class ImageProcessor(ProcessorModule):
 
         Parameters:
         ===========
-        image: pillow Image
+        image: pillow Image or numpy array
         date_string: str, format YYYY-MM-DD
         bounds_string: str, format eastings northings
         image_type: str, typically 'RGB' or 'BWNDVI'
@@ -563,50 +773,60 @@ class ImageProcessor(ProcessorModule):
         """
 
         bounds = [float(coord) for coord in bounds_string.split("_")]
-        sub_images = crop_image_npix(image, npix, bounds=bounds)
+        # tiles is a view on the image array, shape (ny, nx, npix, npix[, channels])
+        tiles, tile_coords = crop_array_npix(image, npix, bounds=bounds)
+        y_parts, x_parts = tiles.shape[:2]
 
         output_location = os.path.dirname(
             self.construct_image_savepath(
                 date_string, bounds_string, "SUB_" + image_type
             )
         )
-        for i, sub in enumerate(sub_images):
-            # sub will be a tuple (image, coords) - unpack it here
-            sub_image, sub_coords = sub
-            output_filename = "{:0>6}_{:0>7}_{:0>3}".format(
-                round(sub_coords[0]), round(sub_coords[1]), round(npix * 10)
-            )
-            output_filename += "_{}".format(date_string)
-            output_filename += "_{}".format(image_type)
-            output_filename += f"_sub{i}"
-
-            if self.output_location_type == "local":
-                # function only implemented locally for now.
-
-                if save_summary_stats:
-                    metrics_dict = {}
-                    sub_image_array = np.array(sub_image)
-                    metrics_dict["mean"] = sub_image_array.mean().astype(np.float64)
-                    metrics_dict["stdev"] = sub_image_array.std().astype(np.float64)
-                    metrics_dict["median"] = np.median(sub_image_array).astype(
-                        np.float64
-                    )
-                    metrics_dict["min"] = sub_image_array.min().astype(np.float64)
-                    metrics_dict["max"] = sub_image_array.max().astype(np.float64)
-                    metrics_dict["25pc"] = np.percentile(sub_image_array, 25).astype(
-                        np.float64
-                    )
-                    metrics_dict["75pc"] = np.percentile(sub_image_array, 75).astype(
-                        np.float64
-                    )
+        if self.output_location_type != "local":
+            # function only implemented locally for now.
+            raise NotImplementedError("Array saving is not implemented in Azure")
+        if self.split_array_format not in ["npy", "tile_store"]:
+            raise RuntimeError(
+                "{}: Unknown split_array_format {} - must be 'npy' or 'tile_store'".format(
+                    self.name, self.split_array_format
+                )
+            )
 
-                    self.save_json(
-                        metrics_dict,
-                        output_filename + ".json",
-                        output_location,
-                        self.output_location_type,
-                    )
-                else:
+        if save_summary_stats:
+            # one table with the stats of all the sub-images, rather than
+            # one file per sub-image.
+            self.save_summary_stats_table(
+                tiles, tile_coords, date_string, bounds_string, image_type
+            )
+        save_npy_files = (not save_summary_stats) and self.split_array_format == "npy"
+
+        # loop over columns then rows, to keep the same sub-image numbering
+        # as before.
+        sub_images = []
+        sub_image_keys = []
+        for ix in range(x_parts):
+            for iy in range(y_parts):
+                i = ix * y_parts + iy
+                sub_image = tiles[iy, ix]
+                sub_coords = tile_coords[iy, ix]
+                sub_images.append(sub_image)
+                sub_image_keys.append(
+                    {
+                        "sub": i,
+                        "x": round(sub_coords[0]),
+                        "y": round(sub_coords[1]),
+                    }
+                )
+                if not (save_npy_files or self.save_split_image):
+                    continue
+                output_filename = "{:0>6}_{:0>7}_{:0>3}".format(
+                    round(sub_coords[0]), round(sub_coords[1]), round(npix * 10)
+                )
+                output_filename += "_{}".format(date_string)
+                output_filename += "_{}".format(image_type)
+                output_filename += f"_sub{i}"
+
+                if save_npy_files:
                     save_array(
                         sub_image,
                         output_location,
@@ -614,16 +834,71 @@ class ImageProcessor(ProcessorModule):
                         ".npy",
                         verbose=False,
                     )
-            else:
-                raise NotImplementedError("Array saving is not implemented in Azure")
 
-            if self.save_split_image:
-                output_filename += ".png"
-                self.save_image(
-                    sub_image, output_location, output_filename, verbose=False
-                )
+                if self.save_split_image:
+                    self.save_image(
+                        Image.fromarray(np.ascontiguousarray(sub_image)),
+                        output_location,
+                        output_filename + ".png",
+                        verbose=False,
+                    )
+
+        if (not save_summary_stats) and self.split_array_format == "tile_store":
+            # all sub-images in one memory-mappable file, plus an index
+            save_tile_store(
+                sub_images,
+                sub_image_keys,
+                output_location,
+                "{}_{}_{}_sub_images".format(date_string, bounds_string, image_type),
+            )
         return True
 
+    def save_summary_stats_table(
+        self, tiles, tile_coords, date_string, bounds_string, image_type
+    ):
+        """
+        Calculate summary statistics (mean, stdev, median, min, max, 25th and
+        75th percentiles) for all sub-images in one go, and save them as
+        one table (parquet or csv, depending on self.summary_stats_format)
+        in the SPLIT directory, with one row per sub-image.
+
+        Parameters:
+        ===========
+        tiles: numpy array of sub-images, shape (ny, nx, npix, npix[, channels])
+        tile_coords: numpy array of sub-image coordinates, shape (ny, nx, 2)
+        date_string: str, format YYYY-MM-DD
+        bounds_string: str, format eastings northings
+        image_type: str, typically 'COUNT'
+
+        Returns:
+        ========
+        table: pandas DataFrame, the table that was saved.
+        """
+        y_parts, x_parts = tiles.shape[:2]
+        stats = tile_summary_stats(tiles)
+        ix, iy = np.meshgrid(np.arange(x_parts), np.arange(y_parts))
+        columns = {
+            # same numbering as the sub-image filenames
+            "sub": (ix * y_parts + iy).ravel(),
+            "x": np.round(tile_coords[:, :, 0]).astype(int).ravel(),
+            "y": np.round(tile_coords[:, :, 1]).astype(int).ravel(),
+            "date": date_string,
+        }
+        for stat_name, values in stats.items():
+            columns[stat_name] = values.ravel()
+        table = pd.DataFrame(columns).sort_values(by="sub").reset_index(drop=True)
+
+        output_location = os.path.dirname(
+            self.construct_image_savepath(
+                date_string, bounds_string, "SUB_" + image_type
+            )
+        )
+        output_filename = "{}_{}_{}_summary_stats.{}".format(
+            date_string, bounds_string, image_type, self.summary_stats_format
+        )
+        save_table(table, output_location, output_filename)
+        return table
+
     def process_single_date(self, date_string):
         """
         For a single set of .tif files corresponding to a date range
@@ -680,24 +955,100 @@ class ImageProcessor(ProcessorModule):
         if len(filenames) == 0:
             return True
 
+        # each tif file is read (and downloaded, if on Azure) at most once for
+        # this date, and the arrays are shared between all the steps below.
+        self.tif_cache = {}
+        self.tif_filenames = filenames
+        try:
+            return self.process_tif_files(input_filepath, date_string, bounds_string)
+        finally:
+            self.tif_cache = {}
+            self.tif_filenames = []
+
+    def get_tif(self, filepath):
+        """
+        Return the contents of a tif file in the input location, as given
+        by read_tif, reading it only the first time it is asked for while
+        processing the current date.
+
+        Parameters
+        ==========
+        filepath: str, full path of the tif file in the input location
+
+        Returns
+        =======
+        dict, format {'array': <2D numpy array>, 'bounds': <list>, 'npix': <list>},
+        or as given by read_tif_bands for a multi-band file.
+        """
+        if not filepath in self.tif_cache:
+            local_filepath = self.get_file(filepath, self.input_location_type)
+            if os.path.basename(filepath) == MULTIBAND_TIF_FILENAME:
+                self.tif_cache[filepath] = read_tif_bands(local_filepath)
+            else:
+                self.tif_cache[filepath] = read_tif(local_filepath)
+            if self.input_location_type == "azure":
+                # we have the contents in memory, so don't need the tempfile
+                shutil.rmtree(os.path.dirname(local_filepath), ignore_errors=True)
+        return self.tif_cache[filepath]
+
+    def get_band_tif(self, input_filepath, band):
+        """
+        Return the contents of one band, either from its own tif file, or
+        from the multi-band tif file if the bands were downloaded together.
+
+        Parameters
+        ==========
+        input_filepath: str, the input directory for the current date
+        band: str, band name, e.g. "B4" or "COUNT"
+
+        Returns
+        =======
+        dict, format {'array': <2D numpy array>, 'bounds': <list>, 'npix': <list>}
+        """
+        if MULTIBAND_TIF_FILENAME not in self.tif_filenames:
+            return self.get_tif(
+                self.join_path(input_filepath, "download.{}.tif".format(band))
+            )
+        multiband_tif = self.get_tif(
+            self.join_path(input_filepath, MULTIBAND_TIF_FILENAME)
+        )
+        if band not in multiband_tif["bands"]:
+            raise RuntimeError(
+                "{}: band {} not found in {}".format(
+                    self.name, band, MULTIBAND_TIF_FILENAME
+                )
+            )
+        return {
+            "array": multiband_tif["bands"][band],
+            "bounds": multiband_tif["bounds"],
+            "npix": multiband_tif["npix"],
+        }
+
+    def process_tif_files(self, input_filepath, date_string, bounds_string):
+        """
+        Make and save all the output images for one date from the tif files
+        in input_filepath.  Called by process_single_date, which sets up the
+        cache used by get_tif.
+
+        Returns
+        =======
+        True if everything was processed and saved OK, False otherwise.
+        """
         # extract this to feed into `convert_to_rgb()`
         band_dict = {}
         for icol, col in enumerate("rgb"):
             band = self.RGB_bands[icol]
-            filename = self.get_file(
-                self.join_path(input_filepath, "download.{}.tif".format(band)),
-                self.input_location_type,
-            )
-            band_dict[col] = {"band": band, "filename": filename}
+            filename = self.join_path(input_filepath, "download.{}.tif".format(band))
+            band_dict[col] = {
+                "band": band,
+                "filename": filename,
+                "array": self.get_band_tif(input_filepath, band)["array"],
+            }
 
-        logger.info(filenames)
+        logger.info(list(self.tif_cache.keys()))
 
-        band_tiff = self.get_file(
-            self.join_path(input_filepath, "download.{}.tif".format(band)),
-            self.input_location_type,
-        )
-
-        downloaded_bounds, npix = get_bounds(band_tiff)
+        band_tif = self.get_band_tif(input_filepath, band)
+        downloaded_bounds, npix = band_tif["bounds"], band_tif["npix"]
 
         logger.info("Downloaded bounds {}".format(downloaded_bounds))
         logger.info("Input bounds {}".format(self.bounds))
@@ -706,11 +1057,16 @@ class ImageProcessor(ProcessorModule):
             logger.info("Downloaded bounds are not the same as input")
             return False
 
-        if npix != [
+        expected_npix = [
             (self.bounds[2] - self.bounds[0]) / 10,
             (self.bounds[3] - self.bounds[1]) / 10,
-        ]:
-            logger.info("Tiff file has wrong shape {}, instead of {}".format(npix))
+        ]
+        if npix != expected_npix:
+            logger.info(
+                "Tiff file has wrong shape {}, instead of {}".format(
+                    npix, expected_npix
+                )
+            )
             return False
 
         # save the rgb image
@@ -721,11 +1077,11 @@ class ImageProcessor(ProcessorModule):
 
         if self.ndvi:
             # save the NDVI image
-            ndvi_tif = self.get_file(
-                self.join_path(input_filepath, "download.NDVI.tif"),
-                self.input_location_type,
-            )
-            ndvi_image = scale_tif(ndvi_tif)
+            ndvi_tif = self.get_band_tif(input_filepath, "NDVI")
+            # scale the NDVI band to greyscale once, and use the array both for
+            # the saved image and as input to the thresholding.
+            ndvi_grey = ndvi_to_greyscale(ndvi_tif["array"])
+            ndvi_image = Image.fromarray(ndvi_grey).convert("RGB")
             ndvi_filepath = self.construct_image_savepath(
                 date_string, bounds_string, "NDVI"
             )
@@ -736,7 +1092,7 @@ class ImageProcessor(ProcessorModule):
             )
 
             # preprocess and threshold the NDVI image
-            processed_ndvi = process_and_threshold(ndvi_image)
+            processed_ndvi = process_and_threshold(ndvi_grey)
             ndvi_bw_filepath = self.construct_image_savepath(
                 date_string, bounds_string, "BWNDVI"
             )
@@ -761,12 +1117,9 @@ class ImageProcessor(ProcessorModule):
 
         if self.count:
             # save the COUNT image
-            count_tif = self.get_file(
-                self.join_path(input_filepath, "download.COUNT.tif"),
-                self.input_location_type,
-            )
+            count_array = self.get_band_tif(input_filepath, "COUNT")["array"]
 
-            count_heatmap = create_count_heatmap(count_tif)
+            count_heatmap = create_count_heatmap(count_array)
             count_filepath = self.construct_image_savepath(
                 date_string, bounds_string, "COUNT"
             )
@@ -777,9 +1130,8 @@ class ImageProcessor(ProcessorModule):
             )
 
             # split and save sub-images
-            count_image = Image.fromarray(cv.imread(count_tif, cv.IMREAD_ANYDEPTH))
             self.split_and_save_sub_images(
-                count_image,
+                count_array,
                 date_string,
                 bounds_string,
                 "COUNT",
@@ -829,7 +1181,19 @@ class WeatherImageToJSON(ProcessorModule):
             self.input_location, date_string, *(self.input_location_subdirs)
         )
         for filename in self.list_directory(input_location, self.input_location_type):
-            if filename.endswith(".tif"):
+            if filename == MULTIBAND_TIF_FILENAME:
+                # all the variables are bands of one file
+                multiband_tif = read_tif_bands(
+                    self.get_file(
+                        self.join_path(input_location, filename),
+                        self.input_location_type,
+                    )
+                )
+                for name_variable, variable_array in multiband_tif["bands"].items():
+                    metrics_dict[name_variable] = variable_array.mean().astype(
+                        np.float64
+                    )
+            elif filename.endswith(".tif"):
                 name_variable = (filename.split("."))[1]
                 variable_array = cv.imread(
                     self.get_file(
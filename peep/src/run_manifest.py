@@ -0,0 +1,248 @@
+"""
+A record of the output written by each Module, kept in a SQLite database,
+so that deciding which dates to skip when (re)running a pipeline is a
+lookup rather than a directory listing (which, for Azure output, is a call
+over the network).
+
+Each row is an "artifact" - a directory of output for one date, e.g.
+<output_location>/<date>/RAW for a downloader - with the Module that wrote
+it, the bounds and date, its status, the number of files and a checksum of
+their contents.  Modules add a row once they have finished writing a
+directory, in a single transaction, so a date that was interrupted partway
+through is not marked as done.
+
+The manifest can be rebuilt from an existing output tree with
+peep_rebuild_manifest, e.g. for output written before the manifest was used,
+or by batch tasks, or after files have been removed by hand.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+COMPLETE = "complete"
+
+DATE_REGEX = r"[\d]{4}-[\d]{2}-[\d]{2}"
+BOUNDS_REGEX = r"gee_([-]?[\d]+)_([-]?[\d]+)_([-]?[\d]+)_([-]?[\d]+)_"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    artifact TEXT PRIMARY KEY,
+    module TEXT,
+    bounds TEXT,
+    date TEXT,
+    status TEXT,
+    n_files INTEGER,
+    checksum TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS artifacts_module_date ON artifacts (module, bounds, date);
+"""
+
+_run_manifests = {}
+_run_manifests_lock = threading.Lock()
+
+
+def get_artifact_key(path, location_type="local"):
+    """
+    The key for an output directory: the absolute path for local output,
+    or <container>/<blob path> for Azure.
+    """
+    if location_type == "local":
+        return os.path.abspath(path)
+    return path.strip("/")
+
+
+def get_bounds_string(bounds):
+    """
+    e.g. [532480.0, 174080.0, 542720.0, 184320.0] -> "532480_174080_542720_184320"
+    """
+    return "_".join("{:.0f}".format(b) for b in bounds)
+
+
+def get_directory_checksum(directory):
+    """
+    sha256 of the names and contents of the files in a local directory.
+    """
+    checksum = hashlib.sha256()
+    for filename in sorted(os.listdir(directory)):
+        filepath = os.path.join(directory, filename)
+        if not os.path.isfile(filepath):
+            continue
+        checksum.update(filename.encode("utf-8"))
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class RunManifest:
+    """
+    SQLite database of the artifacts written by Modules.  Can be used from
+    several threads and processes at once - each gets its own connection.
+
+    Parameters
+    ==========
+    path: str, location of the database file, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def connect(self):
+        # sqlite connections can't be shared between threads or processes
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def record(
+        self,
+        artifact,
+        module="",
+        bounds="",
+        date="",
+        n_files=0,
+        checksum=None,
+        status=COMPLETE,
+    ):
+        """
+        Add or replace the row for an artifact.
+        """
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    artifact,
+                    module,
+                    bounds,
+                    date,
+                    status,
+                    n_files,
+                    checksum,
+                    time.time(),
+                ),
+            )
+
+    def get(self, artifact):
+        """
+        Returns
+        =======
+        dict of the row for an artifact, or None if there isn't one.
+        """
+        cursor = self.connect().execute(
+            "SELECT * FROM artifacts WHERE artifact = ?", (artifact,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def is_complete(self, artifact, n_files=None):
+        """
+        Is the artifact complete, with n_files files if given, or at least
+        one file otherwise?
+        """
+        row = self.get(artifact)
+        if row is None or row["status"] != COMPLETE:
+            return False
+        if n_files is None:
+            return row["n_files"] > 0
+        return row["n_files"] == n_files
+
+    def remove(self, artifact):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM artifacts WHERE artifact = ?", (artifact,))
+
+    def count(self, module=None, status=COMPLETE):
+        """
+        Number of artifacts with a given status, for one Module or all.
+        """
+        query = "SELECT COUNT(*) FROM artifacts WHERE status = ?"
+        args = [status]
+        if module is not None:
+            query += " AND module = ?"
+            args.append(module)
+        return self.connect().execute(query, args).fetchone()[0]
+
+    def rebuild(self, output_location, output_location_type="local"):
+        """
+        Replace the contents of the manifest with every dated directory of
+        files found under output_location.  The Module that wrote each one
+        isn't known, so is left blank.
+
+        Returns
+        =======
+        int, the number of artifacts recorded.
+        """
+        directories = {}
+        if output_location_type == "local":
+            for root, dirs, files in os.walk(output_location):
+                if files:
+                    # count entries as list_directory does
+                    directories[root] = len(files) + len(dirs)
+        elif output_location_type == "azure":
+            from peep.src import azure_utils
+
+            container_name = output_location.split("/")[0]
+            for blob_name in azure_utils.list_blob_names_recursive(
+                output_location, container_name
+            ):
+                directory = "/".join([container_name] + blob_name.split("/")[:-1])
+                directories[directory] = directories.get(directory, 0) + 1
+        else:
+            raise RuntimeError("Unknown location_type - must be 'local' or 'azure'")
+
+        rows = []
+        for directory, n_files in directories.items():
+            dates = [
+                part
+                for part in re.split(r"[/\\]", directory)
+                if re.search(DATE_REGEX, part)
+            ]
+            if not dates:
+                continue
+            bounds_match = re.search(BOUNDS_REGEX, directory)
+            rows.append(
+                (
+                    get_artifact_key(directory, output_location_type),
+                    "",
+                    get_bounds_string(int(b) for b in bounds_match.groups())
+                    if bounds_match
+                    else "",
+                    dates[-1],
+                    COMPLETE,
+                    n_files,
+                    get_directory_checksum(directory)
+                    if output_location_type == "local"
+                    else None,
+                    time.time(),
+                )
+            )
+        with self.connect() as connection:
+            connection.execute("DELETE FROM artifacts")
+            connection.executemany(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+
+def get_run_manifest(path):
+    """
+    Return the RunManifest for a database file, shared by all the Modules
+    in this process that use it.
+    """
+    with _run_manifests_lock:
+        if path not in _run_manifests:
+            _run_manifests[path] = RunManifest(path)
+    return _run_manifests[path]
@@ -0,0 +1,191 @@
+"""
+Run tasks that depend on each other concurrently, on a pool of threads.
+
+Each task has two stages: it is SUBMITTED once its run() function has
+returned, and FINISHED once its (optional) wait() function has also returned.
+For a Module running locally these are the same, but a Module running in
+batch mode is SUBMITTED once its batch tasks have been created, and only
+FINISHED when they have all completed.  A task can depend on another one
+reaching either stage.
+
+Tasks are started as soon as everything they depend on has reached the
+required stage - the thread that completes a task starts its dependents,
+so nothing waits by polling, and the total time is that of the longest
+chain of dependencies rather than the sum over all the tasks.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("peep_logger")
+
+SUBMITTED = "submitted"
+FINISHED = "finished"
+
+
+class DAGScheduler:
+    """
+    Parameters
+    ==========
+    max_workers: int, optional, the maximum number of tasks running at once.
+                 By default, as many as there are tasks.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.tasks = {}
+
+    def add_task(self, name, run, depends_on=[], wait=None, skip=None):
+        """
+        Parameters
+        ==========
+        name: str, unique name of the task
+        run: function with no arguments, its return value is kept as the
+             result of the task.
+        depends_on: list of task names, which need to be FINISHED before
+                    this task starts, or (name, stage) tuples with stage
+                    SUBMITTED or FINISHED.
+        wait: function with no arguments, optional, called after run()
+              to wait for the task to be FINISHED.
+        skip: function with no arguments, optional, called instead of run()
+              if the task is not run because something it depends on failed.
+        """
+        if name in self.tasks:
+            raise ValueError("Task {} was added twice".format(name))
+        dependencies = {}
+        for dependency in depends_on:
+            if isinstance(dependency, str):
+                dependency = (dependency, FINISHED)
+            dep_name, stage = dependency
+            if stage not in [SUBMITTED, FINISHED]:
+                raise ValueError("Unknown stage {} for {}".format(stage, dep_name))
+            # waiting for FINISHED covers waiting for SUBMITTED
+            if dependencies.get(dep_name) != FINISHED:
+                dependencies[dep_name] = stage
+        self.tasks[name] = {
+            "run": run,
+            "wait": wait,
+            "skip": skip,
+            "depends_on": dependencies,
+        }
+
+    def check_dependencies(self):
+        """
+        Raise a ValueError if a task depends on an unknown task,
+        or if there is a cycle of dependencies.
+        """
+        for name, task in self.tasks.items():
+            for dep_name in task["depends_on"]:
+                if dep_name not in self.tasks:
+                    raise ValueError(
+                        "Task {} depends on unknown task {}".format(name, dep_name)
+                    )
+        # remove tasks with no remaining dependencies until none are left
+        remaining = {name: set(task["depends_on"]) for name, task in self.tasks.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(
+                    "Cycle in the dependencies of {}".format(sorted(remaining))
+                )
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def run(self):
+        """
+        Run all the tasks, and wait for them to finish.  If a task raises an
+        exception, the tasks that depend on it are not run, but the others
+        carry on.
+
+        Returns
+        =======
+        tuple (results, errors, skipped): dict of task name to the return
+        value of run(), dict of task name to the exception it raised, and
+        list of the names of the tasks that were not run.
+        """
+        self.check_dependencies()
+        results = {}
+        errors = {}
+        skipped = []
+        if not self.tasks:
+            return results, errors, skipped
+        stages_reached = {name: set() for name in self.tasks}
+        pending = set(self.tasks)
+        failed = set()
+        n_running = [0]
+        lock = threading.Lock()
+        all_done = threading.Event()
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_workers or len(self.tasks),
+            thread_name_prefix="scheduler",
+        )
+
+        def start_ready_tasks():
+            # called with the lock held, whenever a task changes stage
+            changed = True
+            while changed:
+                changed = False
+                for name in sorted(pending):
+                    dependencies = self.tasks[name]["depends_on"]
+                    if any(dep_name in failed for dep_name in dependencies):
+                        logger.error(
+                            "Not running {} as something it depends on failed".format(
+                                name
+                            )
+                        )
+                        pending.remove(name)
+                        failed.add(name)
+                        skipped.append(name)
+                        changed = True
+                        skip_task(name)
+                    elif all(
+                        stage in stages_reached[dep_name]
+                        or FINISHED in stages_reached[dep_name]
+                        for dep_name, stage in dependencies.items()
+                    ):
+                        pending.remove(name)
+                        n_running[0] += 1
+                        executor.submit(run_task, name)
+            if not pending and n_running[0] == 0:
+                all_done.set()
+
+        def reach_stage(name, stage):
+            with lock:
+                stages_reached[name].add(stage)
+                start_ready_tasks()
+
+        def skip_task(name):
+            # called with the lock held, so run inline rather than queued
+            # behind tasks that may be waiting for it
+            if self.tasks[name]["skip"]:
+                try:
+                    self.tasks[name]["skip"]()
+                except Exception:
+                    logger.exception("Error skipping {}".format(name))
+
+        def run_task(name):
+            task = self.tasks[name]
+            try:
+                results[name] = task["run"]()
+                reach_stage(name, SUBMITTED)
+                if task["wait"]:
+                    task["wait"]()
+                reach_stage(name, FINISHED)
+            except Exception as e:
+                logger.exception("Error running {}".format(name))
+                errors[name] = e
+                with lock:
+                    failed.add(name)
+            finally:
+                with lock:
+                    n_running[0] -= 1
+                    start_ready_tasks()
+
+        with lock:
+            start_ready_tasks()
+        all_done.wait()
+        executor.shutdown()
+        return results, errors, skipped
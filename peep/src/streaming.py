@@ -0,0 +1,80 @@
+"""
+Hand dates over from one Module to the next as soon as they are ready.
+
+When a Sequence is run in streaming mode, the downloader puts the name of
+each date directory into a DateStream once its files are in place, and the
+processor takes them out and processes them while later dates are still
+downloading.  The stream holds at most `maxsize` dates, so if processing
+falls behind, downloading waits, and the number of downloaded but not yet
+processed dates on disk stays bounded.
+"""
+
+import collections
+import threading
+
+
+class DateStream:
+    """
+    A bounded queue of date strings, closed by the producer when it has no
+    more to give, and iterated over by the consumer.
+
+    Parameters
+    ==========
+    maxsize: int, the maximum number of dates waiting to be consumed.
+    """
+
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.dates = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.stopped = False
+
+    def put(self, date_string):
+        """
+        Add a date, waiting while the stream is full.
+
+        Returns
+        =======
+        bool, False if the consumer has stopped, so the date was dropped.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.stopped or len(self.dates) < self.maxsize
+            )
+            if self.stopped:
+                return False
+            self.dates.append(date_string)
+            self.condition.notify_all()
+            return True
+
+    def close(self):
+        """
+        Called by the producer when there are no more dates.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stop(self):
+        """
+        Called by the consumer when it won't take any more dates, so that
+        the producer doesn't wait for it forever.
+        """
+        with self.condition:
+            self.stopped = True
+            self.dates.clear()
+            self.condition.notify_all()
+
+    def __iter__(self):
+        """
+        Yield dates as they arrive, until the stream is closed and empty.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.dates or self.closed)
+                if not self.dates:
+                    return
+                date_string = self.dates.popleft()
+                self.condition.notify_all()
+            yield date_string
@@ -0,0 +1,73 @@
+"""
+Fixtures shared between test files.
+"""
+
+import functools
+import http.server
+import threading
+import time
+
+import pytest
+
+from peep.src import ee_backend
+from peep.src.fake_ee import FakeEEBackend
+
+
+class FlakyRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Respond with "503 Service Unavailable" to the first server.n_failures
+    requests, then serve files as normal, after waiting server.delay seconds.
+    The largest number of requests handled at once is kept in server.max_active.
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            if self.server.n_failures > 0:
+                self.server.n_failures -= 1
+                self.send_error(503)
+                return
+            self.server.n_active += 1
+            self.server.max_active = max(self.server.max_active, self.server.n_active)
+        try:
+            time.sleep(self.server.delay)
+            super().do_GET()
+        finally:
+            with self.server.lock:
+                self.server.n_active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_dir(tmp_path):
+    """
+    Serve the files in a temporary directory over HTTP, and yield
+    (directory, base URL, server).
+    """
+    serve_dir = tmp_path / "served"
+    serve_dir.mkdir()
+    handler = functools.partial(FlakyRequestHandler, directory=str(serve_dir))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.n_failures = 0
+    server.delay = 0
+    server.n_active = 0
+    server.max_active = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield serve_dir, "http://127.0.0.1:{}".format(server.server_address[1]), server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_ee_backend(monkeypatch):
+    """
+    Use a FakeEEBackend in place of Earth Engine for the duration of a test.
+    """
+    backend = FakeEEBackend()
+    backend.initialize()
+    monkeypatch.setattr(ee_backend, "_ee_backend", backend)
+    yield backend
+    backend.close()
@@ -0,0 +1,154 @@
+"""
+Test the asyncio download engine in async_download.py
+"""
+
+import os
+import threading
+import zipfile
+
+import pytest
+
+from peep.src.async_download import AsyncDownloadEngine
+from peep.src.download_modules import WeatherDownloader
+
+
+def write_zip_fixtures(serve_dir, n_files):
+    """
+    Write zipfiles gee_<i>.zip, each containing a tif and a json file.
+    Return the total size of the zipfiles.
+    """
+    for i in range(n_files):
+        with zipfile.ZipFile(serve_dir / "gee_{}.zip".format(i), "w") as zip_obj:
+            zip_obj.writestr("download_{}.B4.tif".format(i), b"red" * 1000)
+            zip_obj.writestr("download_{}.json".format(i), b"{}")
+    return sum(
+        os.path.getsize(serve_dir / "gee_{}.zip".format(i)) for i in range(n_files)
+    )
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncDownloadEngine(max_concurrent=2)
+    yield engine
+    engine.close()
+
+
+def test_download_and_unzip_all(tmp_path, http_dir, engine):
+    serve_dir, base_url, server = http_dir
+    total_size = write_zip_fixtures(serve_dir, 6)
+    server.delay = 0.1
+    urls = [base_url + "/gee_{}.zip".format(i) for i in range(6)]
+    output_dir = tmp_path / "RAW"
+    download_stats = {}
+    results = engine.run(
+        engine.download_and_unzip_all(
+            urls + [base_url + "/missing.zip"],
+            str(output_dir),
+            [".tif"],
+            download_stats=download_stats,
+            backoff=0,
+        )
+    )
+    assert results[:6] == [
+        [str(output_dir / "download_{}".format(i))] for i in range(6)
+    ]
+    assert isinstance(results[6], RuntimeError)
+    assert sorted(os.listdir(output_dir)) == [
+        "download_{}.B4.tif".format(i) for i in range(6)
+    ]
+    assert download_stats == {"retries": 0, "bytes": total_size}
+    # downloads overlapped, but no more than max_concurrent at once
+    assert server.max_active == 2
+
+
+def test_download_retries(tmp_path, http_dir, engine):
+    serve_dir, base_url, server = http_dir
+    total_size = write_zip_fixtures(serve_dir, 1)
+    server.n_failures = 2
+    download_stats = {}
+    results = engine.run(
+        engine.download_and_unzip_all(
+            [base_url + "/gee_0.zip"],
+            str(tmp_path / "RAW"),
+            download_stats=download_stats,
+            backoff=0,
+        )
+    )
+    assert results == [[str(tmp_path / "RAW" / "download_0")]]
+    assert download_stats == {"retries": 2, "bytes": total_size}
+    server.n_failures = 3
+    with pytest.raises(RuntimeError):
+        engine.run(
+            engine.download_and_unzip(
+                base_url + "/gee_0.zip", str(tmp_path / "RAW"), retries=2, backoff=0
+            )
+        )
+
+
+def test_limit_shared_between_threads(tmp_path, http_dir, engine):
+    serve_dir, base_url, server = http_dir
+    write_zip_fixtures(serve_dir, 8)
+    server.delay = 0.1
+    results = {}
+
+    def download_slice(i):
+        urls = [base_url + "/gee_{}.zip".format(j) for j in range(4 * i, 4 * i + 4)]
+        results[i] = engine.run(
+            engine.download_and_unzip_all(urls, str(tmp_path / "slice_{}".format(i)))
+        )
+
+    threads = [threading.Thread(target=download_slice, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(len(os.listdir(tmp_path / "slice_{}".format(i))) == 8 for i in range(2))
+    assert not any(isinstance(r, Exception) for i in range(2) for r in results[i])
+    assert server.max_active == 2
+
+
+def test_engine_made_in_worker_thread(tmp_path, http_dir):
+    # a thread with no event loop of its own, as when time slices are
+    # downloaded on n_download_threads threads
+    serve_dir, base_url, server = http_dir
+    write_zip_fixtures(serve_dir, 4)
+    engines = []
+    thread = threading.Thread(target=lambda: engines.append(AsyncDownloadEngine(1)))
+    thread.start()
+    thread.join()
+    engine = engines[0]
+    try:
+        results = engine.run(
+            engine.download_and_unzip_all(
+                [base_url + "/gee_{}.zip".format(i) for i in range(4)],
+                str(tmp_path / "RAW"),
+            )
+        )
+    finally:
+        engine.close()
+    assert not any(isinstance(result, Exception) for result in results)
+    assert len(os.listdir(tmp_path / "RAW")) == 8
+
+
+def test_limit_per_caller(tmp_path, http_dir, engine, caplog):
+    serve_dir, base_url, server = http_dir
+    write_zip_fixtures(serve_dir, 4)
+    server.delay = 0.1
+    downloader = WeatherDownloader()
+    limit = engine.get_limit(downloader, 1)
+    assert engine.get_limit(downloader, 1) is limit
+    # another downloader of the same name, e.g. in another pipeline
+    assert engine.get_limit(WeatherDownloader(), 2) is not limit
+    assert engine.get_limit(downloader, 1) is limit
+    results = engine.run(
+        engine.download_and_unzip_all(
+            [base_url + "/gee_{}.zip".format(i) for i in range(4)],
+            str(tmp_path / "RAW"),
+            limit=limit,
+        )
+    )
+    assert not any(isinstance(result, Exception) for result in results)
+    assert server.max_active == 1
+    # more than the engine allows
+    engine.get_limit(downloader, 3)
+    assert "at most 2 downloads" in caplog.text
@@ -0,0 +1,50 @@
+"""
+Test the functions in coordinate_utils.py
+"""
+
+import os
+
+import pytest
+
+from peep.src.coordinate_utils import (
+    get_enclosing_bounds,
+    read_bounds_file,
+    split_bounds,
+)
+
+
+def test_split_bounds():
+    assert split_bounds([0, 0, 100, 50], 100) == [[0, 0, 100, 50]]
+    sub_bounds = split_bounds([1000, 2000, 1250, 2100], 100)
+    assert sub_bounds == [
+        [1000, 2000, 1100, 2100],
+        [1100, 2000, 1200, 2100],
+        [1200, 2000, 1250, 2100],
+    ]
+    sub_bounds = split_bounds([0, 0, 200, 200], 100)
+    assert len(sub_bounds) == 4
+    assert sub_bounds[1] == [100, 0, 200, 100]
+    assert sub_bounds[2] == [0, 100, 100, 200]
+
+
+def test_get_enclosing_bounds():
+    assert get_enclosing_bounds([[0, 10, 100, 50]]) == [0, 10, 100, 50]
+    assert get_enclosing_bounds([[0, 10, 100, 50], [-20, 30, 80, 70]]) == [
+        -20,
+        10,
+        100,
+        70,
+    ]
+
+
+def test_read_bounds_file():
+    pytest.importorskip("geopandas")
+    bounds_file = os.path.join(
+        os.path.dirname(__file__), "..", "testdata", "images_1024.parquet"
+    )
+    land_bounds = read_bounds_file(bounds_file)
+    all_bounds = read_bounds_file(bounds_file, land_only=False)
+    assert len(all_bounds) == 8763
+    assert 0 < len(land_bounds) < len(all_bounds)
+    left, bottom, right, top = land_bounds[0]
+    assert right > left and top > bottom
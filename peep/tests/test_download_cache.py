@@ -0,0 +1,68 @@
+"""
+Test the functions in download_cache.py
+"""
+
+import os
+import time
+
+from peep.src.download_cache import (
+    add_to_cache,
+    copy_from_cache,
+    get_cache_entries,
+    get_cache_key,
+)
+
+
+def write_files(directory, contents):
+    os.makedirs(directory, exist_ok=True)
+    for filename, content in contents.items():
+        with open(os.path.join(directory, filename), "w") as f:
+            f.write(content)
+
+
+def test_cache_key():
+    params = {"collection_name": "COPERNICUS/S2", "bounds": [1, 2, 3, 4]}
+    same_params = {"bounds": [1, 2, 3, 4], "collection_name": "COPERNICUS/S2"}
+    assert get_cache_key(params) == get_cache_key(same_params)
+    assert get_cache_key(params) != get_cache_key(dict(params, scale=20))
+
+
+def test_add_and_copy_from_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    download_dir = str(tmp_path / "download")
+    write_files(download_dir, {"download.B4.tif": "red", "download.json": "{}"})
+    assert not copy_from_cache(cache_dir, "key1", str(tmp_path / "out"))
+    add_to_cache(cache_dir, "key1", download_dir, {"scale": 10})
+    assert copy_from_cache(cache_dir, "key1", str(tmp_path / "out"))
+    assert os.listdir(tmp_path / "out") == ["download.B4.tif"]
+    with open(tmp_path / "out" / "download.B4.tif") as f:
+        assert f.read() == "red"
+
+
+def test_rewriting_output_leaves_cache_alone(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    download_dir = str(tmp_path / "download")
+    write_files(download_dir, {"download.B4.tif": "red"})
+    add_to_cache(cache_dir, "key1", download_dir)
+    assert copy_from_cache(cache_dir, "key1", str(tmp_path / "out"))
+    # e.g. downloading again with replace_existing_files
+    write_files(download_dir, {"download.B4.tif": "partial"})
+    write_files(str(tmp_path / "out"), {"download.B4.tif": "partial"})
+    assert copy_from_cache(cache_dir, "key1", str(tmp_path / "again"))
+    with open(tmp_path / "again" / "download.B4.tif") as f:
+        assert f.read() == "red"
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    for key in ["key1", "key2", "key3"]:
+        download_dir = str(tmp_path / key)
+        write_files(download_dir, {"download.tif": "x" * 100})
+        add_to_cache(cache_dir, key, download_dir)
+        # make sure the entries have different times
+        time.sleep(0.01)
+    # use key1, so key2 is now the least recently used
+    assert copy_from_cache(cache_dir, "key1", str(tmp_path / "out"))
+    write_files(str(tmp_path / "key4"), {"download.tif": "x" * 100})
+    add_to_cache(cache_dir, "key4", str(tmp_path / "key4"), max_size_bytes=250)
+    assert [entry[0] for entry in get_cache_entries(cache_dir)] == ["key1", "key4"]
@@ -9,8 +9,7 @@ if os.name == "posix":
 else:
     TMPDIR = "%TMP%"
 
-if not os.environ.get("CI") == "true":
-    from peep.src.download_modules import ImageDownloader, WeatherDownloader
+from peep.src.download_modules import ImageDownloader, WeatherDownloader
 
 
 @unittest.skipIf(
@@ -163,3 +162,276 @@ def test_weather_downloader_run_era5():
     ]
     assert len(tif_files) == 2  # temp, precipitation
     shutil.rmtree(tif_dir, ignore_errors=True)
+
+
+def test_weather_downloader_threads_same_as_serial(tmp_path):
+    run_statuses = []
+    for n_download_threads in [1, 4]:
+        weather_downloader = WeatherDownloader("ERA5")
+        weather_downloader.collection_name = "ECMWF/ERA5/MONTHLY"
+        weather_downloader.precipitation_band = ["total_precipitation"]
+        weather_downloader.temperature_band = ["mean_2m_air_temperature"]
+        weather_downloader.bounds = [532480.0, 174080.0, 542720.0, 184320.0]
+        weather_downloader.date_range = ["2017-01-01", "2018-01-01"]
+        weather_downloader.time_per_point = "1m"
+        weather_downloader.n_download_threads = n_download_threads
+        weather_downloader.output_location = str(
+            tmp_path / "threads_{}".format(n_download_threads)
+        )
+        weather_downloader.configure()
+        # don't go to GEE - odd months fail and the rest write one file
+        weather_downloader.prep_data = lambda date_range: [date_range[0]]
+
+        def download_data(urls, location, cache_params=None):
+            if int(urls[0][5:7]) % 2 == 1:
+                raise RuntimeError("download failed")
+            os.makedirs(location, exist_ok=True)
+            with open(os.path.join(location, "download.tif"), "w") as f:
+                f.write(urls[0])
+            return True
+
+        weather_downloader.download_data = download_data
+        run_statuses.append(weather_downloader.run())
+    assert run_statuses[0] == run_statuses[1]
+    assert run_statuses[0]["succeeded"] == 6
+    assert run_statuses[0]["failed"] == 6
+    assert sorted(os.listdir(tmp_path / "threads_1")) == sorted(
+        os.listdir(tmp_path / "threads_4")
+    )
+
+
+@unittest.skipIf(
+    os.environ.get("CI") == "true",
+    "Skipping this test in a Continuous Integration environment.",
+)
+def test_get_collection_info():
+    from peep.src.ee_backend import ee
+    from peep.src.gee_interface import get_collection_info
+
+    dataset = ee.ImageCollection("ECMWF/ERA5/MONTHLY").filterDate(
+        "2017-01-01", "2017-03-01"
+    )
+    info = get_collection_info(dataset, dataset.limit(1))
+    assert info["size"] == 2
+    assert info["filtered_size"] == 1
+    assert "total_precipitation" in info["band_names"]
+    empty_info = get_collection_info(dataset.filterDate("1900-01-01", "1900-02-01"))
+    assert empty_info == {"size": 0, "filtered_size": 0, "band_names": []}
+
+
+def test_weather_downloader_uses_download_cache(tmp_path):
+    n_prep_data_calls = []
+    for run in range(2):
+        weather_downloader = WeatherDownloader("ERA5")
+        weather_downloader.collection_name = "ECMWF/ERA5/MONTHLY"
+        weather_downloader.precipitation_band = ["total_precipitation"]
+        weather_downloader.temperature_band = ["mean_2m_air_temperature"]
+        weather_downloader.bounds = [532480.0, 174080.0, 542720.0, 184320.0]
+        weather_downloader.date_range = ["2017-01-01", "2017-03-01"]
+        weather_downloader.time_per_point = "1m"
+        weather_downloader.download_cache_dir = str(tmp_path / "cache")
+        weather_downloader.output_location = str(tmp_path / "run_{}".format(run))
+        weather_downloader.configure()
+        weather_downloader.prep_data = lambda date_range: (
+            n_prep_data_calls.append(date_range) or [date_range[0]]
+        )
+
+        def download_and_unzip_all(urls, output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+            for band in ["temperature", "precipitation"]:
+                with open(os.path.join(output_dir, band + ".tif"), "w") as f:
+                    f.write(urls[0])
+            return True
+
+        weather_downloader.download_and_unzip_all = download_and_unzip_all
+        assert weather_downloader.run()["succeeded"] == 2
+    # the second run got everything from the cache
+    assert len(n_prep_data_calls) == 2
+    tif_path = os.path.join("2017-02-01_2017-03-01", "RAW", "temperature.tif")
+    with open(tmp_path / "run_1" / tif_path) as f:
+        assert f.read() == "2017-02-01"
+
+
+def test_weather_downloader_tiles_large_bounds(tmp_path):
+    import numpy as np
+    import rasterio
+    import rasterio.transform
+
+    from peep.src.image_utils import read_tif
+
+    weather_downloader = WeatherDownloader("ERA5")
+    weather_downloader.collection_name = "ECMWF/ERA5/MONTHLY"
+    weather_downloader.precipitation_band = ["total_precipitation"]
+    weather_downloader.temperature_band = ["mean_2m_air_temperature"]
+    weather_downloader.bounds = [1000.0, 2000.0, 1250.0, 2100.0]
+    weather_downloader.date_range = ["2017-01-01", "2017-02-01"]
+    weather_downloader.time_per_point = "1m"
+    weather_downloader.max_download_npix = 10
+    weather_downloader.output_location = str(tmp_path / "output")
+    weather_downloader.configure()
+    # don't go to GEE - "download" a tif for each piece, with value = its left edge
+    image_list_areas = []
+    weather_downloader.get_region_geometry = lambda bounds: bounds
+    weather_downloader.prep_image_list = lambda date_range, geom: (
+        image_list_areas.append(geom) or ["image"]
+    )
+    weather_downloader.get_download_urls = lambda image_list, geom: [geom]
+
+    def download_and_unzip_all(urls, output_dir):
+        left, bottom, right, top = urls[0]
+        os.makedirs(output_dir, exist_ok=True)
+        with rasterio.open(
+            os.path.join(output_dir, "download.total_precipitation.tif"),
+            "w",
+            driver="GTiff",
+            height=int((top - bottom) / 10),
+            width=int((right - left) / 10),
+            count=1,
+            dtype="float32",
+            crs="EPSG:27700",
+            transform=rasterio.transform.from_origin(left, top, 10, 10),
+        ) as output_file:
+            output_file.write(
+                np.full((output_file.height, output_file.width), left, "float32"), 1
+            )
+        return True
+
+    weather_downloader.download_and_unzip_all = download_and_unzip_all
+    assert weather_downloader.run()["succeeded"] == 1
+    # the Images are prepared once, for the whole area
+    assert image_list_areas == [weather_downloader.bounds]
+    mosaic = read_tif(
+        str(
+            tmp_path
+            / "output"
+            / "2017-01-01_2017-02-01"
+            / "RAW"
+            / "download.total_precipitation.tif"
+        )
+    )
+    assert mosaic["bounds"] == weather_downloader.bounds
+    assert mosaic["npix"] == [25, 10]
+    assert (mosaic["array"][:, :10] == 1000).all()
+    assert (mosaic["array"][:, 20:] == 1200).all()
+
+
+def test_weather_downloader_multi_region(tmp_path, monkeypatch):
+    import peep.src.download_modules
+
+    region_bounds = [
+        [532480, 174080, 542720, 184320],
+        [542720, 174080, 552960, 184320],
+        [532480, 184320, 542720, 194560],
+    ]
+    monkeypatch.setattr(
+        peep.src.download_modules,
+        "read_bounds_file",
+        lambda bounds_file, projection: region_bounds,
+    )
+    prep_image_list_calls = []
+    for run in range(2):
+        weather_downloader = WeatherDownloader("ERA5")
+        weather_downloader.collection_name = "ECMWF/ERA5/MONTHLY"
+        weather_downloader.precipitation_band = ["total_precipitation"]
+        weather_downloader.temperature_band = ["mean_2m_air_temperature"]
+        weather_downloader.bounds = [532480, 174080, 552960, 194560]
+        weather_downloader.bounds_file = "regions.parquet"
+        weather_downloader.date_range = ["2017-01-01", "2017-03-01"]
+        weather_downloader.time_per_point = "1m"
+        weather_downloader.n_download_threads = 2
+        weather_downloader.output_location = str(tmp_path / "output")
+        weather_downloader.configure()
+        # don't go to GEE - the "URL" is the bounds of the region
+        weather_downloader.get_region_geometry = lambda bounds: bounds
+        weather_downloader.prep_image_list = lambda date_range, geom: (
+            prep_image_list_calls.append(geom) or ["image"]
+        )
+        weather_downloader.get_download_urls = lambda image_list, geom: [geom]
+
+        def download_and_unzip_all(urls, output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+            for band in ["temperature", "precipitation"]:
+                with open(os.path.join(output_dir, band + ".tif"), "w") as f:
+                    f.write(str(urls[0]))
+            return True
+
+        weather_downloader.download_and_unzip_all = download_and_unzip_all
+        run_status = weather_downloader.run()
+        assert run_status["succeeded"] == (6 if run == 0 else 0)
+        assert run_status["failed"] == 0
+    # images were prepared once per time slice, for the area around all regions,
+    # and not at all once the files were there
+    assert prep_image_list_calls == [weather_downloader.bounds] * 2
+    for bounds in region_bounds:
+        tif_path = os.path.join(
+            tmp_path,
+            "output",
+            weather_downloader.get_region_dirname(bounds),
+            "2017-02-01_2017-03-01",
+            "RAW",
+            "temperature.tif",
+        )
+        with open(tif_path) as f:
+            assert f.read() == str(bounds)
+
+
+def test_weather_downloader_asyncio_engine(tmp_path, http_dir):
+    import zipfile
+
+    serve_dir, base_url, server = http_dir
+    for band in ["temperature", "precipitation"]:
+        with zipfile.ZipFile(serve_dir / "{}.zip".format(band), "w") as zip_obj:
+            zip_obj.writestr("download.{}.tif".format(band), band)
+    weather_downloader = WeatherDownloader("ERA5")
+    weather_downloader.collection_name = "ECMWF/ERA5/MONTHLY"
+    weather_downloader.precipitation_band = ["total_precipitation"]
+    weather_downloader.temperature_band = ["mean_2m_air_temperature"]
+    weather_downloader.bounds = [532480.0, 174080.0, 542720.0, 184320.0]
+    weather_downloader.date_range = ["2017-01-01", "2017-04-01"]
+    weather_downloader.time_per_point = "1m"
+    weather_downloader.download_engine = "asyncio"
+    weather_downloader.n_download_threads = 3
+    weather_downloader.output_location = str(tmp_path / "output")
+    weather_downloader.configure()
+    # don't go to GEE - download the zipfiles from the local server
+    weather_downloader.prep_data = lambda date_range: [
+        base_url + "/temperature.zip",
+        base_url + "/precipitation.zip",
+    ]
+    assert weather_downloader.run()["succeeded"] == 3
+    tif_dir = tmp_path / "output" / "2017-03-01_2017-04-01" / "RAW"
+    assert sorted(os.listdir(tif_dir)) == [
+        "download.precipitation.tif",
+        "download.temperature.tif",
+    ]
+
+
+def test_image_downloader_fake_backend(tmp_path, fake_ee_backend):
+    from peep.src.image_utils import read_tif
+
+    image_downloader = ImageDownloader("Sentinel2")
+    image_downloader.collection_name = "COPERNICUS/S2"
+    image_downloader.RGB_bands = ["B4", "B3", "B2"]
+    image_downloader.NIR_band = "B8"
+    image_downloader.cloudy_pix_flag = "CLOUDY_PIXEL_PERCENTAGE"
+    image_downloader.bounds = [532480, 174080, 532800, 174400]
+    image_downloader.date_range = ["2019-01-01", "2019-03-01"]
+    image_downloader.time_per_point = "1m"
+    image_downloader.ndvi = True
+    image_downloader.output_location = str(tmp_path / "output")
+    image_downloader.configure()
+    assert image_downloader.run()["succeeded"] == 2
+    tif_dir = tmp_path / "output" / "2019-01-01_2019-02-01" / "RAW"
+    assert sorted(os.listdir(tif_dir)) == [
+        "download.B2.tif",
+        "download.B3.tif",
+        "download.B4.tif",
+        "download.COUNT.tif",
+        "download.NDVI.tif",
+    ]
+    count_tif = read_tif(str(tif_dir / "download.COUNT.tif"))
+    assert count_tif["bounds"] == image_downloader.bounds
+    assert count_tif["npix"] == [32, 32]
+    # one image every 5 days in January
+    assert (count_tif["array"] == 7).all()
+    assert fake_ee_backend.calls["getDownloadURL"] == 2
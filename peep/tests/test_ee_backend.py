@@ -0,0 +1,45 @@
+"""
+Test the lazy Earth Engine backend in ee_backend.py, and the fake backend.
+"""
+
+import subprocess
+import sys
+
+from peep.src import ee_backend
+from peep.src.gee_interface import get_collection_info
+
+
+def test_import_does_not_initialize_earth_engine():
+    # in a fresh interpreter, so that nothing else has used the backend
+    code = (
+        "import peep.src.download_modules, peep.src.ee_backend as b;"
+        "print(b._ee_backend is None)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "True"
+
+
+def test_backend_chosen_from_environment(monkeypatch):
+    monkeypatch.setattr(ee_backend, "_ee_backend", None)
+    monkeypatch.setenv("PEEP_EE_BACKEND", "fake")
+    backend = ee_backend.get_ee_backend()
+    try:
+        assert type(backend).__name__ == "FakeEEBackend"
+        assert ee_backend.ee.ImageCollection("COPERNICUS/S2").name == "COPERNICUS/S2"
+    finally:
+        backend.close()
+
+
+def test_get_collection_info_fake_backend(fake_ee_backend):
+    ee = ee_backend.ee
+    dataset = ee.ImageCollection("ECMWF/ERA5/MONTHLY").filterDate(
+        "2017-01-01", "2017-01-11"
+    )
+    info = get_collection_info(dataset)
+    assert info["size"] == 2
+    assert info["filtered_size"] == 2
+    assert "total_precipitation" in info["band_names"]
+    empty_info = get_collection_info(dataset.filterDate("2017-01-01", "2017-01-01"))
+    assert empty_info == {"size": 0, "filtered_size": 0, "band_names": []}
@@ -0,0 +1,108 @@
+"""
+Test the functions in file_utils.py
+"""
+
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from peep.src.file_utils import (
+    download_and_unzip,
+    download_to_buffer,
+    read_tile,
+    read_tile_store,
+    save_tile_store,
+)
+from peep.src.image_utils import tile_array
+
+
+def test_tile_store(tmp_path):
+    img = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+    tiles = tile_array(img, 2)
+    sub_images = [tiles[iy, ix] for ix in range(3) for iy in range(2)]
+    keys = [{"sub": i, "x": 100 * i, "y": 200} for i in range(6)]
+    index_path = save_tile_store(sub_images, keys, str(tmp_path), "test_sub_images")
+    store, index = read_tile_store(index_path)
+    assert store.shape == (6, 2, 2, 3)
+    assert index["n_tiles"] == 6
+    assert np.array_equal(store[5], img[2:4, 4:6])
+    tile = read_tile(index_path, x=300, y=200)
+    assert np.array_equal(tile, tiles[1, 1])
+    assert np.array_equal(read_tile(index_path, sub=2), img[0:2, 2:4])
+
+
+def test_empty_tile_store(tmp_path):
+    # e.g. an image smaller than one sub-image
+    index_path = save_tile_store([], [], str(tmp_path), "no_sub_images")
+    store, index = read_tile_store(index_path)
+    assert len(store) == 0
+    assert index["n_tiles"] == 0
+    assert index["tiles"] == []
+    tiles = np.zeros((0, 2, 2, 3), dtype=np.uint8)
+    store, index = read_tile_store(
+        save_tile_store(tiles, [], str(tmp_path), "no_rgb_sub_images")
+    )
+    assert store.shape == (0, 2, 2, 3)
+    assert index["tile_shape"] == [2, 2, 3]
+    assert index["dtype"] == "|u1"
+
+
+def test_download_and_unzip(tmp_path, http_dir):
+    serve_dir, base_url, server = http_dir
+    with zipfile.ZipFile(serve_dir / "gee.zip", "w") as zip_obj:
+        zip_obj.writestr("download.B4.tif", b"red" * 1000)
+        zip_obj.writestr("download.B3.tif", b"green")
+        zip_obj.writestr("download.json", b"{}")
+    output_dir = tmp_path / "RAW"
+    tif_filenames = download_and_unzip(base_url + "/gee.zip", str(output_dir), [".tif"])
+    assert tif_filenames == [str(output_dir / "download")]
+    assert sorted(os.listdir(output_dir)) == ["download.B3.tif", "download.B4.tif"]
+    assert (output_dir / "download.B4.tif").read_bytes() == b"red" * 1000
+    with pytest.raises(RuntimeError):
+        download_and_unzip(base_url + "/missing.zip", str(output_dir))
+
+
+def test_download_buffer_opens_as_zipfile(http_dir):
+    serve_dir, base_url, server = http_dir
+    with zipfile.ZipFile(serve_dir / "gee.zip", "w") as zip_obj:
+        zip_obj.writestr("download.B4.tif", b"red" * 1000)
+    # ZipFile needs a seekable file, which SpooledTemporaryFile isn't
+    # before Python 3.11
+    with download_to_buffer(base_url + "/gee.zip") as buffer:
+        assert buffer.seekable()
+        with zipfile.ZipFile(buffer) as zip_obj:
+            assert zip_obj.read("download.B4.tif") == b"red" * 1000
+
+
+def test_download_and_unzip_retries(tmp_path, http_dir):
+    serve_dir, base_url, server = http_dir
+    with zipfile.ZipFile(serve_dir / "gee.zip", "w") as zip_obj:
+        zip_obj.writestr("download.B4.tif", b"red")
+    zip_size = os.path.getsize(serve_dir / "gee.zip")
+    server.n_failures = 2
+    download_stats = {}
+    download_and_unzip(
+        base_url + "/gee.zip",
+        str(tmp_path / "RAW"),
+        backoff=0,
+        download_stats=download_stats,
+    )
+    assert download_stats == {"retries": 2, "bytes": zip_size}
+    # give up after the maximum number of retries
+    server.n_failures = 3
+    with pytest.raises(RuntimeError):
+        download_and_unzip(
+            base_url + "/gee.zip", str(tmp_path / "RAW"), retries=2, backoff=0
+        )
+    # don't retry errors that won't go away
+    download_stats = {}
+    with pytest.raises(RuntimeError):
+        download_and_unzip(
+            base_url + "/missing.zip",
+            str(tmp_path / "RAW"),
+            backoff=0,
+            download_stats=download_stats,
+        )
+    assert download_stats["retries"] == 0
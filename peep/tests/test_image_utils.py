@@ -2,6 +2,10 @@
 Test the functions in subgraph_centrality.py
 """
 
+import pytest
+import rasterio.transform
+from PIL import ImageSequence
+
 from peep.src.image_utils import *
 
 
@@ -96,3 +100,242 @@ def test_adaptive_threshold():
         for j in range(cols):
             is_binary = img[i, j] == 0 or img[i, j] == 255
             assert is_binary
+
+
+def test_combine_tif(tmp_path):
+    band_dict = {}
+    band_vals = {
+        "r": [[0, 100], [200, 399]],
+        "g": [[50, 0], [0, 0]],
+        "b": [[1, 2], [3, 4]],
+    }
+    for col, vals in band_vals.items():
+        filename = str(tmp_path / "download.{}.tif".format(col))
+        cv.imwrite(filename, np.array(vals, dtype=np.uint16))
+        band_dict[col] = {"band": col, "filename": filename}
+    new_img = combine_tif(band_dict)
+    assert new_img.mode == "RGB"
+    assert new_img.size == (2, 2)
+    # all bands are scaled by the overall max (399) + 1, and truncated
+    assert new_img.getpixel((0, 0)) == (0, 31, 0)
+    assert new_img.getpixel((1, 0)) == (63, 0, 1)
+    assert new_img.getpixel((0, 1)) == (127, 0, 1)
+    assert new_img.getpixel((1, 1)) == (254, 0, 2)
+
+    # already-loaded arrays are used in preference to the files
+    for col in band_dict:
+        band_dict[col]["array"] = np.array(band_vals[col], dtype=np.uint16)
+        os.remove(band_dict[col]["filename"])
+    assert np.array_equal(np.array(combine_tif(band_dict)), np.array(new_img))
+
+
+def test_ndvi_to_greyscale():
+    ndvi = np.array([[-1.0, -0.5], [0.0, 1.0]], dtype=np.float32)
+    grey = ndvi_to_greyscale(ndvi)
+    assert grey.dtype == np.uint8
+    assert grey.tolist() == [[0, 63], [127, 255]]
+
+
+def test_scale_tif_from_file(tmp_path):
+    filename = str(tmp_path / "download.NDVI.tif")
+    cv.imwrite(filename, np.array([[-1.0, 0.5], [0.0, 1.0]], dtype=np.float32))
+    new_img = scale_tif(filename)
+    assert new_img.mode == "RGB"
+    assert new_img.getpixel((1, 0)) == (191, 191, 191)
+    assert new_img.getpixel((0, 1)) == (127, 127, 127)
+
+
+def test_process_and_threshold_array():
+    img = (10 * np.random.randn(100, 100) + 255 // 2).astype("uint8")
+    processed = process_and_threshold(img)
+    assert processed.size == (100, 100)
+    assert set(np.unique(np.array(processed))) <= {0, 255}
+
+
+def test_create_count_heatmap():
+    count = np.array([[0, 5], [10, 10]], dtype=np.uint16)
+    heatmap = create_count_heatmap(count)
+    assert heatmap.mode == "RGBA"
+    # min and max values should be at the ends of the viridis colormap
+    assert heatmap.getpixel((0, 0)) == (68, 1, 84, 255)
+    assert heatmap.getpixel((1, 1)) == (253, 231, 36, 255)
+
+
+def test_create_count_heatmap_no_matplotlib():
+    import sys
+
+    create_count_heatmap(np.arange(16, dtype=np.uint16).reshape(4, 4))
+    assert (
+        "matplotlib.pyplot" not in sys.modules
+        or len(sys.modules["matplotlib.pyplot"].get_fignums()) == 0
+    )
+
+
+def test_tile_array_is_view():
+    img = np.arange(6 * 8 * 3, dtype=np.uint8).reshape(6, 8, 3)
+    tiles = tile_array(img, 2)
+    assert tiles.shape == (3, 4, 2, 2, 3)
+    assert np.shares_memory(tiles, img)
+    assert np.array_equal(tiles[1, 2], img[2:4, 4:6])
+    # leftover pixels at the edges are dropped
+    assert tile_array(img[:, :7], 2).shape == (3, 3, 2, 2, 3)
+
+
+def test_crop_array_npix_coords_non_square():
+    # 4 rows, 6 columns of 10m pixels -> 2 x 3 grid of 2x2 pixel tiles
+    img = np.arange(24).reshape(4, 6)
+    bounds = [1000.0, 2000.0, 1060.0, 2040.0]
+    tiles, tile_coords = crop_array_npix(img, 2, bounds=bounds)
+    assert tiles.shape == (2, 3, 2, 2)
+    assert tile_coords.shape == (2, 3, 2)
+    # top-left tile has its bottom left corner one tile below the top
+    assert tuple(tile_coords[0, 0]) == (1000.0, 2020.0)
+    # bottom-right tile
+    assert tuple(tile_coords[1, 2]) == (1040.0, 2000.0)
+    assert np.array_equal(tiles[1, 2], img[2:4, 4:6])
+
+
+def test_crop_image_npix_non_square():
+    img = Image.fromarray(np.arange(24, dtype=np.uint8).reshape(4, 6))
+    bounds = [1000.0, 2000.0, 1060.0, 2040.0]
+    sub_images = crop_image_npix(img, 2, bounds=bounds)
+    assert len(sub_images) == 6
+    # sub-images are ordered by column, then row
+    region, coords = sub_images[-1]
+    assert coords == (1040.0, 2000.0)
+    assert np.array_equal(np.array(region), np.array(img)[2:4, 4:6])
+
+
+def test_tile_summary_stats():
+    count = np.random.randint(0, 20, size=(64, 96)).astype(np.uint16)
+    tiles = tile_array(count, 32)
+    stats = tile_summary_stats(tiles)
+    assert stats["mean"].shape == (2, 3)
+    for iy in range(2):
+        for ix in range(3):
+            tile = count[iy * 32 : (iy + 1) * 32, ix * 32 : (ix + 1) * 32]
+            assert stats["mean"][iy, ix] == tile.mean()
+            assert stats["stdev"][iy, ix] == tile.std()
+            assert stats["median"][iy, ix] == np.median(tile)
+            assert stats["min"][iy, ix] == tile.min()
+            assert stats["max"][iy, ix] == tile.max()
+            assert stats["25pc"][iy, ix] == np.percentile(tile, 25)
+            assert stats["75pc"][iy, ix] == np.percentile(tile, 75)
+
+
+def test_convert_to_bw():
+    arr = np.zeros((4, 6, 3), dtype=np.uint8)
+    arr[:2] = 200
+    img = Image.fromarray(arr)
+    bw = np.array(convert_to_bw(img, 470))
+    assert bw.shape == (4, 6, 3)
+    assert (bw[:2] == 0).all()
+    assert (bw[2:] == 255).all()
+    bw_inv = np.array(convert_to_bw(img, 470, invert=True))
+    assert (bw_inv == 255 - bw).all()
+
+
+def test_invert_binary_image():
+    arr = np.zeros((5, 3, 3), dtype=np.uint8)
+    arr[0, 0] = (255, 255, 255)
+    inverted = np.array(invert_binary_image(Image.fromarray(arr)))
+    assert (inverted[0, 0] == 0).all()
+    assert inverted.sum() == 255 * 3 * (5 * 3 - 1)
+
+
+def test_image_from_array():
+    arr = np.array([[10, 200, 30], [40, 50, 200]], dtype=np.uint8)
+    img = image_from_array(arr)
+    # array rows become image columns
+    assert img.size == (2, 3)
+    pix = img.load()
+    assert pix[0, 0] == (10, 10, 10)
+    assert pix[0, 1] == (0, 200, 200)
+    assert pix[1, 2] == (0, 200, 200)
+
+
+def test_create_gif_from_images(tmp_path):
+    # write frames in non-chronological order, each a different grey level
+    dates = ["2019-03-01", "2018-01-01", "2018-06-01", "2019-01-01"]
+    for date in dates:
+        grey = int(date[:4]) - 2000 + 10 * int(date[5:7])
+        Image.new("RGB", (40, 20), (grey, grey, grey)).save(
+            tmp_path / "RGB_{}.png".format(date)
+        )
+    Image.new("RGB", (40, 20)).save(tmp_path / "NDVI_2017-01-01.png")
+    gif_path = create_gif_from_images(str(tmp_path), "test", "RGB")
+    frames = [
+        np.array(f.convert("RGB")) for f in ImageSequence.Iterator(Image.open(gif_path))
+    ]
+    assert [frame[0, 0, 0] for frame in frames] == [28, 78, 29, 49]
+    gif_path = create_gif_from_images(
+        str(tmp_path), "test", "RGB", downscale_factor=4, frame_stride=2
+    )
+    frames = [
+        np.array(f.convert("RGB")) for f in ImageSequence.Iterator(Image.open(gif_path))
+    ]
+    assert [frame[0, 0, 0] for frame in frames] == [28, 29]
+    assert frames[0].shape[:2] == (5, 10)
+
+
+def write_georeferenced_tif(filename, array, left, top, scale=10, band_names=None):
+    # array can be 2D, or 3D (bands, rows, columns) for a multi-band file
+    bands = array if array.ndim == 3 else array[np.newaxis]
+    with rasterio.open(
+        filename,
+        "w",
+        driver="GTiff",
+        height=bands.shape[1],
+        width=bands.shape[2],
+        count=bands.shape[0],
+        dtype=array.dtype,
+        crs="EPSG:27700",
+        transform=rasterio.transform.from_origin(left, top, scale, scale),
+    ) as output_file:
+        output_file.write(bands)
+        if band_names:
+            output_file.descriptions = band_names
+
+
+def test_mosaic_tifs(tmp_path):
+    # three tiles: bottom left, bottom right (narrower) and top left
+    tiles = [
+        (np.full((4, 5), 1, dtype=np.uint16), 1000, 2040),
+        (np.full((4, 3), 2, dtype=np.uint16), 1050, 2040),
+        (np.full((2, 5), 3, dtype=np.uint16), 1000, 2060),
+    ]
+    filenames = []
+    for i, (array, left, top) in enumerate(tiles):
+        filenames.append(str(tmp_path / "tile_{}.tif".format(i)))
+        write_georeferenced_tif(filenames[-1], array, left, top)
+    output_filename = str(tmp_path / "mosaic.tif")
+    mosaic_tifs(filenames, output_filename)
+    mosaic = read_tif(output_filename)
+    assert mosaic["bounds"] == [1000, 2000, 1080, 2060]
+    assert mosaic["npix"] == [8, 6]
+    assert (mosaic["array"][2:, :5] == 1).all()
+    assert (mosaic["array"][2:, 5:] == 2).all()
+    assert (mosaic["array"][:2, :5] == 3).all()
+
+
+def test_read_tif_bands(tmp_path):
+    bands = np.stack([np.full((4, 5), i, dtype=np.uint16) for i in range(3)])
+    band_names = ("B4", "B3", "COUNT")
+    filenames = [str(tmp_path / "tile_{}.tif".format(i)) for i in range(2)]
+    write_georeferenced_tif(filenames[0], bands, 1000, 2040, band_names=band_names)
+    write_georeferenced_tif(filenames[1], bands, 1050, 2040, band_names=band_names)
+    multiband_tif = read_tif_bands(filenames[0])
+    assert list(multiband_tif["bands"].keys()) == list(band_names)
+    assert (multiband_tif["bands"]["COUNT"] == 2).all()
+    assert multiband_tif["bounds"] == [1000, 2000, 1050, 2040]
+    assert multiband_tif["npix"] == [5, 4]
+    # band names are kept when combining multi-band files
+    output_filename = str(tmp_path / "mosaic.tif")
+    mosaic_tifs(filenames, output_filename)
+    mosaic = read_tif_bands(output_filename)
+    assert list(mosaic["bands"].keys()) == list(band_names)
+    assert mosaic["npix"] == [10, 4]
+    # files without band names can't be read by name
+    write_georeferenced_tif(filenames[0], bands, 1000, 2040)
+    with pytest.raises(RuntimeError):
+        read_tif_bands(filenames[0])
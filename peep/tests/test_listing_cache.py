@@ -0,0 +1,137 @@
+"""
+Test the DirectoryListingCache in listing_cache.py, and its use by Modules.
+"""
+
+import os
+import pickle
+
+from peep.src.download_modules import WeatherDownloader
+from peep.src.listing_cache import DirectoryListingCache
+from peep.src.peep_pipeline import BaseModule, Pipeline, Sequence
+from peep.src.processor_modules import WeatherImageToJSON
+
+
+def test_listing_cached_until_invalidated():
+    cache = DirectoryListingCache()
+    calls = []
+
+    def list_func(path, location_type):
+        calls.append(path)
+        return ["a", "b"]
+
+    assert cache.list_directory("out/2020-01-01", "azure", list_func) == ["a", "b"]
+    listing = cache.list_directory("out/2020-01-01/", "azure", list_func)
+    assert listing == ["a", "b"]
+    # callers can't change the cached listing
+    listing.append("c")
+    assert cache.list_directory("out/2020-01-01", "azure", list_func) == ["a", "b"]
+    assert calls == ["out/2020-01-01"]
+    assert cache.get_stats() == {"hits": 2, "misses": 1, "invalidations": 0}
+    cache.invalidate("out/2020-01-01", "azure")
+    cache.list_directory("out/2020-01-01", "azure", list_func)
+    assert len(calls) == 2
+    cache.clear()
+    assert cache.get_stats() == {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def test_invalidate_parents_and_children_only():
+    cache = DirectoryListingCache()
+    paths = [
+        "out",
+        "out/2020-01-01",
+        "out/2020-01-01/RAW",
+        "out/2020-01-02",
+        "out/2020-01-0",
+    ]
+    for path in paths:
+        cache.list_directory(path, "azure", lambda path, location_type: [])
+    cache.list_directory("out/2020-01-01", "local", lambda path, location_type: [])
+    cache.invalidate("out/2020-01-01", "azure")
+    assert sorted(path for location_type, path in cache.listings) == [
+        os.path.abspath("out/2020-01-01"),
+        "out/2020-01-0",
+        "out/2020-01-02",
+    ]
+
+
+def test_listing_during_write_not_kept():
+    cache = DirectoryListingCache()
+
+    def list_func(path, location_type):
+        # something is written while we are listing
+        cache.invalidate(path, location_type)
+        return ["partial"]
+
+    assert cache.list_directory("out", "azure", list_func) == ["partial"]
+    assert cache.listings == {}
+
+
+def test_pickled_cache_starts_empty():
+    cache = DirectoryListingCache()
+    cache.list_directory("out", "azure", lambda path, location_type: ["a"])
+    copied = pickle.loads(pickle.dumps(cache))
+    assert copied.listings == {}
+    assert copied.get_stats() == {"hits": 0, "misses": 0, "invalidations": 0}
+    copied.invalidate("out", "azure")
+
+
+def test_module_writes_invalidate_listings(tmp_path):
+    module = BaseModule()
+    module.configure()
+    module.output_location = str(tmp_path)
+    module.output_location_type = "local"
+    assert module.list_directory(str(tmp_path), "local") == []
+    assert module.list_directory(str(tmp_path), "local") == []
+    module.save_json({"x": 1}, "data.json", str(tmp_path / "2020-01-01"), "local")
+    assert module.list_directory(str(tmp_path), "local") == ["2020-01-01"]
+    assert module.list_directory(str(tmp_path / "2020-01-01"), "local") == ["data.json"]
+    source_dir = tmp_path / "tmp"
+    source_dir.mkdir()
+    (source_dir / "download.B4.tif").write_bytes(b"")
+    module.copy_to_output_location(
+        str(source_dir), str(tmp_path / "2020-01-01"), [".tif"]
+    )
+    assert sorted(module.list_directory(str(tmp_path / "2020-01-01"), "local")) == [
+        "data.json",
+        "download.B4.tif",
+    ]
+    assert module.listing_cache.get_stats()["hits"] == 1
+
+
+def test_pipeline_modules_share_listing_cache(tmp_path):
+    p = Pipeline("testpipe")
+    p.bounds = [532480.0, 174080.0, 542720.0, 184320.0]
+    p.date_range = ["2001-01-01", "2020-01-01"]
+    p.output_location = str(tmp_path)
+    p.output_location_type = "local"
+    for seq_name in ["veg", "weather"]:
+        s = Sequence(seq_name)
+        s += BaseModule()
+        p += s
+    p.configure()
+    assert p.veg.veg_BaseModule.listing_cache is p.listing_cache
+    assert p.weather.weather_BaseModule.listing_cache is p.listing_cache
+
+
+def test_processor_sees_tiled_download(tmp_path, fake_ee_backend):
+    s = Sequence("ERA5")
+    s.collection_name = "ECMWF/ERA5/MONTHLY"
+    s.precipitation_band = ["total_precipitation"]
+    s.temperature_band = ["mean_2m_air_temperature"]
+    s.time_per_point = "1m"
+    s.bounds = [532480, 174080, 532800, 174400]
+    s.date_range = ["2017-01-01", "2017-02-01"]
+    s.output_location = str(tmp_path / "output")
+    s.output_location_type = "local"
+    s.max_download_npix = 16
+    s += WeatherDownloader()
+    s += WeatherImageToJSON()
+    s.configure()
+    downloader, processor = s.modules
+    s.run()
+    # the RAW directory was listed (and found empty) before the pieces
+    # were combined there
+    raw_dir = str(tmp_path / "output" / "2017-01-01_2017-02-01" / "RAW")
+    assert len(downloader.list_directory(raw_dir, "local")) == 2
+    assert s.run_status[downloader.name]["succeeded"] == 1
+    assert s.run_status[processor.name]["succeeded"] == 1
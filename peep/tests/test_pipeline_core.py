@@ -2,6 +2,9 @@
 Tests of the core functionality of pipelines, sequences, and modules.
 """
 
+import threading
+
+from peep.src import batch_utils
 from peep.src.peep_pipeline import BaseModule, Pipeline, Sequence
 
 
@@ -76,3 +79,77 @@ def test_configure_pipeline():
     p.testseq += BaseModule()
     p.configure()
     assert p.testseq.testseq_BaseModule.is_configured
+
+
+class RecordingModule(BaseModule):
+    """
+    Module that records when it runs, and can wait at a barrier.
+    """
+
+    def __init__(self, name, events, barrier=None):
+        super().__init__(name)
+        self.events = events
+        self.barrier = barrier
+
+    def run(self):
+        self.events.append("start " + self.name)
+        if self.barrier:
+            self.barrier.wait()
+        self.events.append("end " + self.name)
+        self.is_finished = True
+        return self.run_status
+
+
+def test_pipeline_runs_independent_sequences_concurrently(tmp_path):
+    events = []
+    # the two downloaders each wait for the other, so the pipeline only
+    # finishes if the sequences run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    p = Pipeline("testpipe")
+    p.bounds = [532480.0, 174080.0, 542720.0, 184320.0]
+    p.date_range = ["2001-01-01", "2020-01-01"]
+    p.output_location = str(tmp_path)
+    p.output_location_type = "local"
+    for seq_name in ["veg", "weather"]:
+        s = Sequence(seq_name)
+        s += RecordingModule(seq_name + "_download", events, barrier)
+        s += RecordingModule(seq_name + "_process", events)
+        p += s
+    p += Sequence("combine")
+    p.combine.depends_on = ["veg", "weather"]
+    p.combine += RecordingModule("combine_combiner", events)
+    p.configure()
+    p.run()
+    assert events[-2:] == ["start combine_combiner", "end combine_combiner"]
+    for seq_name in ["veg", "weather"]:
+        assert events.index("end {}_download".format(seq_name)) < events.index(
+            "start {}_process".format(seq_name)
+        )
+        assert p.get(seq_name).is_finished
+    assert "combine_combiner" in p.combine.run_status
+
+
+def test_batch_job_ids_and_pool(monkeypatch):
+    calls = []
+    monkeypatch.setattr(batch_utils, "create_job", lambda job_id: calls.append(job_id))
+    monkeypatch.setattr(batch_utils, "delete_job", lambda job_id: calls.append(job_id))
+    monkeypatch.setattr(batch_utils, "delete_pool", lambda: calls.append("pool"))
+    p = Pipeline("london")
+    p += Sequence("Sentinel2")
+    module = BaseModule()
+    module.run_mode = "batch"
+    p.Sentinel2 += module
+    assert p.has_batch_job()
+    p.Sentinel2.create_batch_job_if_needed()
+    first_job_id = p.Sentinel2.batch_job_id
+    # other pipelines may use the same collection at the same time
+    assert first_job_id.startswith("london_Sentinel2_")
+    p.Sentinel2.create_batch_job_if_needed()
+    assert p.Sentinel2.batch_job_id != first_job_id
+    # the pool is left for other pipelines running at the same time
+    p.delete_batch_pool = False
+    p.cleanup()
+    assert calls == [first_job_id] + [p.Sentinel2.batch_job_id] * 2
+    p.delete_batch_pool = True
+    p.cleanup()
+    assert calls[-1] == "pool"
@@ -0,0 +1,130 @@
+"""
+Tests for the processor modules.
+"""
+
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from peep.src import processor_modules
+from peep.src.peep_pipeline import BaseModule, Sequence
+from peep.src.processor_modules import ImageProcessor
+
+
+def test_image_processor_reads_each_tif_once(monkeypatch):
+    files_read = []
+
+    def fake_read_tif(filename):
+        files_read.append(filename)
+        return {"array": np.zeros((2, 2)), "bounds": [0, 0, 20, 20], "npix": [2, 2]}
+
+    monkeypatch.setattr(processor_modules, "read_tif", fake_read_tif)
+    ip = ImageProcessor()
+    ip.set_default_parameters()
+    ip.input_location_type = "local"
+    first = ip.get_tif("RAW/download.B4.tif")
+    assert ip.get_tif("RAW/download.B4.tif") is first
+    ip.get_tif("RAW/download.B3.tif")
+    assert files_read == ["RAW/download.B4.tif", "RAW/download.B3.tif"]
+
+
+def test_image_processor_reads_bands_from_multiband_tif(monkeypatch):
+    files_read = []
+
+    def fake_read_tif_bands(filename):
+        files_read.append(filename)
+        return {
+            "bands": {band: np.full((2, 2), i) for i, band in enumerate(["B4", "B3"])},
+            "bounds": [0, 0, 20, 20],
+            "npix": [2, 2],
+        }
+
+    monkeypatch.setattr(processor_modules, "read_tif_bands", fake_read_tif_bands)
+    ip = ImageProcessor()
+    ip.set_default_parameters()
+    ip.input_location_type = "local"
+    ip.tif_filenames = ["download.tif"]
+    assert (ip.get_band_tif("RAW", "B3")["array"] == 1).all()
+    assert ip.get_band_tif("RAW", "B4")["bounds"] == [0, 0, 20, 20]
+    assert files_read == [os.path.join("RAW", "download.tif")]
+    with pytest.raises(RuntimeError):
+        ip.get_band_tif("RAW", "COUNT")
+
+
+class DateProcessor(processor_modules.ProcessorModule):
+    """
+    Minimal processor that succeeds for even days of the month.
+    """
+
+    def set_default_parameters(self):
+        super().set_default_parameters()
+        self.input_location_subdirs = ["RAW"]
+        self.output_location_subdirs = ["PROCESSED"]
+
+    def process_single_date(self, date_string):
+        processor_modules.logger.info("processing {}".format(date_string))
+        if date_string.endswith("05"):
+            raise RuntimeError("bad date")
+        return int(date_string[-2:]) % 2 == 0
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_run_local(tmp_path, caplog, n_workers):
+    date_strings = ["2020-01-0{}".format(i) for i in range(1, 7)]
+    for date_string in date_strings:
+        raw_dir = tmp_path / "input" / date_string / "RAW"
+        raw_dir.mkdir(parents=True)
+        (raw_dir / "download.B4.tif").write_bytes(b"")
+    dp = DateProcessor("DateProcessor")
+    dp.configure(
+        {
+            "input_location": str(tmp_path / "input"),
+            "output_location": str(tmp_path / "output"),
+            "n_workers": n_workers,
+        }
+    )
+    with caplog.at_level(logging.INFO, logger="peep_logger"):
+        run_status = dp.run()
+    # 02, 04, 06 succeed, 01, 03 fail, 05 raises an exception
+    assert run_status == {"succeeded": 3, "failed": 3, "incomplete": 0}
+    # worker logs are merged in date order
+    processed = [
+        r.getMessage()
+        for r in caplog.records
+        if r.getMessage().startswith("processing ")
+    ]
+    assert processed == ["processing {}".format(d) for d in date_strings]
+    assert any("bad date" in (r.exc_text or "") for r in caplog.records)
+
+
+def test_run_local_parallel_spawn(tmp_path, monkeypatch):
+    # worker processes that start afresh get the module by pickling it,
+    # as part of a configured Sequence
+    monkeypatch.setattr(
+        processor_modules,
+        "ProcessPoolExecutor",
+        functools.partial(
+            ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")
+        ),
+    )
+    for date_string in ["2020-01-02", "2020-01-04"]:
+        raw_dir = tmp_path / "output" / date_string / "RAW"
+        raw_dir.mkdir(parents=True)
+        (raw_dir / "download.B4.tif").write_bytes(b"")
+    s = Sequence("dates")
+    s.bounds = [532480, 174080, 532800, 174400]
+    s.date_range = ["2020-01-01", "2020-01-07"]
+    s.output_location = str(tmp_path / "output")
+    s.output_location_type = "local"
+    s += BaseModule()
+    s += DateProcessor("DateProcessor")
+    s.configure()
+    dp = s.modules[1]
+    dp.n_workers = 2
+    dp.input_location = str(tmp_path / "output")
+    assert dp.run() == {"succeeded": 2, "failed": 0, "incomplete": 0}
@@ -0,0 +1,122 @@
+"""
+Test the RunManifest in run_manifest.py, and its use by the Modules.
+"""
+
+import os
+import threading
+
+from peep.src.download_modules import WeatherDownloader
+from peep.src.peep_pipeline import Sequence
+from peep.src.processor_modules import WeatherImageToJSON
+from peep.src.run_manifest import RunManifest, get_artifact_key
+
+
+def test_record_and_look_up(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+    assert manifest.get("a/2020-01-01/RAW") is None
+    assert not manifest.is_complete("a/2020-01-01/RAW")
+    manifest.record(
+        "a/2020-01-01/RAW",
+        module="ERA5_WeatherDownloader",
+        date="2020-01-01",
+        n_files=2,
+    )
+    row = manifest.get("a/2020-01-01/RAW")
+    assert row["module"] == "ERA5_WeatherDownloader"
+    assert row["status"] == "complete"
+    assert manifest.is_complete("a/2020-01-01/RAW")
+    assert manifest.is_complete("a/2020-01-01/RAW", n_files=2)
+    assert not manifest.is_complete("a/2020-01-01/RAW", n_files=3)
+    manifest.record("a/2020-01-02/RAW", n_files=2, status="failed")
+    assert not manifest.is_complete("a/2020-01-02/RAW")
+    assert manifest.count() == 1
+    assert manifest.count(module="ERA5_WeatherDownloader") == 1
+    manifest.remove("a/2020-01-01/RAW")
+    assert manifest.count() == 0
+
+
+def test_record_from_many_threads(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+
+    def record(i):
+        manifest.record("a/2020-01-{:02d}/RAW".format(i), n_files=1)
+
+    threads = [threading.Thread(target=record, args=(i,)) for i in range(1, 21)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert manifest.count() == 20
+
+
+def test_rebuild_from_output_tree(tmp_path):
+    output_dir = tmp_path / "output" / "gee_532480_0174080_532800_0174400_ERA5"
+    for date_string in ["2017-01-01_2017-02-01", "2017-02-01_2017-03-01"]:
+        raw_dir = output_dir / date_string / "RAW"
+        raw_dir.mkdir(parents=True)
+        (raw_dir / "download.precipitation.tif").write_bytes(b"1")
+        (raw_dir / "download.temperature.tif").write_bytes(b"2")
+    (output_dir / "notes.txt").write_text("not a date")
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+    manifest.record("stale/2000-01-01/RAW", n_files=1)
+    assert manifest.rebuild(str(tmp_path / "output")) == 2
+    assert manifest.get("stale/2000-01-01/RAW") is None
+    row = manifest.get(
+        get_artifact_key(str(output_dir / "2017-02-01_2017-03-01" / "RAW"))
+    )
+    assert row["date"] == "2017-02-01_2017-03-01"
+    assert row["bounds"] == "532480_174080_532800_174400"
+    assert row["n_files"] == 2
+    assert len(row["checksum"]) == 64
+
+
+def make_weather_sequence(output_location, manifest_file):
+    s = Sequence("ERA5")
+    s.collection_name = "ECMWF/ERA5/MONTHLY"
+    s.precipitation_band = ["total_precipitation"]
+    s.temperature_band = ["mean_2m_air_temperature"]
+    s.time_per_point = "1m"
+    s.bounds = [532480, 174080, 532800, 174400]
+    s.date_range = ["2017-01-01", "2017-04-01"]
+    s.output_location = output_location
+    s.output_location_type = "local"
+    s.manifest_file = manifest_file
+    s += WeatherDownloader()
+    s += WeatherImageToJSON()
+    s.configure()
+    return s
+
+
+def test_modules_skip_dates_in_manifest(tmp_path, fake_ee_backend):
+    output_location = str(tmp_path / "output")
+    manifest_file = str(tmp_path / "manifest.sqlite")
+    s = make_weather_sequence(output_location, manifest_file)
+    s.run()
+    # one URL per band per date
+    assert fake_ee_backend.calls["getDownloadURL"] == 6
+    manifest = RunManifest(manifest_file)
+    downloader, processor = s.modules
+    assert manifest.count(module=downloader.name) == 3
+    assert manifest.count(module=processor.name) == 3
+    raw_dir = os.path.join(output_location, "2017-02-01_2017-03-01", "RAW")
+    row = manifest.get(get_artifact_key(raw_dir))
+    assert row["n_files"] == 2
+    assert row["bounds"] == "532480_174080_532800_174400"
+
+    # a rerun finds everything in the manifest, without listing the output
+    s = make_weather_sequence(output_location, manifest_file)
+    downloader, processor = s.modules
+    downloader.list_directory = None
+    assert downloader.run()["succeeded"] == 0
+    assert fake_ee_backend.calls["getDownloadURL"] == 6
+
+    # dates missing from the manifest are downloaded again, and until then
+    # the processor treats their input as missing
+    manifest.remove(get_artifact_key(raw_dir))
+    assert os.listdir(raw_dir)
+    assert not processor.check_input_data_exists("2017-02-01_2017-03-01")
+    s = make_weather_sequence(output_location, manifest_file)
+    downloader, processor = s.modules
+    assert downloader.run()["succeeded"] == 1
+    assert fake_ee_backend.calls["getDownloadURL"] == 8
+    assert processor.check_input_data_exists("2017-02-01_2017-03-01")
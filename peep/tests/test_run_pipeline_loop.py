@@ -0,0 +1,55 @@
+"""
+Test running many pipelines in one process with scripts/run_pipeline_loop.py
+"""
+
+import pandas as pd
+
+from peep.scripts.run_pipeline_loop import run_pipeline
+
+CONFIG = """
+from peep.configs.collections import data_collections
+
+name = "{name}"
+output_location = "{output_location}"
+output_location_type = "local"
+bounds = [532480, 174080, 532800, 174400]
+date_range = ["2017-01-01", "2017-03-01"]
+collections_to_use = ["ERA5"]
+modules_to_use = {{"ERA5": ["WeatherDownloader", "WeatherImageToJSON"]}}
+"""
+
+
+def test_run_pipelines_in_process(tmp_path, fake_ee_backend):
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    for name in ["first", "second"]:
+        (config_dir / "config_{}.py".format(name)).write_text(
+            CONFIG.format(name=name, output_location=tmp_path / name)
+        )
+    # no bounds, so building the pipeline fails
+    (config_dir / "config_third.py").write_text(
+        "\n".join(
+            line for line in CONFIG.splitlines() if not line.startswith("bounds")
+        ).format(name="third", output_location=tmp_path / "third")
+    )
+    (config_dir / "notes.txt").write_text("not a config")
+    summary_file = tmp_path / "summary.csv"
+
+    n_failed = run_pipeline(
+        str(config_dir), n_workers=2, summary_file=str(summary_file)
+    )
+
+    assert n_failed == 1
+    summary = pd.read_csv(summary_file).fillna("")
+    assert [p.split("/")[-1] for p in summary["config_file"]] == [
+        "config_first.py",
+        "config_second.py",
+        "config_third.py",
+    ]
+    assert list(summary["exit_status"]) == [0, 0, 1]
+    # two months downloaded and processed by each of the pipelines that ran
+    assert list(summary["succeeded"]) == [4, 4, 0]
+    assert list(summary["failed"]) == [0, 0, 0]
+    assert not summary["batch"].any()
+    assert "bounds" in summary["error"][2]
+    assert (summary["duration"] >= 0).all()
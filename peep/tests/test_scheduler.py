@@ -0,0 +1,90 @@
+"""
+Test the DAGScheduler in scheduler.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from peep.src.scheduler import SUBMITTED, DAGScheduler
+
+
+def test_independent_tasks_run_concurrently():
+    # each task waits for the other to start, so this only finishes if
+    # they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    scheduler = DAGScheduler()
+    scheduler.add_task("a", run=lambda: barrier.wait() is not None)
+    scheduler.add_task("b", run=lambda: barrier.wait() is not None)
+    results, errors, skipped = scheduler.run()
+    assert results == {"a": True, "b": True}
+    assert errors == {}
+    assert skipped == []
+
+
+def test_dependencies_respected():
+    order = []
+    scheduler = DAGScheduler()
+    scheduler.add_task(
+        "combine", run=lambda: order.append("combine"), depends_on=["veg", "weather"]
+    )
+    scheduler.add_task("veg", run=lambda: time.sleep(0.1) or order.append("veg"))
+    scheduler.add_task("weather", run=lambda: order.append("weather"))
+    scheduler.run()
+    assert order == ["weather", "veg", "combine"]
+
+
+def test_submitted_and_finished_stages():
+    order = []
+    finish = threading.Event()
+
+    def wait():
+        finish.wait(5)
+        order.append("first finished")
+
+    scheduler = DAGScheduler()
+    scheduler.add_task("first", run=lambda: order.append("first submitted"), wait=wait)
+    # starts once "first" is submitted, and lets it finish
+    scheduler.add_task(
+        "second",
+        run=lambda: order.append("second") or finish.set(),
+        depends_on=[("first", SUBMITTED)],
+    )
+    scheduler.add_task("third", run=lambda: order.append("third"), depends_on=["first"])
+    scheduler.run()
+    assert order == ["first submitted", "second", "first finished", "third"]
+
+
+def test_failure_skips_dependents():
+    def fail():
+        raise RuntimeError("download failed")
+
+    skip_calls = []
+    scheduler = DAGScheduler(max_workers=1)
+    scheduler.add_task("download", run=fail)
+    scheduler.add_task(
+        "process",
+        run=lambda: True,
+        depends_on=["download"],
+        skip=lambda: skip_calls.append("process"),
+    )
+    scheduler.add_task("combine", run=lambda: True, depends_on=["process"])
+    scheduler.add_task("weather", run=lambda: True)
+    results, errors, skipped = scheduler.run()
+    assert results == {"weather": True}
+    assert list(errors) == ["download"]
+    assert sorted(skipped) == ["combine", "process"]
+    assert skip_calls == ["process"]
+
+
+def test_bad_dependencies():
+    scheduler = DAGScheduler()
+    scheduler.add_task("a", run=lambda: True, depends_on=["b"])
+    scheduler.add_task("b", run=lambda: True, depends_on=["a"])
+    with pytest.raises(ValueError):
+        scheduler.run()
+    scheduler = DAGScheduler()
+    scheduler.add_task("a", run=lambda: True, depends_on=["missing"])
+    with pytest.raises(ValueError):
+        scheduler.run()
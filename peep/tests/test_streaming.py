@@ -0,0 +1,146 @@
+"""
+Test the DateStream in streaming.py, and streaming Sequences.
+"""
+
+import json
+import threading
+
+import pytest
+
+from peep.src.download_modules import WeatherDownloader
+from peep.src.peep_pipeline import Sequence
+from peep.src.processor_modules import WeatherImageToJSON
+from peep.src.streaming import DateStream
+
+
+def test_date_stream_yields_dates_until_closed():
+    stream = DateStream(maxsize=2)
+
+    def produce():
+        for date_string in ["2020-01-01", "2020-01-02", "2020-01-03"]:
+            stream.put(date_string)
+        stream.close()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    assert list(stream) == ["2020-01-01", "2020-01-02", "2020-01-03"]
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+
+
+def test_date_stream_put_waits_while_full():
+    stream = DateStream(maxsize=1)
+    assert stream.put("2020-01-01")
+    producer = threading.Thread(target=stream.put, args=("2020-01-02",))
+    producer.start()
+    producer.join(timeout=0.2)
+    # blocked until the consumer takes a date
+    assert producer.is_alive()
+    dates = iter(stream)
+    assert next(dates) == "2020-01-01"
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    stream.close()
+    assert list(dates) == ["2020-01-02"]
+
+
+def test_date_stream_stop_releases_producer():
+    stream = DateStream(maxsize=1)
+    stream.put("2020-01-01")
+    results = []
+    producer = threading.Thread(target=lambda: results.append(stream.put("2020-01-02")))
+    producer.start()
+    stream.stop()
+    producer.join(timeout=5)
+    assert results == [False]
+    # dates put after stopping are dropped
+    assert not stream.put("2020-01-03")
+    stream.close()
+    assert list(stream) == []
+
+
+def make_weather_sequence(output_location, streaming):
+    s = Sequence("ERA5")
+    s.collection_name = "ECMWF/ERA5/MONTHLY"
+    s.precipitation_band = ["total_precipitation"]
+    s.temperature_band = ["mean_2m_air_temperature"]
+    s.time_per_point = "1m"
+    s.bounds = [532480, 174080, 532800, 174400]
+    s.date_range = ["2017-01-01", "2017-05-01"]
+    s.output_location = output_location
+    s.output_location_type = "local"
+    s.streaming = streaming
+    s.stream_queue_size = 1
+    s += WeatherDownloader()
+    s += WeatherImageToJSON()
+    s.configure()
+    return s
+
+
+def test_streaming_sequence_overlaps_download_and_processing(tmp_path, fake_ee_backend):
+    events = []
+    s = make_weather_sequence(str(tmp_path / "output"), streaming=True)
+    downloader, processor = s.modules
+    assert downloader.output_stream is processor.input_stream is not None
+
+    download_time_slice = downloader.download_time_slice
+    process_single_date = processor.process_single_date
+    downloader.download_time_slice = lambda date_range: (
+        events.append("download " + date_range[0]) or download_time_slice(date_range)
+    )
+    processor.process_single_date = lambda date_string: (
+        events.append("process " + date_string[:10]) or process_single_date(date_string)
+    )
+    s.run()
+
+    assert s.run_status[downloader.name]["succeeded"] == 4
+    assert s.run_status[processor.name]["succeeded"] == 4
+    assert s.is_finished
+    # the first month is processed before the last one is downloaded
+    assert events.index("process 2017-01-01") < events.index("download 2017-04-01")
+    weather_json = (
+        tmp_path
+        / "output"
+        / "2017-04-01_2017-05-01"
+        / "JSON"
+        / "WEATHER"
+        / "weather_data.json"
+    )
+    assert set(json.load(open(weather_json))) == {
+        "total_precipitation",
+        "mean_2m_air_temperature",
+    }
+
+
+def test_streaming_sequence_returns_when_processor_fails(tmp_path, fake_ee_backend):
+    s = make_weather_sequence(str(tmp_path / "output"), streaming=True)
+    downloader, processor = s.modules
+
+    def fail():
+        raise RuntimeError("can't prepare")
+
+    processor.prepare_for_run = fail
+    errors = []
+
+    def run():
+        with pytest.raises(RuntimeError) as excinfo:
+            s.run()
+        errors.append(excinfo.value)
+
+    # the downloader carries on past stream_queue_size dates, rather than
+    # waiting forever for the processor to take them
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive()
+    assert processor.name in str(errors[0])
+    assert s.run_status[downloader.name]["succeeded"] == 4
+    assert downloader.output_stream.stopped
+
+
+def test_sequence_not_streaming():
+    s = make_weather_sequence("output", streaming=False)
+    assert all(
+        module.input_stream is None and module.output_stream is None
+        for module in s.modules
+    )
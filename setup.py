@@ -20,6 +20,7 @@ setup(
             "peep_run_module=peep.scripts.run_peep_module:main",
             "peep_generate_config=peep.scripts.generate_config_file:main",
             "peep_run_pipeline_loop=peep.scripts.run_pipeline_loop:main",
+            "peep_rebuild_manifest=peep.scripts.rebuild_run_manifest:main",
         ]
     },
 )